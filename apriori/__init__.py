@@ -0,0 +1,13 @@
+from .miner import FrequentItemsets
+from .apriori import Apriori
+from .fpgrowth import FPGrowth
+from .sharded import ShardedApriori
+from .incremental import IncrementalApriori
+
+# Algorithms with the same interface: Algorithm(filename, min_support, num_baskets).run()
+ALGORITHMS = {
+    'apriori': Apriori,
+    'fpgrowth': FPGrowth,
+    'sharded': ShardedApriori,
+    'incremental': IncrementalApriori,
+}
@@ -0,0 +1,50 @@
+"""Find frequent itemsets in a transaction file (one space delimited transaction per line):
+
+    $ python -m apriori some_ex.txt --support 0.25 --algorithm fpgrowth
+    $ python -m apriori some_ex.txt --support 0.25 --vertical
+
+Levels of frequent itemsets are printed as soon as they are found.
+"""
+import argparse
+import os
+
+from . import ALGORITHMS
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'some_ex.txt')
+MIN_SUPPORT = 0.25
+NUM_BUSKETS = -1
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m apriori', description='Find frequent itemsets')
+    parser.add_argument('filename', nargs='?', default=FILENAME, help='a transaction file')
+    parser.add_argument('--support', type=float, default=MIN_SUPPORT, help='a minimum support')
+    parser.add_argument('--baskets', type=int, default=NUM_BUSKETS, help='a number of baskets to process (-1: all)')
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='apriori')
+    parser.add_argument('--processes', type=int, help='a number of worker processes of the sharded algorithm')
+    parser.add_argument('--vertical', action='store_true',
+                        help='count supports of the apriori algorithm with transaction id bitsets of items')
+    parser.add_argument('--confidence', type=float, help='print association rules with this minimum confidence')
+    args = parser.parse_args()
+    if args.vertical and args.algorithm != 'apriori':
+        parser.error('--vertical can be used only with --algorithm apriori')
+
+    options = {'apriori': {'vertical': args.vertical},
+               'sharded': {'processes': args.processes}}.get(args.algorithm, {})
+    miner = ALGORITHMS[args.algorithm](args.filename, args.support, args.baskets, **options)
+    print(f'{args.algorithm}:', args.filename, "Support:", args.support, "Baskets:", args.baskets)
+    print("Frequent Items:")
+    for k, lk in enumerate(miner.levels(), 1):
+        if k > 1:
+            for itemset in lk:
+                print(sorted(itemset))
+
+    if args.confidence is not None:
+        print("Association Rules:")
+        for antecedent, consequent, support, confidence, lift in miner.association_rules(args.confidence):
+            print(f'{sorted(antecedent)} -> {sorted(consequent)} '
+                  f'support {support:.3f} confidence {confidence:.3f} lift {lift:.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,117 @@
-from itertools import islice
+from collections import defaultdict
 
-FILENAME = 'some_ex.txt'
-MIN_SUPPORT = 0.25
-NUM_BUSKETS = -1
+from .miner import FrequentItemsets
 
 
-class Apriori:
-    def __init__(self, filename, min_support, num_baskets):
-        self.transactions = self.__parse_transactions(filename, num_baskets)
-        self.numTransactions = len(self.transactions)
-        self.minSupport = min_support
-        self.frequentItems = []
-        self.results = []
-        self.frequentItemsSupport = []
+def _popcount(bitset):
+    return bin(bitset).count('1')
 
-    @staticmethod
-    def __parse_transactions(filename, num_baskets):
+
+# int.bit_count is available since Python 3.10
+popcount = getattr(int, 'bit_count', _popcount)
+
+
+def create_ck(lk, k):
+    """
+    Creates Ck candidate k-tuples.
+    (k-1)-tuples are sorted, so only the ones with the same first k-2 items are joined (they are adjacent),
+    and a candidate is kept only if all its (k-1)-subsets are frequent
+    """
+    itemsets = sorted(tuple(sorted(itemset)) for itemset in lk)
+    frequent = set(itemsets)
+    ck = set()
+    for i, a in enumerate(itemsets):
+        for b in itemsets[i + 1:]:
+            if a[:-1] != b[:-1]:
+                break
+            candidate = a + b[-1:]
+            # Subsets without one of the last two items are a and b
+            if all(candidate[:j] + candidate[j + 1:] in frequent for j in range(k - 2)):
+                ck.add(frozenset(candidate))
+    return ck
+
+
+class Apriori(FrequentItemsets):
+    def __init__(self, filename, min_support, num_baskets, vertical=False):
         """
-        Imports transactions from file into dataset.
-        Preconditions:
-            filename - filename of input transaction file (space delimited)
-            numBaskets - Number of baskets to process
-        Post-conditions:
-            dataset - list of transaction sets
+        vertical - count supports with transaction id bitsets of items instead of scanning transactions
         """
-        transactions = []
-        if num_baskets == -1:
-            with open(filename, 'r') as file:
-                for line in file:
-                    transactions.append(map(str.strip, line.split()))
-        else:
-            with open(filename) as file:
-                for line in islice(file, num_baskets):
-                    transactions.append(map(str.strip, line.split()))
-        return list(map(set, transactions))
+        super().__init__(filename, min_support, num_baskets)
+        self.vertical = vertical
+        self.__itemBitsets = {}
+        self.__levelBitsets = {}
 
     def __create_c1(self):
         """
         Creates C1 candidate k-tuples (All items).
         """
-        c1 = []
+        items = set()
         for transaction in self.transactions:
+            items.update(transaction)
+        return [frozenset([item]) for item in sorted(items)]
+
+    def __create_bitsets(self):
+        """
+        Creates a bitset of every item: bit i is set if the item is in transaction i.
+        Post-conditions:
+            itemBitsets - {item: bitset}
+        """
+        transaction_ids = defaultdict(list)
+        for transaction_id, transaction in enumerate(self.transactions):
             for item in transaction:
-                if [item] not in c1:
-                    c1.append([item])
-        c1.sort()
-        return list(map(frozenset, c1))
+                transaction_ids[item].append(transaction_id)
+
+        # Bits are set in a bytearray, a growing int would be copied on every change
+        size = (self.numTransactions + 7) // 8
+        for item, item_transaction_ids in transaction_ids.items():
+            bits = bytearray(size)
+            for transaction_id in item_transaction_ids:
+                bits[transaction_id >> 3] |= 1 << (transaction_id & 7)
+            self.__itemBitsets[item] = int.from_bytes(bits, 'little')
+        self.__levelBitsets = {frozenset([item]): bitset for item, bitset in self.__itemBitsets.items()}
+
+    def __get_bitset(self, candidate):
+        """
+        Get the bitset of transactions which contain all the items of a candidate.
+        Two frequent (k-1)-subsets of a candidate cover all its items, so their bitsets are enough
+        """
+        bitset = self.__levelBitsets.get(candidate)
+        if bitset is not None:
+            return bitset
+
+        subset_bitsets = []
+        for item in candidate:
+            subset_bitset = self.__levelBitsets.get(candidate - {item})
+            if subset_bitset is not None:
+                subset_bitsets.append(subset_bitset)
+                if len(subset_bitsets) == 2:
+                    return subset_bitsets[0] & subset_bitsets[1]
+
+        bitset = (1 << self.numTransactions) - 1
+        for item in candidate:
+            bitset &= self.__itemBitsets.get(item, 0)
+        return bitset
+
+    def __filter_ck_vertical(self, ck):
+        """
+        The same as filter_ck, but supports are counted as numbers of bits in the bitsets of candidates.
+        Bitsets of the frequent k-tuples are kept to count the next level
+        """
+        lk_supports = {}
+        lk = []
+        level_bitsets = {}
+        for candidate in ck:
+            bitset = self.__get_bitset(candidate)
+            count = popcount(bitset)
+            if not count:
+                continue
+            support = count/float(self.numTransactions)
+            if support >= self.minSupport:
+                lk.append(candidate)
+                level_bitsets[candidate] = bitset
+            lk_supports[candidate] = support
+        self.__levelBitsets = level_bitsets
+        return lk, lk_supports
 
     def __filter_ck(self, ck):
         """
@@ -74,33 +140,25 @@ class Apriori:
             lk_supports[key] = support
         return lk, lk_supports
 
-    @staticmethod
-    def __create_ck(lk, k):
-        """
-        Creates Ck candidate k-tuples.
-        """
-        ck = set()
-        for a in lk:
-            for b in lk:
-                union = a | b
-                if len(union) == k and a != b:
-                    ck.add(union)
-        return ck
-
     def run(self):
         """
         Run Apriori Algorithm
         """
+        filter_ck = self.__filter_ck
+        if self.vertical:
+            self.__create_bitsets()
+            filter_ck = self.__filter_ck_vertical
+
         c1 = self.__create_c1()
-        l1, supports = self.__filter_ck(c1)
+        l1, supports = filter_ck(c1)
 
         self.frequentItems.append(l1)
         self.frequentItemsSupport = supports
         k = 2  # Second pass
         while len(self.frequentItems[k-2]) > 0:
-            ck = self.__create_ck(self.frequentItems[k-2], k)
+            ck = create_ck(self.frequentItems[k-2], k)
             if ck != set([]):
-                lk, support_k = self.__filter_ck(ck)
+                lk, support_k = filter_ck(ck)
                 self.frequentItemsSupport.update(support_k)
                 self.frequentItems.append(lk)
                 self.results.append([list(x) for x in lk])
@@ -108,19 +166,3 @@ class Apriori:
                 break
             k += 1
         return
-
-    def print_results(self):
-        """
-        Print Frequent Items starting with largest sets first.
-        """
-        print("Frequent Items:")
-        for sets in self.results:
-            for item in sets:
-                print(item)
-
-
-if __name__ == '__main__':
-    apriori = Apriori(FILENAME, MIN_SUPPORT, NUM_BUSKETS)
-    print("Apriori:", FILENAME, "Support:", MIN_SUPPORT, "Baskets:", NUM_BUSKETS)
-    apriori.run()
-    apriori.print_results()
@@ -0,0 +1,113 @@
+from collections import Counter, defaultdict
+
+from .miner import FrequentItemsets
+
+
+class _FPNode:
+    __slots__ = ('item', 'count', 'parent', 'children')
+
+    def __init__(self, item, parent):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children = {}
+
+
+class _FPTree:
+    """
+    A prefix tree of transactions with items in the same (global) order.
+    Nodes of every item are linked in the header table
+    """
+
+    def __init__(self):
+        self.root = _FPNode(None, None)
+        self.header = defaultdict(list)  # item: nodes
+
+    def add(self, items, count):
+        node = self.root
+        for item in items:
+            child = node.children.get(item)
+            if child is None:
+                child = node.children[item] = _FPNode(item, node)
+                self.header[item].append(child)
+            child.count += count
+            node = child
+
+    def get_prefix_paths(self, item):
+        """
+        Conditional pattern base of an item: paths from the root to its nodes (without them) and their counts
+        """
+        paths = []
+        for node in self.header[item]:
+            path = []
+            parent = node.parent
+            while parent.item is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                path.reverse()
+                paths.append((path, node.count))
+        return paths
+
+
+class FPGrowth(FrequentItemsets):
+    """
+    FP-Growth: transactions are compressed into an FP-tree once, frequent k-tuples are found
+    by recursive mining of conditional trees without generating candidates
+    """
+
+    def __is_frequent(self, count):
+        return count/float(self.numTransactions) >= self.minSupport
+
+    def __mine(self, tree, suffix, counts):
+        """
+        Find all frequent k-tuples which end with the suffix.
+        Preconditions:
+            tree - a (conditional) FP-tree of the suffix
+            counts - {k-tuple: count}, found k-tuples are added here
+        """
+        for item, nodes in list(tree.header.items()):
+            count = sum(node.count for node in nodes)
+            if not self.__is_frequent(count):
+                continue
+            itemset = suffix + (item, )
+            counts[itemset] = count
+
+            paths = tree.get_prefix_paths(item)
+            item_counts = Counter()
+            for path, path_count in paths:
+                for path_item in path:
+                    item_counts[path_item] += path_count
+            conditional_tree = _FPTree()
+            for path, path_count in paths:
+                conditional_tree.add([path_item for path_item in path if self.__is_frequent(item_counts[path_item])],
+                                     path_count)
+            if conditional_tree.header:
+                self.__mine(conditional_tree, itemset, counts)
+
+    def run(self):
+        """
+        Run FP-Growth Algorithm
+        """
+        item_counts = Counter(item for transaction in self.transactions for item in transaction)
+        # The most frequent items are closer to the root, so transactions share more prefixes
+        order = {item: rank for rank, (item, count) in enumerate(
+            sorted(item_counts.items(), key=lambda item_count: (-item_count[1], item_count[0])))
+            if self.__is_frequent(count)}
+
+        tree = _FPTree()
+        for transaction in self.transactions:
+            tree.add(sorted((item for item in transaction if item in order), key=order.get), 1)
+
+        counts = {}
+        self.__mine(tree, (), counts)
+
+        levels = defaultdict(list)
+        for itemset in counts:
+            levels[len(itemset)].append(frozenset(itemset))
+        # The first level is kept even if it is empty, as in Apriori
+        self.frequentItems = [sorted(levels[k], key=sorted) for k in range(1, max(len(levels), 1) + 1)]
+        self.frequentItemsSupport = {frozenset(itemset): count/float(self.numTransactions)
+                                     for itemset, count in counts.items()}
+        self.results = [[sorted(itemset) for itemset in level] for level in self.frequentItems[1:]]
+        return
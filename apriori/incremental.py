@@ -0,0 +1,127 @@
+import json
+import mmap
+import os
+from collections import Counter
+from itertools import combinations
+
+from .apriori import create_ck
+from .miner import FrequentItemsets
+from .sharded import _count_candidates, _count_items, _find_end
+
+STATE_SUFFIX = '.apriori.json'
+
+
+def _find_whole_lines_end(filename, num_baskets):
+    """
+    The same as _find_end, but a line which is still being written (without a newline) is left for the next run.
+    """
+    end = _find_end(filename, num_baskets)
+    if not end:
+        return end
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return data.rfind(b'\n', 0, end) + 1
+
+
+class IncrementalApriori(FrequentItemsets):
+    """
+    Apriori over a growing transaction log. Counts of the frequent k-tuples and of the negative border
+    (counted candidates which are not frequent) are kept in a state file between runs together with
+    the offset of the processed part of the log. A run counts only the appended transactions,
+    the old ones are rescanned only for the candidates which were not counted before and may be frequent now.
+    frequentItemsSupport contains supports of the frequent k-tuples and of the negative border
+    """
+
+    def __init__(self, filename, min_support, num_baskets, state_filename=None):
+        """
+        state_filename - a file of the counts (None: the log filename with STATE_SUFFIX)
+        """
+        # Transactions are streamed from the log, so they are not loaded here
+        self.filename = filename
+        self.minSupport = min_support
+        self.num_baskets = num_baskets
+        self.state_filename = state_filename or filename + STATE_SUFFIX
+        self.numTransactions = 0
+        self.frequentItems = []
+        self.results = []
+        self.frequentItemsSupport = {}
+
+    def __load_state(self, end):
+        """
+        Post-conditions:
+            offset of the processed transactions, their number, {k-tuple: count}
+        """
+        try:
+            with open(self.state_filename) as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return 0, 0, {}
+        if state['offset'] > end:
+            # The log is truncated or rotated, so it is processed from the start
+            return 0, 0, {}
+        return state['offset'], state['transactions'], {frozenset(itemset): count for itemset, count in state['counts']}
+
+    def __save_state(self, offset, counts):
+        state = {
+            'offset': offset,
+            'transactions': self.numTransactions,
+            'counts': sorted([sorted(itemset), count] for itemset, count in counts.items()),
+        }
+        temporary_filename = self.state_filename + '.tmp'
+        with open(temporary_filename, 'w') as state_file:
+            json.dump(state, state_file, separators=(',', ':'))
+        os.replace(temporary_filename, self.state_filename)
+
+    def __is_frequent(self, count):
+        return count/float(self.numTransactions) >= self.minSupport
+
+    def run(self):
+        """
+        Run Apriori Algorithm on the transactions appended since the previous run
+        """
+        end = _find_whole_lines_end(self.filename, self.num_baskets)
+        offset, number_of_old_transactions, old_counts = self.__load_state(end)
+        number_of_new_transactions, item_counts = _count_items(self.filename, offset, end)
+        self.numTransactions = number_of_old_transactions + number_of_new_transactions
+
+        # All items of the old transactions were counted, so an unknown item is a new one
+        new_counts = {frozenset([item]): count for item, count in item_counts.items()}
+        counts = {itemset: old_counts.get(itemset, 0) + new_counts.get(itemset, 0)
+                  for itemset in set(new_counts).union(itemset for itemset in old_counts if len(itemset) == 1)}
+        lk = sorted((itemset for itemset, count in counts.items() if self.__is_frequent(count)), key=sorted)
+        self.frequentItems = [lk]
+
+        k = 2
+        while lk:
+            ck = frozenset(create_ck(lk, k))
+            if not ck:
+                break
+            new_level_counts = _count_candidates(self.filename, offset, end, ck, k) if offset < end else Counter()
+            unknown = []
+            for candidate in ck:
+                if candidate in old_counts:
+                    counts[candidate] = old_counts[candidate] + new_level_counts[candidate]
+                    continue
+                # A candidate was not counted before, because one of its subsets was not frequent in the old
+                # transactions. It can not be in more of them than any subset, so they are rescanned only if
+                # the candidate may be frequent now (and never if it surely is not in them)
+                old_bound = min(counts[subset] - new_counts.get(subset, 0)
+                                for subset in map(frozenset, combinations(candidate, k - 1)))
+                if not old_bound:
+                    counts[candidate] = new_level_counts[candidate]
+                elif self.__is_frequent(old_bound + new_level_counts[candidate]):
+                    unknown.append(candidate)
+            if unknown:
+                unknown_counts = _count_candidates(self.filename, 0, offset, frozenset(unknown), k)
+                for candidate in unknown:
+                    counts[candidate] = unknown_counts[candidate] + new_level_counts[candidate]
+            new_counts = new_level_counts
+
+            lk = sorted((candidate for candidate in ck
+                         if candidate in counts and self.__is_frequent(counts[candidate])), key=sorted)
+            self.frequentItems.append(lk)
+            k += 1
+
+        self.frequentItemsSupport = {itemset: count/float(self.numTransactions) for itemset, count in counts.items()}
+        self.results = [[sorted(itemset) for itemset in lk] for lk in self.frequentItems[1:] if lk]
+        self.__save_state(end, counts)
+        return
@@ -0,0 +1,82 @@
+from itertools import combinations, islice
+
+
+class FrequentItemsets:
+    """
+    A common interface of the frequent itemset mining algorithms.
+    After run():
+        frequentItems - frequent k-tuples (frozensets) of every level k, starting with 1
+        frequentItemsSupport - {frozenset: support} of the frequent k-tuples (Apriori adds the counted infrequent ones)
+        results - frequent k-tuples (lists of items) of every level k, starting with 2
+    """
+
+    def __init__(self, filename, min_support, num_baskets):
+        self.transactions = self.__parse_transactions(filename, num_baskets)
+        self.numTransactions = len(self.transactions)
+        self.minSupport = min_support
+        self.frequentItems = []
+        self.results = []
+        self.frequentItemsSupport = []
+
+    @staticmethod
+    def __parse_transactions(filename, num_baskets):
+        """
+        Imports transactions from file into dataset.
+        Preconditions:
+            filename - filename of input transaction file (space delimited)
+            numBaskets - Number of baskets to process
+        Post-conditions:
+            dataset - list of transaction sets
+        """
+        transactions = []
+        if num_baskets == -1:
+            with open(filename, 'r') as file:
+                for line in file:
+                    transactions.append(map(str.strip, line.split()))
+        else:
+            with open(filename) as file:
+                for line in islice(file, num_baskets):
+                    transactions.append(map(str.strip, line.split()))
+        return list(map(set, transactions))
+
+    def run(self):
+        raise NotImplementedError
+
+    def levels(self):
+        """
+        Run the algorithm and yield frequent k-tuples (frozensets) of every level k, starting with 1
+        """
+        self.run()
+        for lk in self.frequentItems:
+            yield lk
+
+    def association_rules(self, min_confidence):
+        """
+        Derive association rules from the supports of the frequent k-tuples, transactions are not scanned again.
+        Preconditions:
+            min_confidence - minimum confidence threshold
+        Post-conditions:
+            list of (antecedent, consequent, support, confidence, lift) sorted by confidence, the best first
+        """
+        rules = []
+        for lk in self.frequentItems[1:]:
+            for itemset in lk:
+                support = self.frequentItemsSupport[itemset]
+                for size in range(1, len(itemset)):
+                    for antecedent in map(frozenset, combinations(sorted(itemset), size)):
+                        consequent = itemset - antecedent
+                        confidence = support / self.frequentItemsSupport[antecedent]
+                        if confidence >= min_confidence:
+                            lift = confidence / self.frequentItemsSupport[consequent]
+                            rules.append((antecedent, consequent, support, confidence, lift))
+        rules.sort(key=lambda rule: (-rule[3], -rule[4], sorted(rule[0]), sorted(rule[1])))
+        return rules
+
+    def print_results(self):
+        """
+        Print Frequent Items starting with largest sets first.
+        """
+        print("Frequent Items:")
+        for sets in self.results:
+            for item in sets:
+                print(item)
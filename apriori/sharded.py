@@ -0,0 +1,187 @@
+import mmap
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, repeat
+from math import factorial
+
+from .apriori import create_ck
+from .miner import FrequentItemsets
+
+MIN_SHARD_SIZE = 1 << 16  # bytes
+SHARDS_PER_PROCESS = 4
+
+
+def _binomial(n, k):
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+
+def _find_end(filename, num_baskets):
+    """
+    Find the byte offset where the first num_baskets transactions of a file end (-1: all).
+    """
+    size = os.path.getsize(filename)
+    if num_baskets == -1 or not size:
+        return size
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        end = 0
+        for _ in range(num_baskets):
+            newline = data.find(b'\n', end)
+            if newline == -1:
+                return size
+            end = newline + 1
+        return end
+
+
+def _split_shards(filename, end, shard_size):
+    """
+    Split the first end bytes of a file into byte ranges of about shard_size bytes, which end with whole lines.
+    """
+    shards = []
+    if not end:
+        return shards
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < end:
+            newline = data.find(b'\n', min(start + shard_size, end) - 1, end)
+            stop = end if newline == -1 else newline + 1
+            shards.append((start, stop))
+            start = stop
+    return shards
+
+
+def _read_shard(filename, start, stop):
+    """
+    Yield transaction sets of a byte range of a file without reading the whole file into memory.
+    """
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        data.seek(start)
+        while data.tell() < stop:
+            yield set(data.readline().decode().split())
+
+
+def _count_items(filename, start, stop):
+    """
+    Count transactions of a shard and transactions of every item.
+    """
+    number_of_transactions = 0
+    counts = Counter()
+    for transaction in _read_shard(filename, start, stop):
+        number_of_transactions += 1
+        counts.update(transaction)
+    return number_of_transactions, counts
+
+
+def _count_candidates(filename, start, stop, ck, k):
+    """
+    Count transactions of a shard which contain the candidate k-tuples.
+    A transaction is either checked against every candidate or its own k-tuples are looked up in Ck,
+    whichever is fewer
+    """
+    items = frozenset().union(*ck)
+    counts = Counter()
+    for transaction in _read_shard(filename, start, stop):
+        transaction &= items
+        if len(transaction) < k:
+            continue
+        if _binomial(len(transaction), k) < len(ck):
+            for k_tuple in combinations(transaction, k):
+                candidate = frozenset(k_tuple)
+                if candidate in ck:
+                    counts[candidate] += 1
+        else:
+            for candidate in ck:
+                if candidate <= transaction:
+                    counts[candidate] += 1
+    return counts
+
+
+class ShardedApriori(FrequentItemsets):
+    """
+    Apriori over a memory mapped file: transactions are never kept in memory, the file is split into byte range
+    shards and every pass counts supports of the shards in a process pool.
+    frequentItemsSupport contains only the frequent k-tuples
+    """
+
+    def __init__(self, filename, min_support, num_baskets, processes=None, shard_size=None):
+        """
+        processes - a number of worker processes (None: a number of CPUs, 1: count in this process)
+        shard_size - bytes of a shard (None: a few shards per process)
+        """
+        # Transactions are streamed from the file on every pass, so they are not loaded here
+        self.filename = filename
+        self.minSupport = min_support
+        self.processes = processes or os.cpu_count() or 1
+        end = _find_end(filename, num_baskets)
+        if shard_size is None:
+            shard_size = max(end // (self.processes * SHARDS_PER_PROCESS), MIN_SHARD_SIZE)
+        self.shards = _split_shards(filename, end, shard_size)
+        self.numTransactions = 0
+        self.frequentItems = []
+        self.results = []
+        self.frequentItemsSupport = {}
+
+    def __filter(self, counts):
+        lk = []
+        for candidate, count in counts.items():
+            support = count/float(self.numTransactions)
+            if support >= self.minSupport:
+                lk.append(candidate)
+                self.frequentItemsSupport[candidate] = support
+        return sorted(lk, key=sorted)
+
+    def __count(self, map_shards):
+        numbers_of_transactions, item_counts = zip(*map_shards(_count_items)) if self.shards else ((), ())
+        self.numTransactions = sum(numbers_of_transactions)
+        counts = Counter()
+        for shard_counts in item_counts:
+            counts.update(shard_counts)
+        return counts
+
+    def __levels(self, map_shards):
+        self.frequentItems = []
+        counts = {frozenset([item]): count for item, count in self.__count(map_shards).items()}
+        lk = self.__filter(counts)
+        self.frequentItems.append(lk)
+        yield lk
+
+        k = 2
+        while lk:
+            ck = frozenset(create_ck(lk, k))
+            if not ck:
+                break
+            counts = Counter()
+            for shard_counts in map_shards(_count_candidates, ck, k):
+                counts.update(shard_counts)
+            lk = self.__filter(counts)
+            self.frequentItems.append(lk)
+            yield lk
+            k += 1
+
+    def levels(self):
+        """
+        Yield frequent k-tuples (frozensets) of every level k, starting with 1, as soon as the level is counted.
+        Supports of the yielded k-tuples are already in frequentItemsSupport and the yielded levels are appended
+        to frequentItems, so association_rules() works after the levels are consumed
+        """
+        starts, stops = [start for start, _ in self.shards], [stop for _, stop in self.shards]
+        filenames = [self.filename] * len(self.shards)
+
+        if self.processes == 1:
+            def map_shards(function, *arguments):
+                return list(map(function, filenames, starts, stops, *map(repeat, arguments)))
+            yield from self.__levels(map_shards)
+            return
+
+        with ProcessPoolExecutor(self.processes) as executor:
+            def map_shards(function, *arguments):
+                return list(executor.map(function, filenames, starts, stops, *map(repeat, arguments)))
+            yield from self.__levels(map_shards)
+
+    def run(self):
+        """
+        Run Apriori Algorithm
+        """
+        self.frequentItems = list(self.levels())
+        self.results = [[sorted(itemset) for itemset in lk] for lk in self.frequentItems[1:] if lk]
+        return
@@ -0,0 +1,85 @@
+"""Run the benchmarks and write their results in JSON, e.g. to compare two commits:
+
+    $ python -m benchmarks --output before.json
+    $ git checkout other-branch
+    $ python -m benchmarks --output after.json --compare before.json
+
+Only some of the benchmarks can be run: python -m benchmarks expert_engine storage
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from . import expert_engine, frequent_itemsets, storage
+
+BENCHMARKS = {
+    'expert_engine': expert_engine.run,
+    'frequent_itemsets': frequent_itemsets.run,
+    'storage': storage.run,
+}
+
+
+def get_commit() -> str or None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, previous_results: dict) -> list:
+    """Compare the results with the results of a previous run
+
+    :return: lines "benchmark.name: previous -> current (ratio)"
+    """
+    lines = []
+    for benchmark, values in results.items():
+        for name, value in values.items():
+            previous_value = previous_results.get(benchmark, dict()).get(name)
+            if previous_value is None:
+                continue
+            ratio = f'x{value / previous_value:.2f}' if previous_value else '-'
+            lines.append(f'{benchmark}.{name}: {previous_value:.4g} -> {value:.4g} ({ratio})')
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Run the benchmarks and print their results in JSON')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f'benchmarks to run: {", ".join(sorted(BENCHMARKS))} (all of them by default)')
+    parser.add_argument('--repeat', type=int, help='a number of runs of every measurement (the best one is taken)')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--compare', metavar='PREVIOUS_OUTPUT', help='compare the results with a previous output')
+    args = parser.parse_args()
+    unknown_benchmarks = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown_benchmarks:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown_benchmarks))}')
+
+    report = dict(commit=get_commit(), python=platform.python_version(), numpy=np.__version__,
+                  platform=platform.platform(), started_at=time.strftime('%Y-%m-%dT%H:%M:%S'), results=dict())
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print(f'Running {name}...', file=sys.stderr)
+        kwargs = dict(repeat=args.repeat) if args.repeat else dict()
+        report['results'][name] = BENCHMARKS[name](**kwargs)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous_results = json.load(previous_file)['results']
+        print('\n'.join(compare(report['results'], previous_results)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Measure loading of the knowledge bases and the per-answer path of the experts
+
+Run: python -m benchmarks expert_engine
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from bot import QuizSession
+from data import load_data
+from experts import EXPERTS
+from experts.base import UNANSWERED
+from experts.batch import score_answers
+from experts.catalog import Catalog
+from experts.snapshot import read_snapshot, write_snapshot
+from .timing import measure
+
+ANSWERS = ('no', 'probably_no', 'do_not_know', 'probably', 'yes')  # by answer id
+BATCH_SIZE = 1000  # answer vectors
+
+
+def answer_all_questions(expert, initial_state: tuple, rate: int) -> None:
+    """Answer all the questions of the expert with the same answer, starting from the initial state
+    """
+    expert._set_state(initial_state)
+    expert.answers[:] = bytes([UNANSWERED]) * len(expert.answers)
+    for question_number in range(len(expert.questions)):
+        expert.handle_answer(question_number, rate)
+
+
+def run(repeat: int=5) -> dict:
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for expert_class in EXPERTS:
+            name = expert_class.__name__
+            results[f'load_data_ms[{name}]'] = measure(
+                lambda: load_data(expert_class.data_file_name), repeat=repeat) * 1e3
+
+            catalog = expert_class.get_catalog()
+            snapshot_path = os.path.join(directory, f'{expert_class.data_file_name}.kb')
+            write_snapshot(catalog, snapshot_path)
+            results[f'read_snapshot_ms[{name}]'] = measure(
+                lambda: read_snapshot(snapshot_path), number=10, repeat=repeat) * 1e3
+
+            data = load_data(expert_class.data_file_name)
+            results[f'validate_and_build_catalog_ms[{name}]'] = measure(
+                lambda: (expert_class._validate_outcome_dicts(data['outcomes']),
+                         Catalog.from_outcomes(name, data['questions'], data['outcomes'])), repeat=repeat) * 1e3
+
+            results[f'expert_init_us[{name}]'] = measure(expert_class, number=1000, repeat=repeat) * 1e6
+
+    experts = [expert_class() for expert_class in EXPERTS]
+    initial_states = [expert._get_state() for expert in experts]
+    number_of_answers = sum(len(expert.questions) for expert in experts)
+    for rate, answer in enumerate(ANSWERS):
+        def answer_all():
+            for expert, initial_state in zip(experts, initial_states):
+                answer_all_questions(expert, initial_state, rate)
+        results[f'handle_answer_us[{answer}]'] = measure(
+            answer_all, number=100, repeat=repeat) / number_of_answers * 1e6
+
+    results['get_result_us'] = measure(experts[0].get_result, number=10000, repeat=repeat) * 1e6
+
+    # Logged sessions are rescored in batches instead of one expert per session
+    expert_class = EXPERTS[0]
+    answers = np.random.RandomState(0).randint(0, len(ANSWERS), size=(BATCH_SIZE, len(experts[0].questions)))
+    expert_class.posterior_cache = None
+    try:
+        def score_one_by_one():
+            for answer_vector in answers.astype(np.uint8):
+                expert = expert_class()
+                expert.handle_answers(bytes(answer_vector))
+                expert.get_ranking()
+        results['score_answers_us[one_by_one]'] = measure(score_one_by_one, repeat=repeat) / BATCH_SIZE * 1e6
+    finally:
+        del expert_class.posterior_cache
+    results['score_answers_us[batch]'] = measure(
+        lambda: score_answers(expert_class, answers), repeat=repeat) / BATCH_SIZE * 1e6
+
+    # A bot session rebuilds its expert from the answers on every message
+    session = QuizSession.start(EXPERTS[0], 0)
+    while not session.is_finished:
+        session.answer(session.current_step % 5)
+    EXPERTS[0].posterior_cache = None
+    try:
+        results['build_expert_us[uncached]'] = measure(session.build_expert, number=100, repeat=repeat) * 1e6
+    finally:
+        del EXPERTS[0].posterior_cache
+    session.build_expert()
+    results['build_expert_us[cached]'] = measure(session.build_expert, number=100, repeat=repeat) * 1e6
+    return results
@@ -0,0 +1,146 @@
+"""Measure Apriori and FP-Growth on synthetic transaction files of growing size with several support thresholds.
+Results of all the algorithms are cross-checked. The incremental Apriori is measured on the update
+after the last APPENDED_SHARE of the transactions is appended to its log
+
+Run: python -m benchmarks frequent_itemsets
+"""
+import os
+import random
+import tempfile
+import time
+
+from apriori import Apriori, FPGrowth, IncrementalApriori, ShardedApriori
+from apriori.apriori import create_ck
+
+NUMBER_OF_TRANSACTIONS = (1000, 5000, 20000)
+MIN_SUPPORTS = (0.2, 0.05, 0.02)
+NUMBER_OF_ITEMS = 50
+APPENDED_SHARE = 0.05  # of the transactions, which are appended to the log of the incremental Apriori
+
+
+def write_transactions(path: str, number_of_transactions: int,
+                       number_of_items: int=NUMBER_OF_ITEMS, seed: int=0) -> None:
+    """Write a space delimited transaction file. Items are popular in different degrees
+    (the probability of an item is proportional to 1 / rank), baskets have 2-10 items
+
+    :param path: a path of the file
+    :param number_of_transactions: a number of lines
+    :param number_of_items: a number of different items
+    :param seed: a seed of the random generator, the same seed gives the same file
+    """
+    generator = random.Random(seed)
+    items = [f'item{item_number}' for item_number in range(number_of_items)]
+    weights = [1 / rank for rank in range(1, number_of_items + 1)]
+    with open(path, 'w') as transaction_file:
+        for _ in range(number_of_transactions):
+            basket = generator.choices(items, weights, k=generator.randint(2, 10))
+            transaction_file.write(' '.join(sorted(set(basket))) + '\n')
+
+
+def create_ck_pairwise(lk, k):
+    """The former candidate generation: a union of every pair of (k-1)-tuples without pruning
+    """
+    ck = set()
+    for a in lk:
+        for b in lk:
+            union = a | b
+            if len(union) == k and a != b:
+                ck.add(union)
+    return ck
+
+
+def measure_candidates(frequent_items: list, repeat: int) -> dict:
+    """Generate candidates of every level from the frequent itemsets of the previous one
+
+    :param frequent_items: frequent k-tuples of every level k, starting with 1
+    :return: {generation: (a number of candidates, the best time in seconds)}
+    """
+    results = dict()
+    for name, generate in (('pairwise', create_ck_pairwise), ('prefix_join', create_ck)):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            number_of_candidates = sum(len(generate(lk, k)) for k, lk in enumerate(frequent_items[:-1], 2) if lk)
+            best = min(best, time.perf_counter() - started)
+        results[name] = number_of_candidates, best
+    return results
+
+
+def run_algorithm(algorithm: type, path: str, min_support: float, repeat: int, **options) -> tuple:
+    """Run a frequent itemset mining algorithm several times
+
+    :param algorithm: Apriori or FPGrowth
+    :return: the best time in seconds and the last finished miner
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        miner = algorithm(path, min_support, -1, **options)
+        started = time.perf_counter()
+        miner.run()
+        best = min(best, time.perf_counter() - started)
+    return best, miner
+
+
+def run_incremental_update(path: str, directory: str, min_support: float, repeat: int) -> tuple:
+    """Mine a log of the transactions without the last ones, append them and measure the incremental run
+
+    :return: the best time of the incremental run in seconds and the last updated miner
+    """
+    with open(path) as transaction_file:
+        lines = transaction_file.readlines()
+    number_of_old_lines = len(lines) - int(len(lines) * APPENDED_SHARE)
+    log_path = os.path.join(directory, 'log.txt')
+    state_path = os.path.join(directory, 'log.state.json')
+
+    best = float('inf')
+    for _ in range(repeat):
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        with open(log_path, 'w') as log_file:
+            log_file.writelines(lines[:number_of_old_lines])
+        IncrementalApriori(log_path, min_support, -1, state_path).run()
+        with open(log_path, 'a') as log_file:
+            log_file.writelines(lines[number_of_old_lines:])
+        miner = IncrementalApriori(log_path, min_support, -1, state_path)
+        started = time.perf_counter()
+        miner.run()
+        best = min(best, time.perf_counter() - started)
+    return best, miner
+
+
+def run(repeat: int=3) -> dict:
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for number_of_transactions in NUMBER_OF_TRANSACTIONS:
+            path = os.path.join(directory, f'transactions_{number_of_transactions}.txt')
+            write_transactions(path, number_of_transactions)
+            for min_support in MIN_SUPPORTS:
+                case = f'{number_of_transactions},{min_support}'
+                horizontal_time, horizontal = run_algorithm(Apriori, path, min_support, repeat)
+                vertical_time, vertical = run_algorithm(Apriori, path, min_support, repeat, vertical=True)
+                fp_growth_time, fp_growth = run_algorithm(FPGrowth, path, min_support, repeat)
+                sharded_time, sharded = run_algorithm(ShardedApriori, path, min_support, repeat)
+                incremental_time, incremental = run_incremental_update(path, directory, min_support, repeat)
+                if vertical.frequentItemsSupport != horizontal.frequentItemsSupport:
+                    raise ValueError(f'Vertical counting differs from the horizontal one: {case}')
+                # Apriori keeps supports of the counted infrequent candidates too
+                frequent_supports = {itemset: support for itemset, support in horizontal.frequentItemsSupport.items()
+                                     if support >= min_support}
+                if fp_growth.frequentItemsSupport != frequent_supports:
+                    raise ValueError(f'FP-Growth differs from Apriori: {case}')
+                if sharded.frequentItemsSupport != frequent_supports:
+                    raise ValueError(f'Sharded Apriori differs from Apriori: {case}')
+                if {itemset: support for itemset, support in incremental.frequentItemsSupport.items()
+                        if support >= min_support} != frequent_supports:
+                    raise ValueError(f'Incremental Apriori differs from Apriori: {case}')
+                results[f'apriori_run_ms[horizontal,{case}]'] = horizontal_time * 1e3
+                results[f'apriori_run_ms[vertical,{case}]'] = vertical_time * 1e3
+                results[f'fp_growth_run_ms[{case}]'] = fp_growth_time * 1e3
+                results[f'apriori_run_ms[sharded,{case}]'] = sharded_time * 1e3
+                results[f'apriori_run_ms[incremental_update,{case}]'] = incremental_time * 1e3
+                for name, (number_of_candidates, create_time) in measure_candidates(
+                        vertical.frequentItems, repeat).items():
+                    results[f'apriori_candidates[{name},{case}]'] = number_of_candidates
+                    results[f'create_ck_ms[{name},{case}]'] = create_time * 1e3
+                results[f'frequent_itemsets[{case}]'] = sum(len(level) for level in horizontal.frequentItems)
+    return results
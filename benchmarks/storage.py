@@ -0,0 +1,51 @@
+"""Compare the per-message cost of the durable storage with the in-memory one
+
+Run: python -m benchmarks storage
+"""
+import os
+import tempfile
+import time
+
+from bot import MemoryStorage, SQLiteStorage, QuizSession
+from experts import EXPERTS
+
+NUMBER_OF_CHATS = 10000
+NUMBER_OF_MESSAGES = 100000
+
+
+def simulate_messages(storage: MemoryStorage) -> float:
+    """Answer questions in many chats the same way the update loop does
+
+    :return: an average time per message in microseconds
+    """
+    expert_class = EXPERTS[0]
+    started = time.perf_counter()
+    for message_number in range(NUMBER_OF_MESSAGES):
+        chat_id = message_number % NUMBER_OF_CHATS
+        storage.get_language(chat_id)
+        session = storage.get_session(chat_id)
+        if session is None or session.is_finished:
+            session = QuizSession.start(expert_class, 0)
+        else:
+            session.answer(message_number % 5)
+        storage.set_session(chat_id, session)
+    return (time.perf_counter() - started) / NUMBER_OF_MESSAGES * 1e6
+
+
+def run(repeat: int=1) -> dict:
+    results = dict(memory_us_per_message=min(simulate_messages(MemoryStorage()) for _ in range(repeat)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'storage.sqlite3')
+        storage = SQLiteStorage(database)
+        results['sqlite_us_per_message'] = simulate_messages(storage)
+        started = time.perf_counter()
+        storage.close()
+        results['sqlite_final_flush_ms'] = (time.perf_counter() - started) * 1e3
+
+        started = time.perf_counter()
+        storage = SQLiteStorage(database)
+        results['sqlite_restore_ms'] = (time.perf_counter() - started) * 1e3
+        results['restored_sessions'] = len(storage.sessions)
+        storage.close()
+    return results
@@ -0,0 +1,12 @@
+import timeit
+
+
+def measure(function, number: int=1, repeat: int=5) -> float:
+    """Measure a function the same way as timeit does: the best of several runs
+
+    :param function: a function without arguments
+    :param number: a number of calls in one run
+    :param repeat: a number of runs
+    :return: the best time of one call in seconds
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
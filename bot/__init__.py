@@ -1 +1,8 @@
 from .expert_bot import ExpertBotHandler
+from .session import QuizSession
+from .storage import MemoryStorage, SQLiteStorage
+from .scheduler import RateLimiter, SendScheduler
+from .dispatcher import Dispatcher
+from .webhook import WebhookServer
+from .ingestion import UpdateIngestion
+from .speculation import Speculator
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import aiohttp
+
+from .expert_bot import ExpertBotHandler, API_URL, API_REQUESTS, API_REQUEST_SECONDS, FORM_HEADERS, encode_chat_id
+from .scheduler import RateLimiter, get_retry_after
+
+
+class AsyncExpertBotHandler(ExpertBotHandler):
+    """The same Bot API methods as in ExpertBotHandler, but as coroutines over one aiohttp session.
+    Outgoing messages wait for their turn within the global and per chat rate limits
+    """
+
+    def __init__(self, token: str, api_url: str=API_URL, limiter: RateLimiter=None,
+                 connections: int=100, max_retries: int=3):
+        """
+        :param token: a token of the bot
+        :param api_url: a template of the Bot API address (e.g. a local server for testing)
+        :param limiter: global and per chat rate limits
+        :param connections: a maximum number of simultaneous (kept-alive) HTTP connections
+        :param max_retries: a number of retries after "429 Too Many Requests"
+        """
+        super().__init__(token, api_url)
+        self.limiter = limiter or RateLimiter()
+        self.connections = connections
+        self.max_retries = max_retries
+        self.queue_depth = 0  # a number of messages waiting for their turn or for a response
+        self.retried = 0
+        self._http_session = None
+
+    @property
+    def http_session(self) -> aiohttp.ClientSession:
+        # The session is created inside of the running event loop
+        if self._http_session is None:
+            self._http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections))
+        return self._http_session
+
+    async def close(self) -> None:
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+
+    def stats(self) -> dict:
+        """Queue depth metrics
+        """
+        return dict(queue_depth=self.queue_depth, retried=self.retried)
+
+    async def _request(self, http_method: str, method: str, **kwargs) -> tuple:
+        """Make a request to the Bot API and count it in the metrics
+
+        :param http_method: GET or POST
+        :param method: a method of the Bot API (e.g. sendMessage)
+        :param kwargs: arguments of aiohttp.ClientSession.request (e.g. data or params)
+        :return: an HTTP status and a decoded body of the response
+        """
+        started = time.perf_counter()
+        try:
+            async with self.http_session.request(http_method, self.api_url + method, **kwargs) as resp:
+                result = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            API_REQUESTS.inc(method, 'error')
+            raise
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, method)
+        API_REQUESTS.inc(method, resp.status)
+        return resp.status, result
+
+    async def _post(self, method: str, params: dict or bytes, chat_id: int or str, chat_limited: bool=True) -> dict:
+        if isinstance(params, bytes):
+            kwargs = dict(data=params, headers=FORM_HEADERS)
+        else:
+            # Form fields must be strings
+            kwargs = dict(data={key: str(value) for key, value in params.items()})
+        self.queue_depth += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                await asyncio.sleep(self.limiter.reserve(chat_id, chat_limited))
+                status, result = await self._request('POST', method, **kwargs)
+                self.log.debug(f'Message delivery status: {status}')
+                retry_after = get_retry_after(status, result)
+                if retry_after is None or attempt == self.max_retries:
+                    if status >= 400:
+                        self.log.warning(f'Can not send {method} to the chat {chat_id}: {status} {result}' +
+                                         (f' after {attempt} retries' if attempt else ''))
+                    return result
+                self.log.warning(f'Too many requests to the chat {chat_id}, retry after {retry_after}s')
+                self.retried += 1
+                self.limiter.pause(chat_id, retry_after)
+        finally:
+            self.queue_depth -= 1
+
+    async def get_updates(self, offset: int=None, timeout: int=30, limit: int=100) -> list:
+        """Make a GET request to get all the updates (look at ExpertBotHandler.get_updates)
+        """
+        method = 'getUpdates'
+        params = {'timeout': timeout, 'limit': limit}
+        if offset is not None:
+            params['offset'] = offset
+        http_timeout = aiohttp.ClientTimeout(total=timeout + 10)
+        _, result = await self._request('GET', method, params=params, timeout=http_timeout)
+        result = result['result']
+        self.log.debug(f'Got updates: {result}')
+        return result
+
+    async def send_message(self, chat_id: int or str, text: str,
+                           reply_markup: str=None, parse_mode: str='Markdown') -> dict:
+        """Look at ExpertBotHandler.send_message
+
+        :return: a decoded response of the Bot API
+        """
+        params = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode}
+        if reply_markup:
+            params = {**params, 'reply_markup': reply_markup}
+        return await self._post('sendMessage', params, chat_id)
+
+    async def send_photo(self, chat_id: int or str, file_id: str, caption: str=None, parse_mode: str=None) -> dict:
+        """Look at ExpertBotHandler.send_photo
+
+        :return: a decoded response of the Bot API
+        """
+        params = {'chat_id': chat_id, 'photo': file_id}
+        if caption:
+            params = {**params, 'caption': caption}
+        if parse_mode:
+            params = {**params, 'parse_mode': parse_mode}
+        return await self._post('sendPhoto', params, chat_id)
+
+    async def edit_message_text(self, chat_id: int or str, message_id: int, text: str,
+                                reply_markup: str=None, parse_mode: str='Markdown') -> dict:
+        """Look at ExpertBotHandler.edit_message_text
+
+        :return: a decoded response of the Bot API
+        """
+        params = {'chat_id': chat_id, 'message_id': message_id, 'text': text, 'parse_mode': parse_mode}
+        if reply_markup:
+            params = {**params, 'reply_markup': reply_markup}
+        return await self._post('editMessageText', params, chat_id)
+
+    async def answer_callback_query(self, chat_id: int or str, callback_query_id: str) -> dict:
+        """Look at ExpertBotHandler.answer_callback_query
+
+        :return: a decoded response of the Bot API
+        """
+        return await self._post('answerCallbackQuery', {'callback_query_id': callback_query_id}, chat_id,
+                                chat_limited=False)
+
+    async def send_payload(self, chat_id: int or str, payload: tuple, message_id: int=None) -> dict:
+        """Look at ExpertBotHandler.send_payload
+
+        :return: a decoded response of the Bot API
+        """
+        method, body = payload
+        if message_id is not None:
+            body = b'message_id=%d&' % message_id + body
+        return await self._post(method, encode_chat_id(chat_id) + body, chat_id)
+
+
+class Outbox:
+    """Collects replies of the synchronous conversation code to send them later with AsyncExpertBotHandler
+    """
+
+    build_keyboard = staticmethod(ExpertBotHandler.build_keyboard)
+    build_inline_keyboard = staticmethod(ExpertBotHandler.build_inline_keyboard)
+    remove_keyboards = staticmethod(ExpertBotHandler.remove_keyboards)
+
+    def __init__(self):
+        self.calls = []  # [(method_name, args, kwargs), ...]
+
+    def send_message(self, *args, **kwargs) -> None:
+        self.calls.append(('send_message', args, kwargs))
+
+    def send_photo(self, *args, **kwargs) -> None:
+        self.calls.append(('send_photo', args, kwargs))
+
+    def send_payload(self, *args, **kwargs) -> None:
+        self.calls.append(('send_payload', args, kwargs))
+
+    def edit_message_text(self, *args, **kwargs) -> None:
+        self.calls.append(('edit_message_text', args, kwargs))
+
+    def answer_callback_query(self, *args, **kwargs) -> None:
+        self.calls.append(('answer_callback_query', args, kwargs))
+
+    async def send(self, expert_bot: AsyncExpertBotHandler) -> None:
+        """Send all the collected replies one by one (to keep their order)
+        """
+        for method_name, args, kwargs in self.calls:
+            await getattr(expert_bot, method_name)(*args, **kwargs)
+        self.calls.clear()
+
+
+class ChatQueues:
+    """Runs a handler for the messages of every chat in order, while different chats are handled concurrently.
+    A task for a chat lives only while the chat has pending messages.
+
+    Ids of the updates which are not handled yet are kept, so only the handled ones are confirmed to Telegram
+    (look at get_handled_update_id) and the others are delivered again after a crash
+    """
+
+    def __init__(self, handler, loop: asyncio.AbstractEventLoop=None):
+        """
+        :param handler: a coroutine function handler(chat_id, message)
+        :param loop: an event loop to run the tasks in
+        """
+        self.handler = handler
+        self.loop = loop or asyncio.get_event_loop()
+        self.queues = dict()  # chat_id: deque of pending (update_id, message)
+        self.pending_update_ids = set()
+        self.tasks = set()
+        self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+        self._handled = asyncio.Event()
+
+    def put(self, chat_id: int, message, update_id: int=None) -> None:
+        """
+        :param update_id: an id of the update of the message (None if it is not tracked)
+        """
+        if update_id is not None:
+            self.pending_update_ids.add(update_id)
+        queue = self.queues.get(chat_id)
+        if queue is not None:
+            queue.append((update_id, message))
+            return
+        queue = self.queues[chat_id] = deque([(update_id, message)])
+        task = self.loop.create_task(self._process(chat_id, queue))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _process(self, chat_id: int, queue: deque) -> None:
+        try:
+            while queue:
+                update_id, message = queue[0]
+                try:
+                    await self.handler(chat_id, message)
+                except Exception:
+                    # The update is not delivered again, it would fail the same way
+                    self.log.exception(f'Can not handle a message from the chat {chat_id}')
+                queue.popleft()
+                self.pending_update_ids.discard(update_id)
+                self._handled.set()
+        finally:
+            del self.queues[chat_id]
+
+    def get_handled_update_id(self, last_update_id: int) -> int:
+        """Get the last update which can be confirmed: all the updates up to it have been handled
+
+        :param last_update_id: the last received update
+        """
+        if not self.pending_update_ids:
+            return last_update_id
+        return min(self.pending_update_ids) - 1
+
+    async def wait_handled(self, timeout: float) -> None:
+        """Wait until one more message is handled (at most timeout seconds)
+        """
+        self._handled.clear()
+        try:
+            await asyncio.wait_for(self._handled.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def join(self) -> None:
+        """Wait until all the pending messages are handled
+        """
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
@@ -0,0 +1,83 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import zlib
+
+
+def _run_worker(worker_factory, worker_number: int, number_of_workers: int, tasks) -> None:
+    """Handle messages from the queue of one worker until None is received
+    """
+    log = logging.getLogger(f'Bot.Worker.{worker_number}')
+    worker = worker_factory(worker_number, number_of_workers)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            chat_id, message = task
+            try:
+                worker.handle(chat_id, message)
+            except Exception:
+                log.exception(f'Can not handle a message from the chat {chat_id}')
+    finally:
+        worker.close()
+
+
+def get_partition(chat_id: int or str, number_of_partitions: int) -> int:
+    """Get a number of the worker which handles all the messages of the chat
+    """
+    if not isinstance(chat_id, int):
+        # hash() of a string differs between processes
+        chat_id = zlib.crc32(str(chat_id).encode())
+    return chat_id % number_of_partitions
+
+
+class Dispatcher:
+    """Distributes messages between workers by chat id: messages of one chat are always handled
+    by the same worker in order, messages of different chats are handled in parallel
+    """
+
+    def __init__(self, worker_factory, workers: int=4, use_processes: bool=False, queue_size: int=1000):
+        """
+        :param worker_factory: a function (or class) worker_factory(worker_number, number_of_workers),
+        which is called inside of every worker and returns an object with handle(chat_id, message)
+        and close() methods. It must be picklable to run workers in processes
+        :param workers: a number of workers
+        :param use_processes: run workers in processes instead of threads
+        :param queue_size: a maximum number of pending messages of one worker
+        """
+        self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+        queue_class = multiprocessing.Queue if use_processes else queue.Queue
+        worker_class = multiprocessing.Process if use_processes else threading.Thread
+        self.queues = [queue_class(queue_size) for _ in range(workers)]
+        self.workers = [worker_class(target=_run_worker, args=(worker_factory, worker_number, workers, tasks),
+                                     name=f'worker-{worker_number}', daemon=True)
+                        for worker_number, tasks in enumerate(self.queues)]
+        for worker in self.workers:
+            worker.start()
+        self.log.info(f'Started {workers} {"processes" if use_processes else "threads"}')
+
+    def submit(self, chat_id: int or str, message, block: bool=True, timeout: float=None) -> None:
+        """Pass a message to the worker of the chat
+
+        :raise queue.Full: if the worker is busy and the message has not been accepted in time
+        """
+        self.queues[get_partition(chat_id, len(self.queues))].put((chat_id, message), block, timeout)
+
+    def stats(self) -> dict:
+        """Numbers of pending messages of all the workers
+        """
+        try:
+            return dict(queue_sizes=[tasks.qsize() for tasks in self.queues])
+        except NotImplementedError:
+            # multiprocessing.Queue.qsize is not available on macOS
+            return dict()
+
+    def close(self) -> None:
+        """Handle all the pending messages and stop the workers
+        """
+        for tasks in self.queues:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -1,17 +1,101 @@
 import json
 import logging
+import time
+from concurrent.futures import Future
+from urllib.parse import quote_plus
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Counter, Histogram
+from .scheduler import SendScheduler
+
+API_URL = 'https://api.telegram.org/bot{}/'
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+API_REQUESTS = Counter('bot_api_requests_total', 'Requests to the Bot API by their status', ('method', 'status'))
+API_REQUEST_SECONDS = Histogram('bot_api_request_seconds', 'Time of requests to the Bot API', ('method', ))
+
+
+class CallbackQuery(str):
+    """Data of a pressed inline keyboard button. It is passed to the handlers instead of a text of a message,
+    and it keeps the ids which are needed to answer the query and to edit the message with the keyboard
+    """
+
+    def __new__(cls, data: str, callback_query_id: str, message_id: int) -> 'CallbackQuery':
+        callback_query = super().__new__(cls, data)
+        callback_query.id = callback_query_id
+        callback_query.message_id = message_id
+        return callback_query
+
+    def __getnewargs__(self) -> tuple:
+        return str(self), self.id, self.message_id
+
+
+def encode_chat_id(chat_id: int or str) -> bytes:
+    """The chat_id field of an urlencoded form, which is prepended to a pre-rendered payload
+    """
+    if isinstance(chat_id, int):
+        return b'chat_id=%d&' % chat_id
+    return f'chat_id={quote_plus(chat_id)}&'.encode('ascii')
 
 
 class ExpertBotHandler:
 
-    def __init__(self, token: str):
+    def __init__(self, token: str, api_url: str=API_URL, scheduler: SendScheduler=None, connections: int=10):
+        """
+        :param token: a token of the bot
+        :param api_url: a template of the Bot API address (e.g. a local server for testing)
+        :param scheduler: an outgoing message queue. If it is set, send_message and send_photo
+        do not wait for the response and return a future
+        :param connections: a number of kept-alive HTTP connections
+        """
         self.token = token
-        self.api_url = "https://api.telegram.org/bot{}/".format(token)
+        self.api_url = api_url.format(token)
+        self.scheduler = scheduler
         self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=connections))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=connections))
+
+    def _request(self, http_method: str, method: str, **kwargs) -> requests.models.Response:
+        """Make a request to the Bot API and count it in the metrics
 
-    def get_updates(self, offset: int=None, timeout: int=30) -> list:
+        :param http_method: GET or POST
+        :param method: a method of the Bot API (e.g. sendMessage)
+        :param kwargs: arguments of requests.Session.request (e.g. data or params)
+        """
+        started = time.perf_counter()
+        try:
+            resp = self.session.request(http_method, self.api_url + method, **kwargs)
+        except requests.RequestException:
+            API_REQUESTS.inc(method, 'error')
+            raise
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, method)
+        API_REQUESTS.inc(method, resp.status_code)
+        return resp
+
+    def _post(self, method: str, params: dict or bytes, chat_id: int or str,
+              chat_limited: bool=True) -> requests.models.Response or Future:
+        """
+        :param params: form fields or an already urlencoded form
+        :param chat_id: a chat the request is sent to
+        :param chat_limited: False if the request is not a message of the chat (look at RateLimiter.reserve)
+        """
+        def send():
+            if isinstance(params, bytes):
+                resp = self._request('POST', method, data=params, headers=FORM_HEADERS)
+            else:
+                resp = self._request('POST', method, data=params)
+            self.log.debug(f'Message delivery status: {resp.status_code}')
+            return resp
+
+        if self.scheduler is None:
+            return send()
+        return self.scheduler.submit(chat_id, send, chat_limited, method)
+
+    def get_updates(self, offset: int=None, timeout: int=30, limit: int=100) -> list:
         """Make a GET request to get all the updates
 
         :param offset: Identifier of the first update to be returned.
@@ -19,17 +103,38 @@ class ExpertBotHandler:
         By default, updates starting with the earliest unconfirmed update are returned.
         :param timeout: Timeout in seconds for long polling. Defaults to 0, i.e. usual short polling.
         Should be positive, short polling should be used for testing purposes only.
+        :param limit: Limits the number of updates to be retrieved. Values between 1-100 are accepted.
         :return: a list of update results
         """
         method = 'getUpdates'
-        params = {'timeout': timeout, 'offset': offset}
-        resp = requests.get(self.api_url + method, params)
+        params = {'timeout': timeout, 'offset': offset, 'limit': limit}
+        resp = self._request('GET', method, params=params)
         result = resp.json()['result']
         self.log.debug(f'Got updates: {result}')
         return result
 
+    def set_webhook(self, url: str, secret_token: str) -> dict:
+        """Ask Telegram to send updates to the HTTPS url instead of getUpdates
+
+        :param url: an HTTPS url of the webhook endpoint
+        :param secret_token: a secret which Telegram sends in the X-Telegram-Bot-Api-Secret-Token header
+        :return: a decoded response of the Bot API
+        """
+        # One connection delivers the updates in order, so the endpoint can skip the ones it has already handled
+        resp = self._request('POST', 'setWebhook', data={'url': url, 'secret_token': secret_token,
+                                                         'max_connections': 1})
+        self.log.info(f'Webhook {url} is set: {resp.status_code}')
+        return resp.json()
+
+    def delete_webhook(self) -> dict:
+        """Switch back to getUpdates
+        """
+        resp = self._request('POST', 'deleteWebhook')
+        self.log.info(f'Webhook is deleted: {resp.status_code}')
+        return resp.json()
+
     def send_message(self, chat_id: int or str, text: str,
-                     reply_markup: str=None, parse_mode: str='Markdown') -> requests.models.Response():
+                     reply_markup: str=None, parse_mode: str='Markdown') -> requests.models.Response or Future:
         """
         :param chat_id: Unique identifier for the target chat or username of the target channel
         :param text: Text of the message to be sent
@@ -42,23 +147,63 @@ class ExpertBotHandler:
         params = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode}
         if reply_markup:
             params = {**params, 'reply_markup': reply_markup}
-        resp = requests.post(self.api_url + method, params)
-        self.log.debug(f'Message delivery status: {resp.status_code}')
-        return resp
+        return self._post(method, params, chat_id)
 
-    def send_photo(self, chat_id: int or str, file_id: str, caption: str=None) -> requests.models.Response():
+    def send_photo(self, chat_id: int or str, file_id: str, caption: str=None,
+                   parse_mode: str=None) -> requests.models.Response or Future:
         """
         :param chat_id: Unique identifier for the target chat or username of the target channel
         :param file_id: Photo to send. Pass a file_id as String to send a photo that exists on the Telegram servers
-        :param caption: Photo caption 0-200 characters
+        :param caption: Photo caption 0-1024 characters
+        :param parse_mode: Markdown or HTML of the caption
         """
         method = 'sendPhoto'
         params = {'chat_id': chat_id, 'photo': file_id}
         if caption:
             params = {**params, 'caption': caption}
-        resp = requests.post(self.api_url + method, params)
-        self.log.debug(f'Message delivery status: {resp.status_code}')
-        return resp
+        if parse_mode:
+            params = {**params, 'parse_mode': parse_mode}
+        return self._post(method, params, chat_id)
+
+    def edit_message_text(self, chat_id: int or str, message_id: int, text: str,
+                          reply_markup: str=None, parse_mode: str='Markdown') -> requests.models.Response or Future:
+        """
+        :param chat_id: Unique identifier for the target chat or username of the target channel
+        :param message_id: Identifier of the message to edit
+        :param text: New text of the message
+        :param reply_markup: A JSON-serialized object for an inline keyboard
+        :param parse_mode: Send Markdown or HTML, if you want Telegram apps to show bold, italic,
+        fixed-width text or inline URLs in your bot's message.
+        """
+        method = 'editMessageText'
+        params = {'chat_id': chat_id, 'message_id': message_id, 'text': text, 'parse_mode': parse_mode}
+        if reply_markup:
+            params = {**params, 'reply_markup': reply_markup}
+        return self._post(method, params, chat_id)
+
+    def answer_callback_query(self, chat_id: int or str,
+                              callback_query_id: str) -> requests.models.Response or Future:
+        """Stop the progress bar on a pressed inline keyboard button
+
+        :param chat_id: a chat of the button (answers are queued with the other requests to the chat,
+        but they are not messages, so only the global rate limit is applied to them)
+        :param callback_query_id: Unique identifier for the query to be answered
+        """
+        return self._post('answerCallbackQuery', {'callback_query_id': callback_query_id}, chat_id,
+                          chat_limited=False)
+
+    def send_payload(self, chat_id: int or str, payload: tuple,
+                     message_id: int=None) -> requests.models.Response or Future:
+        """Send a pre-rendered request, only the chat (and the edited message) is added to it
+
+        :param chat_id: Unique identifier for the target chat or username of the target channel
+        :param payload: a tuple (method, body) from bot.render.RenderCache
+        :param message_id: Identifier of the message to edit (for editMessageText)
+        """
+        method, body = payload
+        if message_id is not None:
+            body = b'message_id=%d&' % message_id + body
+        return self._post(method, encode_chat_id(chat_id) + body, chat_id)
 
     def get_last_update(self) -> tuple:
         """Get last update and parse a response
@@ -81,6 +226,15 @@ class ExpertBotHandler:
         reply_markup = {"keyboard": keyboard, "one_time_keyboard": True, "resize_keyboard": True}
         return json.dumps(reply_markup)
 
+    @staticmethod
+    def build_inline_keyboard(items: list) -> str:
+        """
+        :param items: a list of tuples (button name, callback data)
+        :return: a JSON-serialized object for an inline keyboard
+        """
+        keyboard = [[{"text": text, "callback_data": data}] for text, data in items]
+        return json.dumps({"inline_keyboard": keyboard})
+
     @staticmethod
     def remove_keyboards() -> str:
         reply_markup = {"remove_keyboard": True}
@@ -88,7 +242,17 @@ class ExpertBotHandler:
 
     @staticmethod
     def parse_update_message(message: dict) -> tuple:
+        """
+        :param message: an update with a message or a callback query (a pressed inline keyboard button)
+        :return: tuple(last_update_id, last_chat_text, last_chat_id), last_chat_text is a CallbackQuery
+        for a callback query
+        """
         last_update_id = message['update_id']
+        callback_query = message.get('callback_query')
+        if callback_query is not None:
+            last_chat_text = CallbackQuery(callback_query['data'], callback_query['id'],
+                                           callback_query['message']['message_id'])
+            return last_update_id, last_chat_text, callback_query['message']['chat']['id']
         last_chat_text = message['message'].get('text')
         last_chat_id = message['message']['chat']['id']
         return last_update_id, last_chat_text, last_chat_id
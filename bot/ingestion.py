@@ -0,0 +1,104 @@
+import logging
+import time
+
+from .expert_bot import ExpertBotHandler
+
+
+class UpdateIngestion:
+    """Gets updates with one getUpdates call per cycle, skips duplicates and unsupported updates
+    and confirms the offset of the handled ones.
+
+    In the backlog drain mode (e.g. after downtime) repeated commands of a chat which only send
+    the same reply again (e.g. several /menu taps in a row) are merged into the last one
+    """
+
+    def __init__(self, expert_bot: ExpertBotHandler, limit: int=100, timeout: int=30,
+                 drain_backlog: bool=False, mergeable_texts: set=frozenset(), backlog_age: int=60):
+        """
+        :param expert_bot: a bot to get updates with
+        :param limit: a maximum number of updates in one batch (1-100)
+        :param timeout: a timeout of long polling in seconds
+        :param drain_backlog: merge obsolete messages of a backlog
+        :param mergeable_texts: messages which can be merged (their replies do not depend on the history)
+        :param backlog_age: messages older than this number of seconds are treated as a backlog
+        """
+        self.expert_bot = expert_bot
+        self.limit = limit
+        self.timeout = timeout
+        self.drain_backlog = drain_backlog
+        self.mergeable_texts = mergeable_texts
+        self.backlog_age = backlog_age
+        self.offset = None
+        self.last_update_id = None
+        self.received_at = None  # time.monotonic() of the last batch
+        self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+
+    def prepare(self, updates: list) -> list:
+        """Parse a batch of updates
+
+        :param updates: a result of getUpdates
+        :return: a list of tuples (update_id, chat_id, text) to handle
+        """
+        self.received_at = time.monotonic()
+        messages = []
+        is_backlog = len(updates) >= self.limit
+        for update in updates:
+            update_id = update['update_id']
+            if self.last_update_id is not None and update_id <= self.last_update_id:
+                self.log.debug(f'Skipped duplicate update {update_id}')
+                continue
+            self.last_update_id = update_id
+            try:
+                _, last_chat_text, last_chat_id = self.expert_bot.parse_update_message(update)
+            except KeyError:
+                self.log.debug(f'Skipped unsupported update {update_id}')
+                continue
+            # Callback queries have no date of their own
+            date = update.get('message', {}).get('date', time.time())
+            is_backlog = is_backlog or date < time.time() - self.backlog_age
+            messages.append((update_id, last_chat_id, last_chat_text))
+
+        if self.drain_backlog and is_backlog:
+            messages = self._merge(messages)
+        return messages
+
+    def _merge(self, messages: list) -> list:
+        """Keep only the last one of consecutive mergeable messages of every chat
+        """
+        merged = []
+        last_message_of_chat = dict()  # chat_id: index in merged
+        for update_id, chat_id, text in messages:
+            index = last_message_of_chat.get(chat_id)
+            if index is not None and text in self.mergeable_texts and merged[index][2] in self.mergeable_texts:
+                merged[index] = None
+            last_message_of_chat[chat_id] = len(merged)
+            merged.append((update_id, chat_id, text))
+        merged = [message for message in merged if message is not None]
+        if len(merged) < len(messages):
+            self.log.info(f'Merged {len(messages) - len(merged)} obsolete messages of the backlog')
+        return merged
+
+    def acknowledge(self, update_id: int) -> None:
+        """Confirm that the update (and all the previous ones) has been handled.
+        The offset is sent to Telegram with the next getUpdates call
+        """
+        if self.offset is None or update_id >= self.offset:
+            self.offset = update_id + 1
+
+    def fetch(self) -> list:
+        """Get the next batch of updates
+
+        :return: a list of tuples (update_id, chat_id, text)
+        """
+        return self.prepare(self.expert_bot.get_updates(self.offset, self.timeout, self.limit))
+
+    def updates(self):
+        """Yield (update_id, chat_id, text) forever. An update is acknowledged when the next one is requested
+        """
+        while True:
+            for update_id, chat_id, text in self.fetch():
+                yield update_id, chat_id, text
+                self.acknowledge(update_id)
+            if self.last_update_id is not None:
+                # Skipped and merged updates are confirmed too
+                self.acknowledge(self.last_update_id)
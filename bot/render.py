@@ -0,0 +1,59 @@
+from urllib.parse import urlencode
+
+
+class RenderCache:
+    """Requests to the Bot API rendered once: texts are formatted, keyboards are serialized and
+    the forms are urlencoded. Only the chat is added to a payload when it is sent
+    (look at ExpertBotHandler.send_payload)
+    """
+
+    def __init__(self):
+        self.payloads = dict()  # key: (method, body)
+
+    def add_message(self, key: tuple, text: str, reply_markup: str=None, parse_mode: str='Markdown') -> None:
+        """Render a sendMessage request (look at ExpertBotHandler.send_message)
+
+        :param key: a key of the payload, e.g. ('question', expert_id, question_number, step, language_id)
+        """
+        params = {'text': text, 'parse_mode': parse_mode}
+        if reply_markup:
+            params['reply_markup'] = reply_markup
+        self.payloads[key] = ('sendMessage', urlencode(params).encode('ascii'))
+
+    def add_photo(self, key: tuple, file_id: str, caption: str=None, parse_mode: str=None) -> None:
+        """Render a sendPhoto request (look at ExpertBotHandler.send_photo)
+        """
+        params = {'photo': file_id}
+        if caption:
+            params['caption'] = caption
+        if parse_mode:
+            params['parse_mode'] = parse_mode
+        self.payloads[key] = ('sendPhoto', urlencode(params).encode('ascii'))
+
+    def add_reply_markup_edit(self, key: tuple, reply_markup: str) -> None:
+        """Render an editMessageReplyMarkup request (send it with the id of the edited message)
+
+        :param reply_markup: a JSON-serialized object for an inline keyboard
+        """
+        self.payloads[key] = ('editMessageReplyMarkup', urlencode({'reply_markup': reply_markup}).encode('ascii'))
+
+    def __getitem__(self, key: tuple) -> tuple:
+        """
+        :return: a tuple (method, body)
+        """
+        return self.payloads[key]
+
+    def get_edit(self, key: tuple) -> tuple:
+        """The same message as an editMessageText request (send it with the id of the edited message).
+        Only an inline keyboard can be in the message
+
+        :return: a tuple (method, body)
+        """
+        method, body = self.payloads[key]
+        return 'editMessageText', body
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.payloads
+
+    def __len__(self) -> int:
+        return len(self.payloads)
@@ -0,0 +1,223 @@
+import heapq
+import logging
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+
+GLOBAL_MESSAGES_PER_SECOND = 30  # Telegram limits for bots
+CHAT_MESSAGES_PER_SECOND = 1
+CHAT_BURST = 3
+
+
+class TokenBucket:
+    """A token bucket in the form of a virtual scheduler: instead of counting tokens
+    it keeps the time when the bucket becomes empty (theoretical arrival time)
+    """
+
+    __slots__ = ('interval', 'tolerance', 'arrival_time')
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        :param rate: a number of tokens added per second
+        :param capacity: a maximum number of tokens (a burst size)
+        """
+        self.interval = 1 / rate
+        self.tolerance = (capacity - 1) * self.interval
+        self.arrival_time = 0.0
+
+    def earliest(self, now: float) -> float:
+        """Get the earliest time (not before now) when a token is available
+        """
+        return max(now, self.arrival_time - self.tolerance)
+
+    def take(self, at: float) -> None:
+        """Take a token at the moment (which must not be earlier than the earliest time)
+        """
+        self.arrival_time = max(self.arrival_time, at) + self.interval
+
+
+class RateLimiter:
+    """Global and per chat token buckets of outgoing messages
+    """
+
+    def __init__(self, global_rate: float=GLOBAL_MESSAGES_PER_SECOND,
+                 chat_rate: float=CHAT_MESSAGES_PER_SECOND, chat_burst: int=CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = dict()  # chat_id: token_bucket
+        self._lock = Lock()
+        self._last_cleanup = time.monotonic()
+
+    def reserve(self, chat_id: int or str, chat_limited: bool=True) -> float:
+        """Reserve a slot to send one message to the chat
+
+        :param chat_limited: False for requests which are not messages of the chat (e.g. answers to callback
+        queries), they are only counted in the global limit
+        :return: a delay in seconds to wait before sending
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._cleanup(now)
+            if not chat_limited:
+                send_time = self.global_bucket.earliest(now)
+                self.global_bucket.take(send_time)
+                return send_time - now
+            chat_bucket = self.chat_buckets.get(chat_id)
+            if chat_bucket is None:
+                chat_bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            send_time = self.global_bucket.earliest(chat_bucket.earliest(now))
+            chat_bucket.take(send_time)
+            self.global_bucket.take(send_time)
+            return send_time - now
+
+    def pause(self, chat_id: int or str, seconds: float) -> None:
+        """Do not send anything to the chat for a while (e.g. after "429 Too Many Requests")
+        """
+        with self._lock:
+            chat_bucket = self.chat_buckets.get(chat_id)
+            if chat_bucket is None:
+                chat_bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            chat_bucket.arrival_time = max(chat_bucket.arrival_time,
+                                           time.monotonic() + seconds + chat_bucket.tolerance)
+
+    def _cleanup(self, now: float) -> None:
+        # Full buckets do not differ from the new ones, so they are removed once a minute
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        self.chat_buckets = {chat_id: bucket for chat_id, bucket in self.chat_buckets.items()
+                             if bucket.arrival_time > now}
+
+
+def get_retry_after(status: int, response: dict) -> float or None:
+    """Get a delay from a "429 Too Many Requests" response of the Bot API
+
+    :param status: an HTTP status code
+    :param response: a decoded body of the response
+    :return: a number of seconds to wait or None if the request must not be retried
+    """
+    if status != 429:
+        return None
+    return float((response.get('parameters') or dict()).get('retry_after', 1))
+
+
+class SendScheduler:
+    """An outgoing message queue. Messages of one chat are sent in order and one at a time,
+    messages of different chats are sent by several worker threads within the rate limits
+    """
+
+    def __init__(self, limiter: RateLimiter=None, workers: int=4, max_retries: int=3):
+        """
+        :param limiter: global and per chat rate limits
+        :param workers: a number of threads which send messages (and HTTP connections they use)
+        :param max_retries: a number of retries after "429 Too Many Requests"
+        """
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+        self.queues = dict()  # chat_id: deque of (send, future, attempt, chat_limited, method)
+        self.queue_depth = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._ready = []  # heap of (send_time, sequence_number, chat_id)
+        self._sequence_number = 0
+        self._condition = Condition()
+        self._stopped = False
+        self._threads = [Thread(target=self._work, name=f'send-{number}', daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stats(self) -> dict:
+        """Queue depth metrics
+        """
+        with self._condition:
+            return dict(queue_depth=self.queue_depth, waiting_chats=len(self.queues),
+                        sent=self.sent, retried=self.retried, failed=self.failed)
+
+    def submit(self, chat_id: int or str, send, chat_limited: bool=True, method: str='message') -> Future:
+        """Put a message into the queue. Failed deliveries are logged, so nobody has to wait for the future
+
+        :param chat_id: an id of the target chat
+        :param send: a function which sends the message and returns requests.Response
+        :param chat_limited: False if the request is not counted in the limit of the chat (look at RateLimiter)
+        :param method: a method of the Bot API for the log
+        :return: a future with the response
+        """
+        future = Future()
+        with self._condition:
+            queue = self.queues.get(chat_id)
+            if queue is None:
+                queue = self.queues[chat_id] = deque()
+                self._schedule(chat_id, self.limiter.reserve(chat_id, chat_limited))
+            queue.append((send, future, 0, chat_limited, method))
+            self.queue_depth += 1
+        return future
+
+    def _schedule(self, chat_id: int or str, delay: float) -> None:
+        self._sequence_number += 1
+        heapq.heappush(self._ready, (time.monotonic() + delay, self._sequence_number, chat_id))
+        self._condition.notify()
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._ready:
+                        delay = self._ready[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                    elif self._stopped:
+                        return
+                    else:
+                        delay = None
+                    self._condition.wait(delay)
+                _, _, chat_id = heapq.heappop(self._ready)
+                send, future, attempt, chat_limited, method = self.queues[chat_id].popleft()
+
+            retry_after = None
+            try:
+                resp = send()
+                retry_after = get_retry_after(resp.status_code, resp.json() if resp.status_code == 429 else {})
+            except Exception as error:
+                resp = error
+
+            with self._condition:
+                queue = self.queues[chat_id]
+                if retry_after is not None and attempt < self.max_retries:
+                    self.log.warning(f'Too many requests to the chat {chat_id}, retry after {retry_after}s')
+                    self.retried += 1
+                    self.limiter.pause(chat_id, retry_after)
+                    queue.appendleft((send, future, attempt + 1, chat_limited, method))
+                    self._schedule(chat_id, retry_after)
+                    continue
+
+                self.queue_depth -= 1
+                if isinstance(resp, Exception):
+                    self.failed += 1
+                    self.log.error(f'Can not send {method} to the chat {chat_id}', exc_info=resp)
+                    future.set_exception(resp)
+                else:
+                    if resp.status_code < 400:
+                        self.sent += 1
+                    else:
+                        self.failed += 1
+                        self.log.warning(f'Can not send {method} to the chat {chat_id}: {resp.status_code} '
+                                         f'{resp.text}' + (f' after {attempt} retries' if attempt else ''))
+                    future.set_result(resp)
+                if queue:
+                    self._schedule(chat_id, self.limiter.reserve(chat_id, queue[0][3]))
+                else:
+                    del self.queues[chat_id]
+
+    def close(self) -> None:
+        """Send all the queued messages and stop the workers
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,90 @@
+from experts import EXPERTS
+from experts.base import Expert, UNANSWERED
+from experts.catalog import Catalog
+
+
+class QuizSession:
+    """A compact state of one quiz. Only answers are kept, a posteriori probabilities
+    (and the next question in the adaptive mode) are rebuilt from the shared knowledge base
+    of the expert when they are needed. A session keeps the knowledge base it has been started with,
+    even if the knowledge base of the expert is reloaded during the quiz
+    """
+
+    __slots__ = ('expert_id', 'current_step', 'language_id', 'answers', 'catalog', '_question_number')
+
+    inline_keyboard = False  # questions are answered with inline keyboard buttons which edit one message
+
+    def __init__(self, expert_id: int, language_id: int, answers: bytes=None, current_step: int=0,
+                 catalog: Catalog=None):
+        """
+        :param expert_id: an index of the expert class in experts.EXPERTS
+        :param language_id: a language of the quiz
+        :param answers: a packed answer vector, one answer id (or UNANSWERED) per question
+        :param current_step: a number of answered questions
+        :param catalog: a knowledge base of the quiz (the current one of the expert by default)
+        """
+        self.expert_id = expert_id
+        self.language_id = language_id
+        self.current_step = current_step
+        self.catalog = self.expert_class.get_catalog() if catalog is None else catalog
+        if answers is None:
+            answers = bytes([UNANSWERED]) * len(self.catalog.questions)
+        self.answers = bytearray(answers)
+        self._question_number = None
+
+    @classmethod
+    def start(cls, expert_class: type, language_id: int) -> 'QuizSession':
+        return cls(EXPERTS.index(expert_class), language_id)
+
+    @property
+    def expert_class(self) -> type:
+        return EXPERTS[self.expert_id]
+
+    @property
+    def questions(self) -> tuple:
+        return self.catalog.questions
+
+    @property
+    def number_of_questions(self) -> int:
+        return len(self.answers)
+
+    @property
+    def question_number(self) -> int or None:
+        """A number of current question (None if the quiz is finished)
+        """
+        if self._question_number is None:
+            self._question_number = self.build_expert().get_next_question()
+        return self._question_number
+
+    @property
+    def is_finished(self) -> bool:
+        return self.question_number is None
+
+    def current_question(self) -> str:
+        return self.questions[self.question_number]
+
+    def answer(self, rate: int) -> None:
+        """Save an answer to the current question and move to the next one
+
+        :param rate: an answer id. No: 0, Probably no: 1, Do not know: 2, Probably: 3, Yes: 4
+        """
+        self.answers[self.question_number] = rate
+        self.current_step += 1
+        self._question_number = None
+
+    def build_expert(self) -> Expert:
+        """Create an expert and replay all the answers of this session
+        """
+        expert_system = self.expert_class(self.catalog)
+        expert_system.handle_answers(self.answers)
+        return expert_system
+
+    def get_result(self) -> dict:
+        return self.build_expert().get_result()
+
+    def get_result_number(self) -> int:
+        return self.build_expert().get_result_number()
+
+    def __repr__(self):
+        return (f'<{type(self).__name__} {self.expert_class.__name__} '
+                f'step {self.current_step}/{self.number_of_questions}>')
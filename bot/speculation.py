@@ -0,0 +1,107 @@
+import logging
+from collections import OrderedDict
+from threading import Condition, Thread
+
+from bot.session import QuizSession
+from metrics import Counter
+
+NUMBER_OF_ANSWERS = 5
+
+SPECULATIONS = Counter('bot_speculations_total', 'Speculative calculations of the next answers by their outcome',
+                       ('outcome', ))
+
+
+class Speculator:
+    """Calculates states of the expert after every possible answer to the current question of a quiz
+    in a background thread, while the user is reading the question. The states are put into the posterior cache
+    of the expert (together with the result and the next question), so the real answer is only a lookup.
+
+    The work is bounded: at most max_pending quizzes wait for a speculation, the next ones are not speculated.
+    The thread is started on the first speculation, so forked worker processes get their own one
+    """
+
+    def __init__(self, max_pending: int=0):
+        """
+        :param max_pending: a maximum number of quizzes waiting for a speculation (0 to turn it off)
+        """
+        self.max_pending = max_pending
+        self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+        self._pending = OrderedDict()  # chat_id: (expert_class, catalog, answers, question_number)
+        self._current_chat_id = None
+        self._condition = Condition()
+        self._thread = None
+        self._stopped = False
+
+    def speculate(self, chat_id: int or str, quiz_session: QuizSession) -> bool:
+        """Calculate all the answers to the current question of the quiz in the background.
+        A pending speculation of the previous question of the chat is replaced
+
+        :return: False if the speculation is turned off or the budget is exhausted
+        """
+        expert_class = quiz_session.expert_class
+        if not self.max_pending or expert_class.posterior_cache is None or quiz_session.is_finished:
+            return False
+        with self._condition:
+            if self._stopped:
+                return False
+            self._pending.pop(chat_id, None)
+            if len(self._pending) >= self.max_pending:
+                SPECULATIONS.inc('skipped')
+                return False
+            self._pending[chat_id] = (expert_class, quiz_session.catalog, bytes(quiz_session.answers),
+                                      quiz_session.question_number)
+            if self._thread is None:
+                self._thread = Thread(target=self._work, name='speculation', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return True
+
+    def cancel(self, chat_id: int or str) -> None:
+        """Drop a pending (or running) speculation of the chat, e.g. after /stop
+        """
+        with self._condition:
+            if self._pending.pop(chat_id, None) is not None or self._current_chat_id == chat_id:
+                self._current_chat_id = None
+                SPECULATIONS.inc('cancelled')
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                chat_id, (expert_class, catalog, answers, question_number) = self._pending.popitem(last=False)
+                self._current_chat_id = chat_id
+
+            answers = bytearray(answers)
+            for rate in range(NUMBER_OF_ANSWERS):
+                if self._current_chat_id != chat_id:
+                    break
+                answers[question_number] = rate
+                try:
+                    expert_class(catalog).handle_answers(answers)
+                except Exception:
+                    self.log.exception(f'Can not speculate answers of the chat {chat_id}')
+                    break
+            else:
+                SPECULATIONS.inc('done')
+
+            with self._condition:
+                if self._current_chat_id == chat_id:
+                    self._current_chat_id = None
+
+    def stats(self) -> dict:
+        with self._condition:
+            return dict(pending=len(self._pending), max_pending=self.max_pending)
+
+    def close(self) -> None:
+        """Drop all the pending speculations and stop the thread
+        """
+        with self._condition:
+            self._stopped = True
+            self._pending.clear()
+            self._current_chat_id = None
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
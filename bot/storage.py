@@ -0,0 +1,180 @@
+import logging
+import sqlite3
+from threading import Event, Lock, Thread
+
+from .session import QuizSession
+
+
+class MemoryStorage:
+    """Languages and quiz sessions of all the chats kept in process memory only
+    """
+
+    def __init__(self):
+        self.languages = dict()  # chat_id: language_id
+        self.sessions = dict()  # chat_id: quiz_session
+        self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+
+    def get_language(self, chat_id: int, default: int=None) -> int:
+        return self.languages.get(chat_id, default)
+
+    def set_language(self, chat_id: int, language_id: int) -> None:
+        self.languages[chat_id] = language_id
+
+    def get_session(self, chat_id: int) -> QuizSession:
+        return self.sessions.get(chat_id)
+
+    def set_session(self, chat_id: int, session: QuizSession) -> None:
+        """Save a new session or mark that an existing one has been changed
+        """
+        self.sessions[chat_id] = session
+
+    def delete_session(self, chat_id: int) -> None:
+        self.sessions.pop(chat_id, None)
+
+    def flush(self) -> None:
+        """Write all the pending changes (nothing to do for the memory storage)
+        """
+
+    def close(self) -> None:
+        self.flush()
+
+
+class SQLiteStorage(MemoryStorage):
+    """Languages and quiz sessions kept in memory and written to an SQLite database in batches.
+
+    Changes are only marked as dirty on the hot path, a background thread writes them
+    every flush_interval seconds (or earlier when max_pending changes are waiting).
+    All the data is loaded back with two queries when the storage is created.
+    """
+
+    def __init__(self, database: str, flush_interval: float=1.0, max_pending: int=1000, partition: tuple=None):
+        """
+        :param database: a path to an SQLite database file
+        :param flush_interval: a maximum delay in seconds between a change and its write to the disk
+        :param max_pending: a number of changed chats which triggers an early flush
+        :param partition: (partition_number, number_of_partitions) to load only the chats
+        with chat_id % number_of_partitions == partition_number (e.g. the chats of one worker)
+        """
+        super().__init__()
+        self.partition = partition
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._dirty_languages = set()
+        self._dirty_sessions = set()
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wake_up = Event()
+        self._stopped = Event()
+
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        self._connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS languages (
+                chat_id INTEGER PRIMARY KEY,
+                language_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sessions (
+                chat_id INTEGER PRIMARY KEY,
+                expert_id INTEGER NOT NULL,
+                language_id INTEGER NOT NULL,
+                current_step INTEGER NOT NULL,
+                answers BLOB NOT NULL
+            );
+        """)
+        self._load()
+
+        self._thread = Thread(target=self._flush_periodically, name='storage-flush', daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        """Restore languages and quiz sessions of all the chats
+        """
+        condition, params = '', ()
+        if self.partition:
+            partition_number, number_of_partitions = self.partition
+            # Python's modulo is never negative, as opposed to SQLite's one
+            condition = ' WHERE (chat_id % :count + :count) % :count = :number'
+            params = {'count': number_of_partitions, 'number': partition_number}
+
+        self.languages.update(self._connection.execute(
+            'SELECT chat_id, language_id FROM languages' + condition, params))
+        number_of_outdated = 0
+        for chat_id, expert_id, language_id, current_step, answers in self._connection.execute(
+                'SELECT chat_id, expert_id, language_id, current_step, answers FROM sessions' + condition, params):
+            session = QuizSession(expert_id, language_id, answers, current_step)
+            if len(session.answers) != len(session.questions):
+                # The knowledge base has been changed since the quiz was started, it can not be continued
+                number_of_outdated += 1
+                continue
+            self.sessions[chat_id] = session
+        self.log.info(f'Restored {len(self.languages)} languages and {len(self.sessions)} quiz sessions')
+        if number_of_outdated:
+            self.log.warning(f'Skipped {number_of_outdated} quiz sessions of changed knowledge bases')
+
+    def _mark_dirty(self, dirty: set, chat_id: int) -> None:
+        with self._lock:
+            dirty.add(chat_id)
+            number_of_pending = len(self._dirty_languages) + len(self._dirty_sessions)
+        if number_of_pending >= self.max_pending:
+            self._wake_up.set()
+
+    def set_language(self, chat_id: int, language_id: int) -> None:
+        super().set_language(chat_id, language_id)
+        self._mark_dirty(self._dirty_languages, chat_id)
+
+    def set_session(self, chat_id: int, session: QuizSession) -> None:
+        super().set_session(chat_id, session)
+        self._mark_dirty(self._dirty_sessions, chat_id)
+
+    def delete_session(self, chat_id: int) -> None:
+        super().delete_session(chat_id)
+        self._mark_dirty(self._dirty_sessions, chat_id)
+
+    def flush(self) -> None:
+        """Write all the changed languages and quiz sessions in one transaction
+        """
+        with self._flush_lock:
+            with self._lock:
+                dirty_languages, self._dirty_languages = self._dirty_languages, set()
+                dirty_sessions, self._dirty_sessions = self._dirty_sessions, set()
+                languages = [(chat_id, self.languages[chat_id]) for chat_id in dirty_languages]
+                sessions, deleted_sessions = [], []
+                for chat_id in dirty_sessions:
+                    session = self.sessions.get(chat_id)
+                    if session is None:
+                        deleted_sessions.append((chat_id, ))
+                    else:
+                        sessions.append((chat_id, session.expert_id, session.language_id,
+                                         session.current_step, bytes(session.answers)))
+            if not (languages or sessions or deleted_sessions):
+                return
+
+            try:
+                with self._connection:
+                    self._connection.executemany('REPLACE INTO languages VALUES (?, ?)', languages)
+                    self._connection.executemany('REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)', sessions)
+                    self._connection.executemany('DELETE FROM sessions WHERE chat_id = ?', deleted_sessions)
+            except sqlite3.Error:
+                # Keep the changes for the next attempt
+                with self._lock:
+                    self._dirty_languages |= dirty_languages
+                    self._dirty_sessions |= dirty_sessions
+                raise
+            self.log.debug(f'Flushed {len(languages)} languages and {len(dirty_sessions)} quiz sessions')
+
+    def _flush_periodically(self) -> None:
+        while not self._stopped.is_set():
+            self._wake_up.wait(self.flush_interval)
+            self._wake_up.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as error:
+                self.log.error(f'Can not flush changes: {error}')
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wake_up.set()
+        self._thread.join()
+        self.flush()
+        self._connection.close()
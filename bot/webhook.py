@@ -0,0 +1,109 @@
+import hmac
+import json
+import logging
+import queue
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock
+
+from .expert_bot import ExpertBotHandler
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    """An HTTP endpoint which accepts updates from Telegram (instead of getUpdates long polling)
+    and passes their messages to the same handler as polling does.
+
+    If the handler does not accept a message (raises queue.Full because workers are busy),
+    the endpoint answers "503 Service Unavailable" and Telegram delivers the update again later.
+    Updates which are delivered again after they have been handled (e.g. when a response is lost)
+    are skipped the same way as UpdateIngestion skips them
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handle, secret_token: str, host: str='0.0.0.0', port: int=8443, path: str='/'):
+        """
+        :param handle: a function handle(chat_id, (text, received_at)), e.g. Dispatcher.submit.
+        received_at is a value of time.monotonic() when the request has been received
+        :param secret_token: a secret which Telegram sends in the X-Telegram-Bot-Api-Secret-Token header
+        :param host: an address to listen on
+        :param port: a port to listen on
+        :param path: a path of the endpoint
+        """
+        self.handle = handle
+        self.secret_token = secret_token
+        self.endpoint_path = path
+        self.log = logging.getLogger(f'Bot.{type(self).__name__}')
+        self.last_update_id = None
+        self._lock = Lock()
+        super().__init__((host, port), WebhookRequestHandler)
+
+    def submit(self, update: dict, received_at: float) -> int:
+        """Pass the message of an update to the handler once
+
+        :param update: a decoded update from Telegram
+        :param received_at: a value of time.monotonic() when the request has been received
+        :return: an HTTP status of the response
+        """
+        try:
+            update_id = update['update_id']
+        except (KeyError, TypeError):
+            return 400
+
+        # Updates are handled one at a time, so a duplicate can not slip in while the previous one is submitted
+        with self._lock:
+            if self.last_update_id is not None and update_id <= self.last_update_id:
+                self.log.debug(f'Skipped duplicate update {update_id}')
+                return 200
+            try:
+                last_update_id, last_chat_text, last_chat_id = ExpertBotHandler.parse_update_message(update)
+            except (KeyError, TypeError):
+                # Other kinds of updates are not supported, Telegram must not deliver them again
+                self.log.debug(f'Skipped update: {update}')
+                self.last_update_id = update_id
+                return 200
+
+            try:
+                self.handle(last_chat_id, (last_chat_text, received_at))
+            except queue.Full:
+                self.log.warning(f'Workers are busy, update {last_update_id} is postponed')
+                return 503
+            self.last_update_id = update_id
+            return 200
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+
+    server = None  # type: WebhookServer
+
+    def _reply(self, status: int, headers: dict=None) -> None:
+        self.send_response(status)
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        received_at = time.monotonic()
+        if self.path != self.server.endpoint_path:
+            return self._reply(404)
+
+        secret_token = self.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(secret_token.encode(), self.server.secret_token.encode()):
+            self.server.log.warning(f'Wrong secret token from {self.client_address[0]}')
+            return self._reply(403)
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            update = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            return self._reply(400)
+
+        status = self.server.submit(update, received_at)
+        self._reply(status, {'Retry-After': '1'} if status == 503 else None)
+
+    def log_message(self, format: str, *args) -> None:
+        self.server.log.debug(format % args)
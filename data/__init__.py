@@ -1,12 +1,28 @@
 from pathlib import Path
 
-import yaml
-
 
 CURRENT_DIR = Path(__file__).parent
 DEFAULT_CONFIG_FILE = CURRENT_DIR / Path('data_structure.yaml')
 
 
+def get_data_path(data_file: str, suffix: str='.yaml') -> Path:
+    """Get an absolute path of a data file
+
+    :param str data_file: a name or a path of a data file
+        (e.g. audio_interface or audio_interface.yaml or /absolute/path/config/audio_interface.yaml)
+    :param str suffix: a suffix of the file (e.g. .yaml for the source data)
+    :return: a path in the data directory if data_file is not absolute
+    """
+    if not data_file:
+        raise ValueError('Configuration file not specified.')
+
+    data_path = Path(data_file).with_suffix(suffix)
+
+    if not data_path.is_absolute():
+        data_path = CURRENT_DIR / data_path
+    return data_path
+
+
 def load_data(data_file: str) -> dict:
     """Load project data from yaml file.
     File data_structure.yaml contains default data structure.
@@ -15,16 +31,13 @@ def load_data(data_file: str) -> dict:
         (e.g. audio_interface or audio_interface.yaml or /absolute/path/config/audio_interface.yaml)
     :return: dict with data
     """
+    # PyYAML is only needed to compile the knowledge base, the bot loads its snapshots
+    import yaml
+
     with DEFAULT_CONFIG_FILE.open() as cf:
         conf = yaml.load(cf.read())
 
-    if not data_file:
-        raise ValueError('Configuration file not specified.')
-
-    data_path = Path(data_file).with_suffix('.yaml')
-
-    if not data_path.is_absolute():
-        data_path = CURRENT_DIR / data_path
+    data_path = get_data_path(data_file)
 
     if not data_path.exists():
         raise FileNotFoundError(f'Configuration file "{data_path}" not found!')
@@ -4,3 +4,6 @@ from .microphone_expert import Microphone
 from .studio_monitor_expert import StudioMonitor
 from .mixing_console_expert import MixingConsole
 from .software_expert import Software
+
+# The position of an expert class is its identifier (e.g. in quiz sessions)
+EXPERTS = (AudioInterface, Soundproofing, Microphone, StudioMonitor, MixingConsole, Software)
@@ -1,3 +1,5 @@
+import logging
+
 from experts import base
 
 
@@ -20,13 +22,14 @@ class AudioInterface(base.Expert):
             else:
                 break
 
-        for el in self.outcomes:
-            print(el['producer'], el['priori_probability'])
+        for el, posterior in zip(self.outcomes, self.posteriors):
+            print(el['producer'], posterior)
 
         result = self.get_result()
         print(f"\nResult:\nProducer: {result.get('producer')}\nModel: {result.get('model')}\n")
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format=base.LOG_FORMAT)
     sound_card = AudioInterface()
     sound_card.run_in_console()
@@ -1,14 +1,35 @@
 import logging
-from decimal import Decimal
-from random import randrange
+import time
+from threading import Lock
 
-import trafaret as t
-from trafaret import Dict
+import numpy as np
 
-from data import load_data
+from data import get_data_path, load_data
+from experts.cache import PosteriorCache
+from experts.catalog import Catalog
 from experts.exceptions import ProbabilityRatesException, OutcomesValidationException, RangeException
+from experts.snapshot import SNAPSHOT_SUFFIX, read_snapshot
+from metrics import Histogram
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_catalogs = dict()  # expert_class: catalog
+_catalogs_lock = Lock()
+
+PROBABILITY_MODE = 'probability'
+LOG_ODDS_MODE = 'log_odds'
+UNANSWERED = 0xFF  # a value of a question which has not been answered yet (e.g. in an answer vector)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'  # set up by the scripts, not on import
+
+ANSWER_SECONDS = Histogram('expert_answer_seconds', 'Time of handling one answer', ('expert', ))
+CATALOG_LOAD_SECONDS = Histogram('expert_catalog_load_seconds', 'Time of loading a knowledge base',
+                                 ('expert', 'source'))
+
+
+def _get_entropy(scores: np.ndarray, axis: int=0) -> np.ndarray:
+    """Get the entropy of every column (or of every vector along the axis) of scores normalized to the sum of 1
+    """
+    probabilities = scores / scores.sum(axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return -np.nansum(probabilities * np.log(probabilities), axis=axis)
 
 
 class Expert:
@@ -21,9 +42,15 @@ class Expert:
     rate_gradation = 5          # type: int
     probably_no_rate = -3       # type: int
     probably_rate = 3           # type: int
+    posterior_mode = PROBABILITY_MODE  # type: str
+    ranking_size = 5            # type: int
+    adaptive_questions = False  # type: bool
+    stop_threshold = None       # type: float
+    validate_data = False       # type: bool
+    posterior_cache = PosteriorCache()  # type: PosteriorCache
     log_name = 'expert'         # type: str
 
-    def __init__(self):
+    def __init__(self, catalog: Catalog=None):
         """Приклад, для кращого розуміння вхідних данних:
 
         Питання:      1) У вас є температура?
@@ -32,18 +59,112 @@ class Expert:
         Ймовірність P=0.01, що будь-яка навмання взята людина хворіє грипом.
         Ймовірність P=0.9, що при симптомах грипу користувач відповість ТАК на питання чи є у нього температура
         Ймовірність P=0.01 того, що він відповість ТАК на данне питання, але при цьому у нього немає Гриппу
-        """
 
-        if self.data_file_name:
-            # Load questions and outcomes from a file
-            data = load_data(self.data_file_name)
-            self.questions = data.get('questions')
-            self.outcomes = data.get('outcomes')
+        :param catalog: a knowledge base of the expert (the current one by default),
+        e.g. the one a quiz session has been started with before the knowledge base was reloaded
+        """
 
-        self.pid = f'{randrange(2**16):04X}'
-        self.log = logging.getLogger(f'Expert.{type(self).__name__}.{self.pid}')
+        self.log = logging.getLogger(f'Expert.{type(self).__name__}')
         self._check_rate_range()
-        self._validate_outcome_dicts()
+        if self.posterior_mode not in (PROBABILITY_MODE, LOG_ODDS_MODE):
+            raise ValueError(f'Unknown posterior mode: {self.posterior_mode}')
+
+        # Questions and outcomes are shared between all the instances,
+        # the array of a posteriori probabilities is replaced (not modified) on every answer
+        self.catalog = self.get_catalog() if catalog is None else catalog
+        self.questions = self.catalog.questions
+        self.outcomes = self.catalog.outcomes
+        self.log_odds = None
+        self.complements = None
+        if self.posterior_mode == LOG_ODDS_MODE:
+            self.log_odds = self.catalog.prior_log_odds
+        self.answers = bytearray([UNANSWERED]) * len(self.questions)
+        self._ranking = None
+        self._best = None
+        self._next_question = None
+
+        # The initial state is the state of an empty answer vector, so it is cached the same way
+        if self.posterior_cache is not None:
+            state = self.posterior_cache.get(self._get_cache_key(self.answers))
+            if state is not None:
+                self._set_state(state)
+                return
+        if self.log_odds is None:
+            self.posteriors = self.catalog.priors
+        self._update_ranking()
+        self._update_next_question()
+        if self.posterior_cache is not None:
+            self.posterior_cache.put(self._get_cache_key(self.answers), self._get_state())
+
+    @property
+    def posteriors(self) -> np.ndarray:
+        """A posteriori probabilities of all the outcomes
+        """
+        if self.log_odds is None:
+            return self._posteriors
+        return 1 / (1 + np.exp(-self.log_odds))
+
+    @posteriors.setter
+    def posteriors(self, value: np.ndarray) -> None:
+        if self.posterior_mode == LOG_ODDS_MODE:
+            self.log_odds = np.log(value / (1 - value))
+        else:
+            self._posteriors = value
+            self.complements = 1 - value
+
+    @classmethod
+    def get_catalog(cls) -> Catalog:
+        """Get the knowledge base of this expert. It is loaded only once per process
+
+        :return: a shared catalog with questions and outcomes
+        """
+        catalog = _catalogs.get(cls)
+        if catalog is None:
+            with _catalogs_lock:
+                catalog = _catalogs.get(cls)
+                if catalog is None:
+                    catalog = _catalogs[cls] = cls._load_catalog()
+        return catalog
+
+    @classmethod
+    def set_catalog(cls, catalog: Catalog) -> Catalog:
+        """Replace the knowledge base of this expert (e.g. a reloaded one) for all the new instances.
+        The instances which have been created before keep the old one
+
+        :return: the replaced catalog (None if it has not been loaded yet)
+        """
+        with _catalogs_lock:
+            old_catalog = _catalogs.get(cls)
+            _catalogs[cls] = catalog
+        return old_catalog
+
+    @classmethod
+    def _load_catalog(cls) -> Catalog:
+        """Load the compiled snapshot of the data file (see experts.compile) if it is up to date.
+        Otherwise load questions and outcomes from the data file (or from the class attributes),
+        they are validated only if validate_data is set
+        """
+        log = logging.getLogger(f'Expert.{cls.__name__}')
+        questions, outcomes = cls.questions, cls.outcomes
+        if cls.data_file_name:
+            snapshot_path = get_data_path(cls.data_file_name, SNAPSHOT_SUFFIX)
+            data_path = get_data_path(cls.data_file_name)
+            if snapshot_path.exists() and (not data_path.exists() or
+                                           snapshot_path.stat().st_mtime >= data_path.stat().st_mtime):
+                with CATALOG_LOAD_SECONDS.time(cls.__name__, 'snapshot'):
+                    return read_snapshot(str(snapshot_path))
+            log.warning(f'There is no up-to-date snapshot of {data_path.name}, run "python -m experts.compile"')
+
+        with CATALOG_LOAD_SECONDS.time(cls.__name__, 'yaml' if cls.data_file_name else 'class'):
+            if cls.data_file_name:
+                # Load questions and outcomes from a file
+                data = load_data(cls.data_file_name)
+                questions = data.get('questions')
+                outcomes = data.get('outcomes')
+
+            if cls.validate_data:
+                cls._validate_outcome_dicts(outcomes)
+            return Catalog.from_outcomes(cls.data_file_name or cls.__name__, questions, outcomes)
 
     def _check_rate_range(self) -> None:
         """The probably_no_rate and probably_rate variables must be in range
@@ -57,7 +178,13 @@ class Expert:
                     minus_rate_gradation=-self.rate_gradation, rate_gradation=self.rate_gradation))
         self.log.debug('Probability rate ranges are OK')
 
-    def _validate_outcome_dicts(self) -> None:
+    @classmethod
+    def _validate_outcome_dicts(cls, outcomes: list) -> None:
+        # trafaret is only needed to compile the knowledge base (or if validate_data is set)
+        import trafaret as t
+        from trafaret import Dict
+
+        log = logging.getLogger(f'Expert.{cls.__name__}')
         template = Dict({
             t.Key('id'): t.Int,
             t.Key('producer'): t.String,
@@ -73,73 +200,166 @@ class Expert:
             }).allow_extra('*'),
         })
 
-        if not isinstance(self.outcomes, list):
+        if not isinstance(outcomes, list):
             raise TypeError('The outcomes variable must be a list instance')
 
-        number_of_products = len(self.outcomes)
+        number_of_products = len(outcomes)
 
-        for current_product_number, outcome in enumerate(self.outcomes, 1):
+        for current_product_number, outcome in enumerate(outcomes, 1):
             try:
                 template.check(outcome)
             except t.DataError as error:
-                self.log.error('Validation error occurred: {err_msg}'.format(err_msg=error))
+                log.error('Validation error occurred: {err_msg}'.format(err_msg=error))
                 raise OutcomesValidationException('Validation error occurred: {}'.format(error))
             else:
-                self.log.debug('({}/{}) outcome dictionaries checked.'.format(
+                log.debug('({}/{}) outcome dictionaries checked.'.format(
                     current_product_number, number_of_products))
-        self.log.debug('Outcome dictionaries are OK')
+        log.debug('Outcome dictionaries are OK')
 
     @staticmethod
-    def _calculate_answer_no(p: Decimal, p_y: Decimal, p_n: Decimal) -> Decimal():
+    def _calculate_answer_no(p: np.ndarray, q: np.ndarray, p_y: np.ndarray, p_n: np.ndarray) -> np.ndarray:
         """If user will answer "NO" to some question, we should
            recalculate a posteriori probability for the assumption
 
-        :param p: a posteriori probability of current assumption
-        :param p_y: a conditional probability in presence
-        :param p_n: a conditional probability in absence
-        :return: new value of a posteriori probability calculated using Bayes' theorem
+        :param p: a posteriori probabilities of all the assumptions
+        :param q: complements of the a posteriori probabilities (1 - p)
+        :param p_y: conditional probabilities in presence
+        :param p_n: conditional probabilities in absence
+        :return: new values of a posteriori probabilities calculated using Bayes' theorem
         """
-        return ((1 - p_y) * p) / ((1 - p_y) * p + (1 - p_n) * (1 - p))
+        return ((1 - p_y) * p) / ((1 - p_y) * p + (1 - p_n) * q)
 
-    def _calculate_answer_probably_no(self, p: Decimal, p_y: Decimal, p_n: Decimal) -> Decimal():
+    def _calculate_answer_probably_no(self, p: np.ndarray, q: np.ndarray,
+                                      p_y: np.ndarray, p_n: np.ndarray) -> np.ndarray:
         """For more information look at the "calculate_answer_no" method documentation
         """
         return p + (p - ((1 - p_y) * p) / ((1 - p_y) * p + (1 - p_n) *
-                                           (1 - p))) * self.probably_no_rate / self.rate_gradation
+                                           q)) * self.probably_no_rate / self.rate_gradation
 
     @staticmethod
-    def _calculate_answer_do_not_know(p: Decimal, p_y: Decimal, p_n: Decimal) -> Decimal():
+    def _calculate_answer_do_not_know(p: np.ndarray, q: np.ndarray, p_y: np.ndarray, p_n: np.ndarray) -> np.ndarray:
         """If user will answer "I don't know" we should not make any calculations
 
-        :param p: a posteriori probability of current assumption
+        :param p: a posteriori probabilities of all the assumptions
         :return: the same input variable
         """
         return p
 
-    def _calculate_answer_probably(self, p: Decimal, p_y: Decimal, p_n: Decimal) -> Decimal():
+    def _calculate_answer_probably(self, p: np.ndarray, q: np.ndarray,
+                                   p_y: np.ndarray, p_n: np.ndarray) -> np.ndarray:
         """For more information look at the "calculate_answer_no" method documentation
         """
-        return p + ((p_y * p) / (p_y * p + p_n * (1 - p)) - p) * self.probably_rate / self.rate_gradation
+        return p + ((p_y * p) / (p_y * p + p_n * q) - p) * self.probably_rate / self.rate_gradation
 
     @staticmethod
-    def _calculate_answer_yes(p: Decimal, p_y: Decimal, p_n: Decimal) -> Decimal():
+    def _calculate_answer_yes(p: np.ndarray, q: np.ndarray, p_y: np.ndarray, p_n: np.ndarray) -> np.ndarray:
         """For more information look at the "calculate_answer_no" method documentation
         """
-        return Decimal((p_y * p) / (p_y * p + p_n * (1 - p)))
+        return (p_y * p) / (p_y * p + p_n * q)
 
-    @staticmethod
-    def _get_probabilities_from_outcome(outcome: dict, question_number: int) -> tuple:
-        """Parce an input dictionary for necessary data to make all calculations
+    def _get_probabilities(self, question_number: int) -> tuple:
+        """Get all the data which is necessary to make calculations for the question
 
-        :param outcome: an input data with all the assumptions and additional info
         :param question_number: a number of current question
-        :return: a posteriori probability of current assumption,
-        a conditional probability in presence and a conditional probability in absence
+        :return: a posteriori probabilities of all the assumptions, their complements,
+        conditional probabilities in presence and conditional probabilities in absence
+        """
+        p = self.posteriors
+        q = self.complements
+        p_y = self.catalog.presence[:, question_number - 1]
+        p_n = self.catalog.absence[:, question_number - 1]
+        return p, q, p_y, p_n
+
+    def _get_log_likelihood_ratios(self, question_number: int, rate: int) -> np.ndarray:
+        """Get the evidence of an answer in the log-odds form. Uncertain answers (Probably no, Probably)
+        are counted as a part of the whole evidence, scaled by the probably_no_rate and probably_rate
+
+        :param question_number: a number of current question
+        :param rate: an answer id. No: 0, Probably no: 1, Probably: 3, Yes: 4
+        :return: log-likelihood ratios which must be added to log-odds of all the assumptions
+        """
+        if rate < 2:
+            weight = 1 if rate == 0 else -self.probably_no_rate / self.rate_gradation
+            return self.catalog.log_ratio_no[:, question_number - 1] * weight
+        weight = 1 if rate == 4 else self.probably_rate / self.rate_gradation
+        return self.catalog.log_ratio_yes[:, question_number - 1] * weight
+
+    def _update_ranking(self) -> None:
+        """Keep indices of the best outcomes (up to ranking_size) sorted by their probabilities.
+
+        The ranking is recalculated after every answer in O(n + k log k) for n outcomes and k = ranking_size:
+        an answer changes the probabilities of all the outcomes, so the Bayes update before it is O(n) anyway,
+        and a ranking maintained incrementally could not skip any outcome
+        """
+        scores = self.posteriors if self.log_odds is None else self.log_odds
+        size = min(self.ranking_size, len(scores))
+        if not size:
+            self._ranking = np.empty(0, dtype=int)
+            return
+        best = np.argpartition(-scores, size - 1)[:size]
+        self._ranking = best[np.argsort(-scores[best], kind='mergesort')]
+        self._best = int(np.argmax(scores))
+
+    def _is_decided(self) -> bool:
+        """Check if the share of the best outcome in the sum of all the a posteriori probabilities
+        has reached the stop_threshold
+        """
+        if self.stop_threshold is None or self._best is None:
+            return False
+        posteriors = self.posteriors
+        return posteriors[self._best] >= self.stop_threshold * posteriors.sum()
+
+    def _get_expected_entropies(self, question_numbers: np.ndarray) -> np.ndarray:
+        """Get the expected entropy of the (normalized) a posteriori probabilities after an answer
+        to every question. Only "Yes" and "No" answers are taken into account
+
+        :param question_numbers: numbers of questions in range [0; number of questions)
+        :return: an array of expected entropies of the same length
+        """
+        if self.log_odds is None:
+            p, q = self._posteriors, self.complements
+        else:
+            p, q = self.posteriors, 1 / (1 + np.exp(self.log_odds))
+        # Columns are questions, all the answers to all the questions are calculated at once
+        p, q = p[:, np.newaxis], q[:, np.newaxis]
+        p_y = self.catalog.presence[:, question_numbers]
+        p_n = self.catalog.absence[:, question_numbers]
+        probability_of_yes = (p * p_y).sum(axis=0) / p.sum()
+        return (probability_of_yes * _get_entropy(self._calculate_answer_yes(p, q, p_y, p_n)) +
+                (1 - probability_of_yes) * _get_entropy(self._calculate_answer_no(p, q, p_y, p_n)))
+
+    def _update_next_question(self) -> None:
+        """Choose the next question: the first unanswered one or, in the adaptive mode,
+        the one with the lowest expected entropy. There is no next question if the result is decided
         """
-        p = Decimal(outcome['priori_probability'])
-        p_y = Decimal(outcome['questions_estimation'][question_number]['probability_in_presence'])
-        p_n = Decimal(outcome['questions_estimation'][question_number]['probability_in_absence'])
-        return p, p_y, p_n
+        unanswered = np.flatnonzero(np.frombuffer(bytes(self.answers), dtype=np.uint8) == UNANSWERED)
+        if not len(unanswered) or self._is_decided():
+            self._next_question = None
+        elif not self.adaptive_questions:
+            self._next_question = int(unanswered[0])
+        else:
+            self._next_question = int(unanswered[np.argmin(self._get_expected_entropies(unanswered))])
+
+    def get_next_question(self) -> int or None:
+        """Get a number of the question to ask next
+
+        :return: a number of question in range [0; number of questions) or None if the quiz is finished
+        """
+        return self._next_question
+
+    def _get_state(self) -> tuple:
+        """Get everything which has been calculated from the answers (the arrays are never modified)
+        """
+        if self.log_odds is not None:
+            return self.log_odds, None, self._ranking, self._best, self._next_question
+        return self._posteriors, self.complements, self._ranking, self._best, self._next_question
+
+    def _set_state(self, state: tuple) -> None:
+        scores, complements, self._ranking, self._best, self._next_question = state
+        if self.log_odds is not None:
+            self.log_odds = scores
+        else:
+            self._posteriors, self.complements = scores, complements
 
     def handle_answer(self, question_number: int, rate: int) -> None:
         """Handle user answer (No, Probably no, Do not know, Probably, Yes)
@@ -147,19 +367,100 @@ class Expert:
         :param question_number: a number of question must be in range [0; +∞)
         :param rate: an answer id. No: 0, Probably no: 1, Do not know: 2, Probably: 3, Yes: 4
         """
-        question_number += 1
         if rate not in range(5):
             raise RangeException('Rate number is out of range: [0;4]')
+        started = time.perf_counter()
+        self.answers[question_number] = rate
+        question_number += 1
         calculation_methods = {0: self._calculate_answer_no, 1: self._calculate_answer_probably_no,
                                2: self._calculate_answer_do_not_know, 3: self._calculate_answer_probably,
                                4: self._calculate_answer_yes}
-        calculation_method = calculation_methods[rate]
-        self.log.debug(f'Calculation method is "{calculation_method.__name__}"')
-        for outcome in self.outcomes:
-            p, p_y, p_n = self._get_probabilities_from_outcome(outcome, question_number)
-            outcome['priori_probability'] = calculation_method(p, p_y, p_n)
-            self.log.debug(f"Model: {outcome['producer']} {outcome['model']}. "
-                           f"Probability: {outcome['priori_probability']}")
+        if self.posterior_mode == LOG_ODDS_MODE:
+            self.log.debug('Calculation method is "%s"', LOG_ODDS_MODE)
+            if rate != 2:
+                self.log_odds = self.log_odds + self._get_log_likelihood_ratios(question_number, rate)
+        else:
+            calculation_method = calculation_methods[rate]
+            self.log.debug('Calculation method is "%s"', calculation_method.__name__)
+            # All the outcomes are recalculated at once. The complements are calculated the same way
+            # (for the opposite assumptions) instead of 1 - p, which loses precision when p is close to 1
+            p, q, p_y, p_n = self._get_probabilities(question_number)
+            self._posteriors, self.complements = calculation_method(p, q, p_y, p_n), calculation_method(q, p, p_n, p_y)
+        self._update_ranking()
+        self._update_next_question()
+        ANSWER_SECONDS.observe(time.perf_counter() - started, type(self).__name__)
+
+        if self.log.isEnabledFor(logging.DEBUG):
+            for outcome, posterior in zip(self.outcomes, self.posteriors):
+                self.log.debug(f"Model: {outcome['producer']} {outcome['model']}. "
+                               f"Probability: {posterior}")
+
+    def _get_cache_key(self, answers: bytes) -> tuple:
+        """A key of the posterior cache: the settings of the expert, the generation of its catalog
+        and an answer vector (the key does not keep the catalog alive after a reload)
+        """
+        return (type(self), self.posterior_mode, self.adaptive_questions, self.stop_threshold,
+                self.catalog.generation, bytes(answers))
+
+    def handle_answers(self, answers: bytes) -> None:
+        """Handle all the answers from an answer vector in the order they have been asked:
+        in order of questions or, in the adaptive mode, in the order chosen by get_next_question.
+        States after every answer prefix are taken from (and saved to) the posterior cache
+
+        :param answers: answer ids for every question, UNANSWERED for the questions without an answer
+        """
+        if self.posterior_cache is not None:
+            # A state of the whole vector is the same as the state after replaying it (e.g. if it has been
+            # calculated in advance by bot.speculation), so the prefixes are not looked up one by one
+            state = self.posterior_cache.get(self._get_cache_key(answers))
+            if state is not None:
+                self.answers[:] = answers
+                self._set_state(state)
+                return
+
+        answered = (question_number for question_number, rate in enumerate(answers) if rate != UNANSWERED)
+        while True:
+            question_number = self.get_next_question() if self.adaptive_questions else next(answered, None)
+            if question_number is None or answers[question_number] == UNANSWERED:
+                break
+            if self.posterior_cache is None:
+                self.handle_answer(question_number, answers[question_number])
+                continue
+
+            # An answer vector of the prefix, e.g. (4, 255, 255), then (4, 0, 255), then (4, 0, 3)
+            self.answers[question_number] = answers[question_number]
+            key = self._get_cache_key(self.answers)
+            state = self.posterior_cache.get(key)
+            if state is not None:
+                self._set_state(state)
+            else:
+                self.handle_answer(question_number, answers[question_number])
+                self.posterior_cache.put(key, self._get_state())
+
+    def get_result_number(self) -> int:
+        """A number of the most probable outcome
+        """
+        return self._best
 
     def get_result(self) -> dict:
-        return max(self.outcomes, key=lambda x: x['priori_probability'])
+        return self.outcomes[self._best]
+
+    def get_ranking(self, number_of_outcomes: int=None) -> list:
+        """Get the best outcomes with their a posteriori probabilities.
+        Up to ranking_size outcomes are taken from the ranking which is kept after every answer
+
+        :param number_of_outcomes: a number of outcomes to return (ranking_size by default)
+        :return: a list of tuples (outcome, probability) sorted from the most probable one
+        """
+        if number_of_outcomes is None:
+            number_of_outcomes = self.ranking_size
+        if number_of_outcomes > len(self._ranking) and len(self._ranking) < len(self.outcomes):
+            best = np.argsort(-(self.posteriors if self.log_odds is None else self.log_odds),
+                              kind='mergesort')[:number_of_outcomes]
+        else:
+            best = self._ranking[:number_of_outcomes]
+        if self.log_odds is None:
+            scores = self.posteriors[best]
+        else:
+            scores = 1 / (1 + np.exp(-self.log_odds[best]))
+        return [(self.outcomes[outcome_number], float(score)) for outcome_number, score in zip(best, scores)]
@@ -0,0 +1,238 @@
+"""Score many answer vectors of one expert at once, e.g. logged quiz sessions after a change of the knowledge base.
+Rows of a CSV file are a session id and answer ids of all the questions (empty for a question without an answer),
+the file is read and scored in chunks and the best outcomes of every session are written as CSV:
+
+    $ python -m experts.batch MixingConsole sessions.csv --output scores.csv --top 3
+"""
+import argparse
+import csv
+import logging
+import sys
+import time
+from itertools import islice
+
+import numpy as np
+
+from experts import EXPERTS
+from experts.base import LOG_FORMAT, LOG_ODDS_MODE, UNANSWERED, _get_entropy
+from experts.exceptions import RangeException
+
+DEFAULT_CHUNK_SIZE = 4096  # rows
+
+log = logging.getLogger('Expert.batch')
+
+
+class _BatchState:
+    """A posteriori probabilities (or log-odds) of every row of answer vectors, rows x outcomes
+    """
+
+    def __init__(self, expert, number_of_rows: int):
+        self.expert = expert
+        self.catalog = expert.catalog
+        if expert.log_odds is not None:
+            self.log_odds = np.tile(self.catalog.prior_log_odds, (number_of_rows, 1))
+        else:
+            self.posteriors = np.tile(self.catalog.priors, (number_of_rows, 1))
+            self.complements = 1 - self.posteriors
+
+    @property
+    def scores(self) -> np.ndarray:
+        return self.posteriors if self.expert.log_odds is None else self.log_odds
+
+    def get_probabilities(self, rows: np.ndarray) -> tuple:
+        """
+        :return: a posteriori probabilities of the rows and their complements
+        """
+        if self.expert.log_odds is None:
+            return self.posteriors[rows], self.complements[rows]
+        log_odds = self.log_odds[rows]
+        return 1 / (1 + np.exp(-log_odds)), 1 / (1 + np.exp(log_odds))
+
+    def handle_answers(self, rows: np.ndarray, question_numbers: np.ndarray, rates: np.ndarray) -> None:
+        """Handle one answer of every row the same way as Expert.handle_answer does
+
+        :param rows: indices of the rows
+        :param question_numbers: a number of the answered question of every row, in range [0; number of questions)
+        :param rates: an answer id of every row
+        """
+        expert = self.expert
+        calculation_methods = {0: expert._calculate_answer_no, 1: expert._calculate_answer_probably_no,
+                               3: expert._calculate_answer_probably, 4: expert._calculate_answer_yes}
+        # Rows are grouped by the answer, every group is recalculated at once
+        for rate, calculation_method in calculation_methods.items():
+            selected = rates == rate
+            if not selected.any():
+                continue
+            rows_of_rate, questions_of_rate = rows[selected], question_numbers[selected]
+            if expert.log_odds is not None:
+                self.log_odds[rows_of_rate] += expert._get_log_likelihood_ratios(questions_of_rate + 1, rate).T
+                continue
+            p, q = self.posteriors[rows_of_rate], self.complements[rows_of_rate]
+            p_y, p_n = self.catalog.presence[:, questions_of_rate].T, self.catalog.absence[:, questions_of_rate].T
+            self.posteriors[rows_of_rate] = calculation_method(p, q, p_y, p_n)
+            self.complements[rows_of_rate] = calculation_method(q, p, p_n, p_y)
+
+    def is_decided(self, rows: np.ndarray) -> np.ndarray:
+        """The same as Expert._is_decided for every row
+        """
+        if self.expert.stop_threshold is None:
+            return np.zeros(len(rows), dtype=bool)
+        scores = self.scores[rows]
+        posteriors, _ = self.get_probabilities(rows)
+        best = posteriors[np.arange(len(rows)), np.argmax(scores, axis=1)]
+        return best >= self.expert.stop_threshold * posteriors.sum(axis=1)
+
+    def get_expected_entropies(self, rows: np.ndarray, question_numbers: np.ndarray) -> np.ndarray:
+        """The same as Expert._get_expected_entropies for every row
+
+        :param question_numbers: numbers of questions of every row, rows x questions
+        :return: expected entropies of the same shape
+        """
+        p, q = self.get_probabilities(rows)
+        # The axes are rows, outcomes and questions
+        p, q = p[:, :, np.newaxis], q[:, :, np.newaxis]
+        p_y = self.catalog.presence.T[question_numbers].transpose(0, 2, 1)
+        p_n = self.catalog.absence.T[question_numbers].transpose(0, 2, 1)
+        probability_of_yes = (p * p_y).sum(axis=1) / p.sum(axis=1)
+        return (probability_of_yes * _get_entropy(self.expert._calculate_answer_yes(p, q, p_y, p_n), axis=1) +
+                (1 - probability_of_yes) * _get_entropy(self.expert._calculate_answer_no(p, q, p_y, p_n), axis=1))
+
+
+def score_answers(expert_class: type, answers: np.ndarray, number_of_outcomes: int=None) -> tuple:
+    """Score answer vectors the same way as Expert.handle_answers does (with the current settings of the
+    expert class, e.g. adaptive_questions and stop_threshold), but all the rows are calculated at once
+
+    :param expert_class: a subclass of Expert
+    :param answers: answer ids, rows x questions, UNANSWERED for the questions without an answer
+    :param number_of_outcomes: a number of the best outcomes of every row (ranking_size by default)
+    :return: a tuple of arrays, rows x number_of_outcomes: numbers of the best outcomes
+    (sorted from the most probable one) and their a posteriori probabilities
+    """
+    expert = expert_class()
+    answers = np.asarray(answers)
+    if answers.ndim != 2 or answers.shape[1] != len(expert.questions):
+        raise ValueError(f'Answer vectors of {expert_class.__name__} must have {len(expert.questions)} answers')
+    if not np.isin(answers, (0, 1, 2, 3, 4, UNANSWERED)).all():
+        raise RangeException('Rate number is out of range: [0;4]')
+    answers = answers.astype(np.uint8)
+    if number_of_outcomes is None:
+        number_of_outcomes = expert.ranking_size
+
+    number_of_rows, number_of_questions = answers.shape
+    state = _BatchState(expert, number_of_rows)
+    if not expert.adaptive_questions:
+        # All the answers are handled in order of questions
+        for question_number in range(number_of_questions):
+            rows = np.flatnonzero(answers[:, question_number] != UNANSWERED)
+            state.handle_answers(rows, np.full(len(rows), question_number), answers[rows, question_number])
+    else:
+        # Every row follows its own order of questions and stops where the quiz has stopped.
+        # All the rows which are left have been asked the same number of questions
+        asked = np.zeros(answers.shape, dtype=bool)
+        rows = np.arange(number_of_rows)
+        for step in range(number_of_questions):
+            rows = rows[~state.is_decided(rows)]
+            if not len(rows):
+                break
+            unasked = np.nonzero(~asked[rows])[1].reshape(len(rows), number_of_questions - step)
+            expected_entropies = state.get_expected_entropies(rows, unasked)
+            question_numbers = unasked[np.arange(len(rows)), np.argmin(expected_entropies, axis=1)]
+            rates = answers[rows, question_numbers]
+            answered = rates != UNANSWERED
+            rows, question_numbers, rates = rows[answered], question_numbers[answered], rates[answered]
+            asked[rows, question_numbers] = True
+            state.handle_answers(rows, question_numbers, rates)
+
+    best = np.argsort(-state.scores, axis=1, kind='mergesort')[:, :number_of_outcomes]
+    posteriors, _ = state.get_probabilities(np.arange(number_of_rows))
+    return best, posteriors[np.arange(number_of_rows)[:, np.newaxis], best]
+
+
+def _parse_rows(rows: list, number_of_questions: int) -> tuple:
+    """
+    :return: session ids and an array of answer vectors
+    """
+    answers = np.full((len(rows), number_of_questions), UNANSWERED, dtype=int)
+    session_ids = []
+    for row_number, row in enumerate(rows):
+        if len(row) != number_of_questions + 1:
+            raise ValueError(f'Session {row[0]} must have {number_of_questions} answers')
+        session_ids.append(row[0])
+        answers[row_number] = [int(rate) if rate else UNANSWERED for rate in row[1:]]
+    return session_ids, answers
+
+
+def score_file(expert_class: type, input_file, output_file, number_of_outcomes: int=None,
+               chunk_size: int=DEFAULT_CHUNK_SIZE, header: bool=False) -> int:
+    """Score sessions of a CSV file chunk by chunk, so a file of any size is scored in constant memory
+
+    :param input_file: rows of a session id and answer ids of all the questions
+    :param output_file: rows of a session id, a rank, an outcome id, a producer, a model and a probability
+    :param header: skip the first row of the input
+    :return: a number of the scored sessions
+    """
+    number_of_questions = len(expert_class.get_catalog().questions)
+    reader, writer = csv.reader(input_file), csv.writer(output_file)
+    if header:
+        next(reader, None)
+    writer.writerow(('session', 'rank', 'outcome_id', 'producer', 'model', 'probability'))
+
+    outcomes = expert_class.get_catalog().outcomes
+    number_of_sessions = 0
+    while True:
+        rows = [row for row in islice(reader, chunk_size) if row]
+        if not rows:
+            return number_of_sessions
+        session_ids, answers = _parse_rows(rows, number_of_questions)
+        best, probabilities = score_answers(expert_class, answers, number_of_outcomes)
+        for session_id, outcome_numbers, outcome_probabilities in zip(session_ids, best.tolist(),
+                                                                      probabilities.tolist()):
+            for rank, (outcome_number, probability) in enumerate(zip(outcome_numbers, outcome_probabilities), 1):
+                outcome = outcomes[outcome_number]
+                writer.writerow((session_id, rank, outcome['id'], outcome['producer'], outcome['model'],
+                                 f'{probability:.6g}'))
+        number_of_sessions += len(rows)
+
+
+def main() -> int:
+    experts = {expert_class.__name__: expert_class for expert_class in EXPERTS}
+    parser = argparse.ArgumentParser(prog='python -m experts.batch', description='Score logged quiz sessions')
+    parser.add_argument('expert', choices=sorted(experts))
+    parser.add_argument('input', help='a CSV file of session ids and answer ids of all the questions ("-": stdin)')
+    parser.add_argument('--output', default='-', help='a CSV file of the best outcomes of every session')
+    parser.add_argument('--top', type=int, help='a number of the best outcomes of every session')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='sessions scored at once')
+    parser.add_argument('--header', action='store_true', help='skip the first row of the input')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='the sessions were asked the most informative question first (as with run_bot.py)')
+    parser.add_argument('--stop-threshold', type=float, metavar='SHARE',
+                        help='the sessions were finished at this share of the best outcome (as with run_bot.py)')
+    parser.add_argument('--log-odds', action='store_true', help='calculate in the log-odds form')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+    expert_class = experts[args.expert]
+    expert_class.adaptive_questions = args.adaptive
+    expert_class.stop_threshold = args.stop_threshold
+    if args.log_odds:
+        expert_class.posterior_mode = LOG_ODDS_MODE
+
+    started = time.perf_counter()
+    input_file = sys.stdin if args.input == '-' else open(args.input, newline='')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        number_of_sessions = score_file(expert_class, input_file, output_file, args.top, args.chunk_size,
+                                        args.header)
+    except (ValueError, RangeException) as error:
+        log.error(f'{args.input}: {error}')
+        return 1
+    finally:
+        for file in (input_file, output_file):
+            if file not in (sys.stdin, sys.stdout):
+                file.close()
+    log.info(f'Scored {number_of_sessions} sessions in {time.perf_counter() - started:.2f} s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class PosteriorCache:
+    """A bounded LRU cache of expert states keyed by expert settings, catalog and answer prefix.
+
+    Answers can take only five values, so many users give the same answers to the first questions.
+    The state of an expert after such a prefix is calculated once and then shared (it is never modified)
+    """
+
+    def __init__(self, max_entries: int=10000):
+        """
+        :param max_entries: a maximum number of cached states
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._states = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: tuple) -> tuple or None:
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._states.move_to_end(key)
+            return state
+
+    def put(self, key: tuple, state: tuple) -> None:
+        with self._lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            if len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(size=len(self._states), max_entries=self.max_entries, hits=self.hits, misses=self.misses)
+
+    def __len__(self):
+        return len(self._states)
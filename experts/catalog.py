@@ -0,0 +1,113 @@
+import sys
+from itertools import count
+from types import MappingProxyType
+
+import numpy as np
+
+from experts.exceptions import OutcomesValidationException
+
+# Every catalog loaded by a process gets its own number (look at Catalog.generation)
+_GENERATIONS = count()
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+def _freeze(value):
+    """Recursively convert dictionaries and lists into read-only equivalents
+
+    :param value: a value loaded from the knowledge base
+    :return: the same data wrapped into MappingProxyType and tuple objects
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class Catalog:
+    """An immutable knowledge base of one expert (questions and outcomes).
+
+    A catalog is loaded once per process and shared between all the expert instances,
+    so every quiz session keeps only its own a posteriori probabilities.
+    Conditional probabilities are stored as dense (outcomes x questions) arrays,
+    together with their logarithmic likelihood ratios for the log-odds mode.
+    """
+
+    __slots__ = ('name', 'generation', 'questions', 'outcomes', 'priors', 'presence', 'absence',
+                 'prior_log_odds', 'log_ratio_yes', 'log_ratio_no', '__weakref__')
+
+    def __init__(self, name: str, questions: list, outcomes: list,
+                 priors: np.ndarray, presence: np.ndarray, absence: np.ndarray):
+        """
+        :param name: a name of the knowledge base (e.g. data file name)
+        :param questions: a list of questions
+        :param outcomes: a list of outcome dictionaries (without questions_estimation)
+        :param priors: a priori probabilities of the outcomes
+        :param presence: conditional probabilities in presence (outcomes x questions)
+        :param absence: conditional probabilities in absence (outcomes x questions)
+        """
+        self.name = name
+        # A unique number of the catalog in the process. Caches key on it instead of the catalog itself,
+        # so a replaced catalog is freed, and unlike id() it is never reused by a later catalog
+        self.generation = next(_GENERATIONS)
+        self.questions = tuple(questions)
+        self.outcomes = tuple(_freeze(outcome) for outcome in outcomes)
+        self.priors = _read_only(priors)
+        self.presence = _read_only(presence)
+        self.absence = _read_only(absence)
+
+        # Bayes' theorem in the log-odds form: log_odds(H|E) = log_odds(H) + log(P(E|H) / P(E|not H))
+        self.prior_log_odds = _read_only(np.log(self.priors / (1 - self.priors)))
+        self.log_ratio_yes = _read_only(np.log(self.presence / self.absence))
+        self.log_ratio_no = _read_only(np.log((1 - self.presence) / (1 - self.absence)))
+
+    @classmethod
+    def from_outcomes(cls, name: str, questions: list, outcomes: list) -> 'Catalog':
+        """Create a catalog from the outcome dictionaries of a data file.
+        Their questions_estimation dictionaries are converted into the arrays
+
+        :param name: a name of the knowledge base (e.g. data file name)
+        :param questions: a list of questions
+        :param outcomes: a list of outcome dictionaries
+        """
+        return cls(name, questions,
+                   [{key: value for key, value in outcome.items() if key != 'questions_estimation'}
+                    for outcome in outcomes],
+                   np.array([outcome['priori_probability'] for outcome in outcomes], dtype=float),
+                   cls._build_table(outcomes, len(questions), 'probability_in_presence'),
+                   cls._build_table(outcomes, len(questions), 'probability_in_absence'))
+
+    @staticmethod
+    def _build_table(outcomes: list, number_of_questions: int, key: str) -> np.ndarray:
+        """Collect conditional probabilities of all the outcomes into one array
+
+        :param outcomes: a list of outcome dictionaries
+        :param number_of_questions: a number of questions
+        :param key: probability_in_presence or probability_in_absence
+        :return: an array of shape (number of outcomes, number of questions)
+        """
+        table = np.empty((len(outcomes), number_of_questions), dtype=float)
+        for outcome_number, outcome in enumerate(outcomes):
+            for question_number in range(number_of_questions):
+                estimation = outcome['questions_estimation'].get(question_number + 1)
+                if estimation is None:
+                    raise OutcomesValidationException(
+                        f'Outcome {outcome["id"]} has no estimation for question {question_number + 1}')
+                table[outcome_number, question_number] = estimation[key]
+        return table
+
+    @property
+    def nbytes(self) -> int:
+        """An approximate size of the catalog in memory: the arrays, the questions and the fields of the outcomes
+        """
+        return (sum(getattr(self, name).nbytes for name in ('priors', 'presence', 'absence', 'prior_log_odds',
+                                                            'log_ratio_yes', 'log_ratio_no')) +
+                sum(sys.getsizeof(question) for question in self.questions) +
+                sum(sys.getsizeof(value) for outcome in self.outcomes for value in outcome.values()))
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.name}: {len(self.questions)} questions, {len(self.outcomes)} outcomes>'
@@ -0,0 +1,61 @@
+"""Validate the knowledge bases of all the experts and compile them into binary snapshots,
+which are loaded by the bot instead of the yaml files:
+
+    $ python -m experts.compile
+"""
+import logging
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from data import get_data_path, load_data
+from experts import EXPERTS
+from experts.base import LOG_FORMAT
+from experts.catalog import Catalog
+from experts.exceptions import OutcomesValidationException, SnapshotException
+from experts.snapshot import SNAPSHOT_SUFFIX, read_snapshot, write_snapshot
+
+log = logging.getLogger('Expert.compile')
+
+
+def compile_expert(expert_class: type) -> Path:
+    """Validate the data file of the expert and write its snapshot next to it
+
+    :param expert_class: a subclass of Expert with data_file_name
+    :return: a path of the snapshot
+    """
+    data = load_data(expert_class.data_file_name)
+    questions, outcomes = data.get('questions'), data.get('outcomes')
+    expert_class._validate_outcome_dicts(outcomes)
+    catalog = Catalog.from_outcomes(expert_class.data_file_name, questions, outcomes)
+
+    # Running bots keep the old file mapped, so a new one replaces it instead of being written in place.
+    # Worker processes may compile the same file at once (see experts.reload), so every one writes its own
+    snapshot_path = get_data_path(expert_class.data_file_name, SNAPSHOT_SUFFIX)
+    temporary_path = snapshot_path.with_suffix(f'{SNAPSHOT_SUFFIX}.{os.getpid()}.tmp')
+    write_snapshot(catalog, str(temporary_path))
+    compiled = read_snapshot(str(temporary_path))
+    if (compiled.questions != catalog.questions or compiled.outcomes != catalog.outcomes or
+            not all(np.array_equal(getattr(compiled, name), getattr(catalog, name))
+                    for name in ('priors', 'presence', 'absence'))):
+        raise SnapshotException(f'{temporary_path} differs from {expert_class.data_file_name}')
+    os.replace(str(temporary_path), str(snapshot_path))
+    return snapshot_path
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    for expert_class in EXPERTS:
+        try:
+            snapshot_path = compile_expert(expert_class)
+        except (OutcomesValidationException, SnapshotException) as error:
+            log.error(f'{expert_class.__name__}: {error}')
+            return 1
+        log.info(f'{expert_class.__name__}: {snapshot_path.name} ({snapshot_path.stat().st_size} bytes)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,3 +11,8 @@ class OutcomesValidationException(Exception):
 class RangeException(Exception):
     def __init__(self, message):
         super().__init__(message)
+
+
+class SnapshotException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
@@ -0,0 +1,127 @@
+import logging
+import time
+from threading import Event, Lock, Thread
+
+from data import get_data_path
+from experts import EXPERTS
+from experts.base import CATALOG_LOAD_SECONDS
+from experts.compile import compile_expert
+from experts.snapshot import SNAPSHOT_SUFFIX, read_snapshot
+from metrics import Counter
+
+CATALOG_RELOADS = Counter('expert_catalog_reloads_total', 'Reloads of changed knowledge bases by their status',
+                          ('expert', 'status'))
+
+
+def _get_mtime(path) -> int or None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class CatalogWatcher:
+    """Watches the data files of the experts and their snapshots in a background thread.
+    A changed data file is validated and compiled into a snapshot (a changed snapshot is only read),
+    then the new catalog replaces the old one at once: new quiz sessions get the new knowledge base,
+    the started ones keep the knowledge base they have been started with.
+    A data file which can not be loaded is reported and the old knowledge base is kept.
+
+    The thread is started by start() in every process which handles quizzes, e.g. in forked worker processes
+    """
+
+    def __init__(self, interval: float=0, prepare=None, experts: tuple=EXPERTS):
+        """
+        :param interval: seconds between checks of the files (0 to turn the watcher off)
+        :param prepare: a function prepare(expert_class, catalog), which is called with a new catalog
+        before it replaces the old one (e.g. to render the replies of the bot)
+        :param experts: the expert classes to watch
+        """
+        self.interval = interval
+        self.prepare = prepare
+        self.experts = experts
+        self.log = logging.getLogger('Expert.reload')
+        self._mtimes = dict()  # expert_class: (mtime of the data file, mtime of the snapshot)
+        self._changed_mtimes = dict()  # expert_class: mtimes of files which are still being written
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    def _get_mtimes(self, expert_class: type) -> tuple:
+        return (_get_mtime(get_data_path(expert_class.data_file_name)),
+                _get_mtime(get_data_path(expert_class.data_file_name, SNAPSHOT_SUFFIX)))
+
+    def start(self) -> None:
+        """Remember the current versions of the files and start watching them (only once per process)
+        """
+        with self._lock:
+            if self._thread is not None or not self.interval:
+                return
+            self._mtimes = {expert_class: self._get_mtimes(expert_class)
+                            for expert_class in self.experts if expert_class.data_file_name}
+            self._thread = Thread(target=self._watch, name='catalog-watcher', daemon=True)
+            self._thread.start()
+        self.log.info(f'Watching {len(self._mtimes)} knowledge bases every {self.interval} s')
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                self.log.exception('Can not check the knowledge bases')
+
+    def check(self) -> list:
+        """Reload the knowledge bases whose files have been changed. A file is reloaded when it has not been
+        changed since the previous check, so a file which is still being written is not loaded
+
+        :return: the expert classes with reloaded knowledge bases
+        """
+        reloaded = []
+        for expert_class, mtimes in list(self._mtimes.items()):
+            current_mtimes = self._get_mtimes(expert_class)
+            if current_mtimes == mtimes:
+                continue
+            if self._changed_mtimes.get(expert_class) != current_mtimes:
+                self._changed_mtimes[expert_class] = current_mtimes
+                continue
+            del self._changed_mtimes[expert_class]
+            if self.reload(expert_class):
+                reloaded.append(expert_class)
+        return reloaded
+
+    def reload(self, expert_class: type) -> bool:
+        """Load, validate and swap in the knowledge base of the expert
+
+        :return: False if the knowledge base can not be loaded
+        """
+        name = expert_class.__name__
+        data_mtime, snapshot_mtime = self._get_mtimes(expert_class)
+        snapshot_path = get_data_path(expert_class.data_file_name, SNAPSHOT_SUFFIX)
+        started = time.perf_counter()
+        try:
+            with CATALOG_LOAD_SECONDS.time(name, 'reload'):
+                if data_mtime is not None and (snapshot_mtime is None or data_mtime > snapshot_mtime):
+                    compile_expert(expert_class)
+                catalog = read_snapshot(str(snapshot_path))
+            if self.prepare is not None:
+                self.prepare(expert_class, catalog)
+        except Exception:
+            CATALOG_RELOADS.inc(name, 'error')
+            self.log.exception(f'{name}: can not reload {expert_class.data_file_name}, the old knowledge base is kept')
+            return False
+        finally:
+            # A broken file is not loaded again until it is changed
+            self._mtimes[expert_class] = self._get_mtimes(expert_class)
+
+        old_catalog = expert_class.set_catalog(catalog)
+        CATALOG_RELOADS.inc(name, 'ok')
+        self.log.info(f'{name}: reloaded {len(catalog.questions)} questions and {len(catalog.outcomes)} outcomes '
+                      f'in {(time.perf_counter() - started) * 1e3:.1f} ms, memory '
+                      f'{old_catalog.nbytes if old_catalog is not None else 0} -> {catalog.nbytes} bytes '
+                      f'(the old one is kept by the started quiz sessions)')
+        return True
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
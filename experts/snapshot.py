@@ -0,0 +1,107 @@
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from experts.catalog import Catalog
+from experts.exceptions import SnapshotException
+
+SNAPSHOT_SUFFIX = '.kb'
+SNAPSHOT_VERSION = 1
+_MAGIC = b'EXPERTKB'
+_HEADER_LENGTH = struct.Struct('<Q')
+_TABLES = ('priors', 'presence', 'absence')
+_ALIGNMENT = 8
+
+
+def _intern(strings: dict, value: str) -> int:
+    """Get an index of the string in the string table (add it if it is not there yet)
+    """
+    index = strings.get(value)
+    if index is None:
+        index = strings[value] = len(strings)
+    return index
+
+
+def write_snapshot(catalog: Catalog, path: str) -> None:
+    """Write a knowledge base into a binary file which can be loaded without parsing and validation.
+
+    The file consists of the magic bytes, the length of a JSON header, the header itself
+    (questions and outcomes, their strings are replaced by indices in a table of unique strings)
+    and the float64 arrays of probabilities aligned to 8 bytes
+
+    :param catalog: a validated knowledge base
+    :param path: a path of the snapshot file
+    """
+    strings = dict()  # string: index
+    fields = sorted({field for outcome in catalog.outcomes for field in outcome})
+    string_fields = sorted({field for outcome in catalog.outcomes for field, value in outcome.items()
+                            if isinstance(value, str)})
+    outcomes = []
+    for outcome in catalog.outcomes:
+        values = []
+        for field in fields:
+            value = outcome.get(field)
+            if field in string_fields and value is not None:
+                if not isinstance(value, str):
+                    raise SnapshotException(f'Outcome {outcome.get("id")}: {field} must be a string, not {value!r}')
+                value = _intern(strings, value)
+            values.append(value)
+        outcomes.append(values)
+
+    tables = dict()
+    offset = 0
+    for table_name in _TABLES:
+        table = getattr(catalog, table_name)
+        tables[table_name] = dict(offset=offset, shape=table.shape)
+        offset += table.size * 8
+
+    header = dict(version=SNAPSHOT_VERSION, name=catalog.name,
+                  questions=[_intern(strings, question) for question in catalog.questions],
+                  fields=fields, string_fields=string_fields, outcomes=outcomes, tables=tables,
+                  strings=sorted(strings, key=strings.get))
+    header = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-(len(_MAGIC) + _HEADER_LENGTH.size + len(header)) % _ALIGNMENT)
+
+    with open(path, 'wb') as snapshot_file:
+        snapshot_file.write(_MAGIC)
+        snapshot_file.write(_HEADER_LENGTH.pack(len(header)))
+        snapshot_file.write(header)
+        for table_name in _TABLES:
+            snapshot_file.write(np.ascontiguousarray(getattr(catalog, table_name), dtype='<f8').tobytes())
+
+
+def read_snapshot(path: str) -> Catalog:
+    """Load a knowledge base from a binary snapshot. The arrays of probabilities are not copied,
+    they are read-only views of the memory-mapped file
+
+    :param path: a path of the snapshot file
+    :return: a catalog
+    """
+    with open(path, 'rb') as snapshot_file:
+        buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(_MAGIC)] != _MAGIC:
+        raise SnapshotException(f'{path} is not a knowledge base snapshot')
+    header_start = len(_MAGIC) + _HEADER_LENGTH.size
+    header_length, = _HEADER_LENGTH.unpack_from(buffer, len(_MAGIC))
+    header = json.loads(buffer[header_start:header_start + header_length].decode('utf-8'))
+    if header['version'] != SNAPSHOT_VERSION:
+        raise SnapshotException(f'{path}: unsupported snapshot version {header["version"]}')
+
+    strings = header['strings']
+    string_fields = set(header['string_fields'])
+    outcomes = [{field: strings[value] if field in string_fields and value is not None else value
+                 for field, value in zip(header['fields'], values)}
+                for values in header['outcomes']]
+
+    data_start = header_start + header_length
+    tables = dict()
+    for table_name, table in header['tables'].items():
+        shape = tuple(table['shape'])
+        tables[table_name] = np.frombuffer(buffer, dtype='<f8', count=int(np.prod(shape)),
+                                           offset=data_start + table['offset']).reshape(shape)
+
+    return Catalog(header['name'], [strings[index] for index in header['questions']], outcomes,
+                   tables['priors'], tables['presence'], tables['absence'])
@@ -0,0 +1,2 @@
+from .registry import Counter, Histogram, StatsCollector, Registry, REGISTRY
+from .server import MetricsServer
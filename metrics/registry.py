@@ -0,0 +1,217 @@
+import logging
+import time
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds of latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(label_names: tuple, label_values: tuple) -> str:
+    if not label_names:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in label_values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(label_names, escaped)) + '}'
+
+
+class Registry:
+    """All the metrics of a process, rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = Lock()
+
+    def register(self, metric) -> None:
+        with self._lock:
+            if any(registered.name == metric.name for registered in self.metrics):
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self.metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+
+    type = ''  # type: str
+
+    def __init__(self, name: str, documentation: str, label_names: tuple=(), registry: Registry=REGISTRY):
+        """
+        :param name: a name of the metric (e.g. bot_api_requests_total)
+        :param documentation: a description of the metric
+        :param label_names: names of labels, their values are passed to every update of the metric
+        :param registry: a registry to render the metric with (None not to register it)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = dict()  # label values: value
+        self._lock = Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _check_labels(self, label_values: tuple) -> None:
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}, got {label_values}')
+
+    def render(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A number of events which can only grow
+    """
+
+    type = 'counter'
+
+    def inc(self, *label_values, amount: float=1) -> None:
+        self._check_labels(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+                for label_values, value in values]
+
+
+class _Timer:
+
+    __slots__ = ('histogram', 'label_values', 'started')
+
+    def __init__(self, histogram: 'Histogram', label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+class Histogram(_Metric):
+    """A distribution of values (e.g. latencies) counted in buckets, together with their sum and count
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple=(),
+                 buckets: tuple=DEFAULT_BUCKETS, registry: Registry=REGISTRY):
+        """
+        :param buckets: sorted upper bounds of the buckets (+Inf is added automatically)
+        """
+        self.buckets = tuple(sorted(buckets)) + (float('inf'), )
+        super().__init__(name, documentation, label_names, registry)
+
+    def observe(self, value: float, *label_values) -> None:
+        self._check_labels(label_values)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # Counts of the buckets (not cumulative), the sum and the count of values
+                counts = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def time(self, *label_values) -> _Timer:
+        """Observe the duration of a with block
+        """
+        self._check_labels(label_values)
+        return _Timer(self, label_values)
+
+    def get_count(self, *label_values) -> int:
+        counts = self._values.get(label_values)
+        return counts[-1] if counts else 0
+
+    def render(self) -> list:
+        with self._lock:
+            values = [(label_values, list(counts)) for label_values, counts in self._values.items()]
+        lines = []
+        label_names = self.label_names + ('le', )
+        for label_values, counts in values:
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets, counts):
+                cumulative_count += count
+                labels = _format_labels(label_names, label_values + (_format_value(upper_bound), ))
+                lines.append(f'{self.name}_bucket{labels} {cumulative_count}')
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-2])}')
+            lines.append(f'{self.name}_count{labels} {counts[-1]}')
+        return lines
+
+
+class StatsCollector(_Metric):
+    """Numbers from stats() methods of objects (e.g. queue depths, retries and cache hits), read at every scrape.
+    Every number of a stats dictionary is a sample with its key in the "stat" label,
+    every item of a list of numbers is a sample with its index appended to the key (e.g. queue_sizes_0)
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple=(), registry: Registry=REGISTRY):
+        """
+        :param label_names: names of labels of the objects, the "stat" label is added to them
+        """
+        super().__init__(name, documentation, tuple(label_names) + ('stat', ), registry)
+        self.log = logging.getLogger(f'Metrics.{type(self).__name__}')
+
+    def add(self, stats, *label_values) -> None:
+        """Read the numbers of an object at every scrape
+
+        :param stats: a function which returns a dictionary of numbers or lists of numbers (e.g. Dispatcher.stats)
+        :param label_values: labels of the object (an object with the same labels is replaced)
+        """
+        self._check_labels(label_values + ('', ))
+        with self._lock:
+            self._values[label_values] = stats
+
+    def remove(self, *label_values) -> None:
+        """Stop reading the numbers of an object (e.g. after it is closed)
+        """
+        with self._lock:
+            self._values.pop(label_values, None)
+
+    def render(self) -> list:
+        with self._lock:
+            sources = list(self._values.items())
+        lines = []
+        for label_values, stats in sources:
+            try:
+                values = stats()
+            except Exception:
+                self.log.exception(f'Can not read {self.name}{_format_labels(self.label_names[:-1], label_values)}')
+                continue
+            for stat, value in values.items():
+                if isinstance(value, (list, tuple)):
+                    samples = [(f'{stat}_{index}', item) for index, item in enumerate(value)]
+                else:
+                    samples = [(stat, value)]
+                for sample_stat, sample_value in samples:
+                    labels = _format_labels(self.label_names, label_values + (sample_stat, ))
+                    lines.append(f'{self.name}{labels} {_format_value(sample_value)}')
+        return lines
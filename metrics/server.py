@@ -0,0 +1,58 @@
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+
+from .registry import REGISTRY, Registry
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """A local HTTP endpoint which serves all the metrics of the registry in the Prometheus text format
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str='127.0.0.1', port: int=9100, path: str='/metrics', registry: Registry=REGISTRY):
+        """
+        :param host: an address to listen on
+        :param port: a port to listen on
+        :param path: a path of the endpoint
+        :param registry: metrics to serve
+        """
+        self.endpoint_path = path
+        self.registry = registry
+        self.log = logging.getLogger(f'Metrics.{type(self).__name__}')
+        super().__init__((host, port), MetricsRequestHandler)
+
+    def start(self) -> Thread:
+        """Serve requests in a background thread
+        """
+        thread = Thread(target=self.serve_forever, name='metrics', daemon=True)
+        thread.start()
+        self.log.info(f'Metrics are served on http://{self.server_address[0]}:{self.server_address[1]}'
+                      f'{self.endpoint_path}')
+        return thread
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    server = None  # type: MetricsServer
+
+    def do_GET(self) -> None:
+        if self.path != self.server.endpoint_path:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        self.server.log.debug(format % args)
@@ -1,6 +1,24 @@
+import argparse
+import asyncio
+import logging
+import secrets
+import time
+from functools import lru_cache, partial
+from threading import Lock
+from weakref import WeakKeyDictionary
+
 import misc
-from bot import ExpertBotHandler
-from experts import AudioInterface, Soundproofing, Microphone, StudioMonitor, MixingConsole, Software
+from bot import (ExpertBotHandler, QuizSession, MemoryStorage, SQLiteStorage, SendScheduler, RateLimiter,
+                 Dispatcher, WebhookServer, UpdateIngestion)
+from bot.expert_bot import API_URL, CallbackQuery
+from bot.render import RenderCache
+from bot.scheduler import GLOBAL_MESSAGES_PER_SECOND
+from bot.speculation import Speculator
+from experts import EXPERTS, AudioInterface, Soundproofing, Microphone, StudioMonitor, MixingConsole, Software
+from experts.base import Expert, LOG_FORMAT
+from experts.catalog import Catalog
+from experts.reload import CatalogWatcher
+from metrics import Histogram, MetricsServer, StatsCollector
 
 EQUIPMENTS = ({
         'Аудіо інтерфейс': AudioInterface,
@@ -43,130 +61,508 @@ QUESTION_NUMBER_PREFIX = ('Поточне питання: ', 'Current question:
 DONE_MESSAGE = ('Готово', 'Done')
 LANGUAGES = {'🇺🇦UA': 0, '🇺🇸US': 1}
 DEFAULT_LANGUAGE_ID = 0  # UA
+# Commands, which only send the same reply again, so repeated ones can be merged in a backlog
+MERGEABLE_TEXTS = frozenset(('/start', '/menu', '/help', '/settings'))
+CALLBACK_ANSWER = '{step} {answer_id}'  # data of an answer button of an inline keyboard
+MAX_CAPTION_LENGTH = 1024
+# Answers to the sent questions are calculated in advance if --speculate is set (one thread per process)
+SPECULATOR = Speculator()
+# Changed knowledge bases are reloaded if --reload is set (one thread per process which handles quizzes)
+CATALOG_WATCHER = CatalogWatcher()
+# Queue depths, retries and cache hits of this process are read from the stats() of the components at every scrape
+COMPONENT_STATS = StatsCollector('bot_component_stats', 'Current numbers of the queues and caches of the bot',
+                                 ('component', 'worker'))
+
+
+def get_posterior_cache_stats() -> dict:
+    return Expert.posterior_cache.stats() if Expert.posterior_cache is not None else dict()
+
+
+COMPONENT_STATS.add(get_posterior_cache_stats, 'posterior_cache', '')
+COMPONENT_STATS.add(SPECULATOR.stats, 'speculator', '')
+
+
+def format_result(result: dict, language_id: int, max_length: int=None) -> str:
+    """Format a result message
+
+    :param max_length: a maximum length of the message, the description is shortened to fit it
+    """
+    description = str(result.get('description'))
+    text = RESULT_MESSAGE[language_id].format(
+        producer=result.get('producer'), model=result.get('model'), description=description)
+    if max_length is None or len(text) <= max_length:
+        return text
+    description = description[:len(description) - (len(text) - max_length) - 1].rsplit(' ', 1)[0] + '…'
+    return RESULT_MESSAGE[language_id].format(
+        producer=result.get('producer'), model=result.get('model'), description=description)
+
+
+def parse_callback_answer(callback_query: CallbackQuery, language_id: int) -> tuple:
+    """
+    :param language_id: a language of the answer buttons
+    :return: a tuple (step, answer_id) of an answer button (None for other data, e.g. an unknown answer_id)
+    """
+    try:
+        step, answer_id = map(int, callback_query.split())
+    except ValueError:
+        return None
+    if not 0 <= answer_id < len(LIST_OF_ANSWERS[language_id]):
+        return None
+    return step, answer_id
+
+
+@lru_cache(maxsize=None)
+def render_replies() -> RenderCache:
+    """Render all the replies of the bot to the commands once.
+    Replies of the quizzes are rendered for the current knowledge bases too (look at render_quiz)
+    """
+    replies = RenderCache()
+    remove_keyboard = ExpertBotHandler.remove_keyboards()
+    for language_id in range(len(LIST_OF_ANSWERS)):
+        replies.add_message(('no_text', language_id), NO_TEXT_MESSAGE[language_id])
+        replies.add_message(('not_available', language_id), NOT_AVAILABLE_TEXT[language_id])
+        replies.add_message(('done', language_id), DONE_MESSAGE[language_id], reply_markup=remove_keyboard)
+        replies.add_message(('start', language_id), START_TEXT[language_id], reply_markup=remove_keyboard)
+        replies.add_message(('help', language_id), '\n'.join(HELP_TEXT[language_id]), reply_markup=remove_keyboard)
+        replies.add_message(('menu', language_id), MENU_TEXT[language_id],
+                            reply_markup=ExpertBotHandler.build_keyboard(list(EQUIPMENTS[language_id].keys())))
+        replies.add_message(('settings', language_id), SETTINGS_TEXT[language_id],
+                            reply_markup=ExpertBotHandler.build_keyboard(list(LANGUAGES.keys())))
+    replies.add_reply_markup_edit(('remove_inline_keyboard', ), ExpertBotHandler.build_inline_keyboard([]))
+
+    for expert_id, expert_class in enumerate(EXPERTS):
+        render_quiz(expert_id, expert_class.get_catalog())
+    return replies
+
+
+# Catalog: {expert_id: RenderCache}. The replies live as long as their knowledge base, i.e. while it is
+# the current one or a started quiz session still uses it, so a reload never evicts replies in use
+QUIZ_REPLIES = WeakKeyDictionary()
+QUIZ_REPLIES_LOCK = Lock()
+
+
+def render_quiz(expert_id: int, catalog: Catalog) -> RenderCache:
+    """Render the replies of a quiz with a knowledge base once: questions and results. A quiz session is answered
+    with the replies of the knowledge base it has been started with, even if the knowledge base is reloaded.
+    Replies of the inline keyboard mode are rendered only if QuizSession.inline_keyboard is set
+    """
+    adaptive_questions = EXPERTS[expert_id].adaptive_questions
+    with QUIZ_REPLIES_LOCK:
+        replies = QUIZ_REPLIES.get(catalog, {}).get((expert_id, adaptive_questions))
+    if replies is not None:
+        return replies
+
+    # Rendering takes a while, so it is not done under the lock (a concurrent render of the same one is dropped)
+    replies = _render_quiz(expert_id, catalog, adaptive_questions)
+    with QUIZ_REPLIES_LOCK:
+        return QUIZ_REPLIES.setdefault(catalog, {}).setdefault((expert_id, adaptive_questions), replies)
+
+
+def get_question_steps(question_number: int, number_of_questions: int, adaptive_questions: bool) -> range:
+    """Steps a question can be asked at: any step in the adaptive mode, otherwise the questions are asked in order
+    """
+    if adaptive_questions:
+        return range(number_of_questions)
+    return range(question_number, question_number + 1)
+
+
+def _render_quiz(expert_id: int, catalog: Catalog, adaptive_questions: bool) -> RenderCache:
+    replies = RenderCache()
+    remove_keyboard = ExpertBotHandler.remove_keyboards()
+    number_of_questions = len(catalog.questions)
+    for language_id, answers in enumerate(LIST_OF_ANSWERS):
+        keyboard = ExpertBotHandler.build_keyboard(answers)
+        for question_number, question_text in enumerate(catalog.questions):
+            for step in get_question_steps(question_number, number_of_questions, adaptive_questions):
+                replies.add_message(('question', expert_id, question_number, step, language_id),
+                                    f'{QUESTION_NUMBER_PREFIX[language_id]}'
+                                    f'({step + 1}/{number_of_questions})\n'
+                                    f'*{question_text}*\n\n'
+                                    f'{STOP_TEXT[language_id]}',
+                                    reply_markup=keyboard)
+        for result_number, result in enumerate(catalog.outcomes):
+            replies.add_message(('result', expert_id, result_number, language_id),
+                                format_result(result, language_id), reply_markup=remove_keyboard)
+
+        if QuizSession.inline_keyboard:
+            render_inline_quiz(replies, expert_id, catalog, language_id, adaptive_questions)
 
+    for result_number, result in enumerate(catalog.outcomes):
+        file_id = result.get('image_id')
+        if file_id:
+            replies.add_photo(('photo', expert_id, result_number), file_id, caption='{} {}'.format(
+                result.get('producer'), result.get('model')))
+    return replies
+
+
+def render_reloaded_quiz(expert_class: type, catalog: Catalog) -> None:
+    """Render the replies of a reloaded knowledge base before it is swapped in (look at CatalogWatcher)
+    """
+    render_quiz(EXPERTS.index(expert_class), catalog)
 
-def send_question(expert_bot: ExpertBotHandler, last_chat_id: int, question_text: str,
-                  question_number: int, number_of_questions: int, current_language_id: int) -> None:
+
+def render_inline_quiz(replies: RenderCache, expert_id: int, catalog: Catalog, language_id: int,
+                       adaptive_questions: bool) -> None:
+    """Render questions with inline keyboards, which are edited in place, and results in one photo
+    """
+    number_of_questions = len(catalog.questions)
+    keyboards = [ExpertBotHandler.build_inline_keyboard([
+        (answer, CALLBACK_ANSWER.format(step=step, answer_id=answer_id))
+        for answer_id, answer in enumerate(LIST_OF_ANSWERS[language_id])]) for step in range(number_of_questions)]
+    for question_number, question_text in enumerate(catalog.questions):
+        for step in get_question_steps(question_number, number_of_questions, adaptive_questions):
+            replies.add_message(('inline_question', expert_id, question_number, step, language_id),
+                                f'{QUESTION_NUMBER_PREFIX[language_id]}'
+                                f'({step + 1}/{number_of_questions})\n'
+                                f'*{question_text}*\n\n'
+                                f'{STOP_TEXT[language_id]}',
+                                reply_markup=keyboards[step])
+
+    for result_number, result in enumerate(catalog.outcomes):
+        # A result without a photo replaces the last question
+        replies.add_message(('inline_result', expert_id, result_number, language_id),
+                            format_result(result, language_id))
+        file_id = result.get('image_id')
+        caption = format_result(result, language_id, MAX_CAPTION_LENGTH)
+        if file_id and len(caption) <= MAX_CAPTION_LENGTH:
+            replies.add_photo(('inline_photo', expert_id, result_number, language_id), file_id,
+                              caption=caption, parse_mode='Markdown')
+
+
+def send_question(expert_bot: ExpertBotHandler, last_chat_id: int, quiz_session: QuizSession,
+                  message_id: int=None) -> None:
     """Send current question from quiz to user
+
+    :param message_id: a message with the inline keyboard of the previous question to edit
     """
-    keyboard = expert_bot.build_keyboard(LIST_OF_ANSWERS[current_language_id])
-    expert_bot.send_message(chat_id=last_chat_id,
-                            text=f'{QUESTION_NUMBER_PREFIX[current_language_id]}'
-                                 f'({question_number + 1}/{number_of_questions})\n'
-                                 f'*{question_text}*\n\n'
-                                 f'{STOP_TEXT[current_language_id]}',
-                            reply_markup=keyboard)
+    replies = render_quiz(quiz_session.expert_id, quiz_session.catalog)
+    key = (quiz_session.expert_id, quiz_session.question_number, quiz_session.current_step, quiz_session.language_id)
+    if not QuizSession.inline_keyboard:
+        expert_bot.send_payload(last_chat_id, replies[('question', ) + key])
+    elif message_id is None:
+        expert_bot.send_payload(last_chat_id, replies[('inline_question', ) + key])
+    else:
+        expert_bot.send_payload(last_chat_id, replies.get_edit(('inline_question', ) + key), message_id)
+    # The user reads the question now, so all the answers to it are calculated meanwhile
+    SPECULATOR.speculate(last_chat_id, quiz_session)
+
+
+def send_result(expert_bot: ExpertBotHandler, last_chat_id: int, quiz_session: QuizSession,
+                message_id: int=None) -> None:
+    """Send the result of a finished quiz to user
+
+    :param message_id: a message with the inline keyboard of the last question
+    """
+    replies = render_quiz(quiz_session.expert_id, quiz_session.catalog)
+    key = (quiz_session.expert_id, quiz_session.get_result_number(), quiz_session.language_id)
+    if QuizSession.inline_keyboard:
+        if ('inline_photo', ) + key in replies:
+            if message_id is not None:
+                # Buttons of the last question must not stay under the finished quiz
+                expert_bot.send_payload(last_chat_id, render_replies()[('remove_inline_keyboard', )], message_id)
+            expert_bot.send_payload(last_chat_id, replies[('inline_photo', ) + key])
+            return
+        if message_id is not None:
+            expert_bot.send_payload(last_chat_id, replies.get_edit(('inline_result', ) + key), message_id)
+            return
+
+    photo_key = ('photo', ) + key[:2]
+    if photo_key in replies:
+        expert_bot.send_payload(last_chat_id, replies[photo_key])
+    expert_bot.send_payload(last_chat_id, replies[('result', ) + key])
+
+
+def answer_question(expert_bot: ExpertBotHandler, storage: MemoryStorage, last_chat_id: int,
+                    quiz_session: QuizSession, answer_id: int, message_id: int=None) -> None:
+    """Save an answer and send the next question or the result
+
+    :param answer_id: No: 0, Probably no: 1, Do not know: 2, Probably: 3, Yes: 4
+    :param message_id: a message with the inline keyboard of the answered question
+    """
+    # Save the answer, probabilities are calculated only for the result
+    quiz_session.answer(answer_id)
+    storage.set_session(last_chat_id, quiz_session)
+
+    if quiz_session.is_finished:
+        send_result(expert_bot, last_chat_id, quiz_session, message_id)
+        storage.delete_session(last_chat_id)
+    else:
+        # Send next question
+        send_question(expert_bot, last_chat_id, quiz_session, message_id)
+
+
+UPDATE_SECONDS = Histogram('bot_update_seconds', 'Time from receiving an update to the end of its handling')
+
+
+def handle_message(expert_bot: ExpertBotHandler, storage: MemoryStorage,
+                   last_chat_id: int, last_chat_text: str) -> None:
+    """Run one step of the conversation with a user (commands, menus and the quiz)
+
+    :param expert_bot: a bot (or any object with the same interface) to send the replies with
+    :param storage: languages and quiz sessions of all the chats
+    :param last_chat_id: an id of the chat the message came from
+    :param last_chat_text: a text of the message (None if the message has no text)
+    or a CallbackQuery of a pressed inline keyboard button
+    """
+    replies = render_replies()
+    current_language_id = storage.get_language(last_chat_id, DEFAULT_LANGUAGE_ID)
+    quiz_session = storage.get_session(last_chat_id)
+    is_current_user_in_quiz = quiz_session is not None
+    if is_current_user_in_quiz:
+        current_language_id = quiz_session.language_id
+
+    if isinstance(last_chat_text, CallbackQuery):
+        # Stop the progress bar on the button first
+        expert_bot.answer_callback_query(last_chat_id, last_chat_text.id)
+        answer = parse_callback_answer(last_chat_text, current_language_id)
+        # Buttons of finished quizzes and of answered questions (e.g. a double tap) are ignored
+        if is_current_user_in_quiz and answer is not None and answer[0] == quiz_session.current_step:
+            answer_question(expert_bot, storage, last_chat_id, quiz_session, answer[1], last_chat_text.message_id)
+
+    elif not last_chat_text:
+        # There is no text in this update
+        expert_bot.send_payload(last_chat_id, replies['no_text', current_language_id])
+
+    elif is_current_user_in_quiz:
+        if last_chat_text in LIST_OF_ANSWERS[current_language_id]:
+            answer_id = LIST_OF_ANSWERS[current_language_id].index(last_chat_text)
+            answer_question(expert_bot, storage, last_chat_id, quiz_session, answer_id)
+
+        elif last_chat_text == '/stop':
+            # Stop this quiz
+            storage.delete_session(last_chat_id)
+            SPECULATOR.cancel(last_chat_id)
+            expert_bot.send_payload(last_chat_id, replies['done', current_language_id])
+
+        elif last_chat_text.startswith('/'):
+            expert_bot.send_payload(last_chat_id, replies['not_available', current_language_id])
+            send_question(expert_bot, last_chat_id, quiz_session)
+
+    elif last_chat_text == '/start':
+        expert_bot.send_payload(last_chat_id, replies['start', current_language_id])
+
+    elif last_chat_text == '/menu':
+        expert_bot.send_payload(last_chat_id, replies['menu', current_language_id])
+
+    elif last_chat_text == '/help':
+        expert_bot.send_payload(last_chat_id, replies['help', current_language_id])
+
+    elif last_chat_text == '/settings':
+        expert_bot.send_payload(last_chat_id, replies['settings', current_language_id])
+
+    elif last_chat_text in LANGUAGES:
+        current_language_id = LANGUAGES.get(last_chat_text, DEFAULT_LANGUAGE_ID)
+        storage.set_language(last_chat_id, current_language_id)
+        expert_bot.send_payload(last_chat_id, replies['done', current_language_id])
+
+    elif last_chat_text in EQUIPMENTS[current_language_id]:
+        chosen_class = EQUIPMENTS[current_language_id][last_chat_text]
+        quiz_session = QuizSession.start(chosen_class, current_language_id)
+        if quiz_session.is_finished:
+            # With a stop threshold the result can be decided by the a priori probabilities alone
+            send_result(expert_bot, last_chat_id, quiz_session)
+            return
+        storage.set_session(last_chat_id, quiz_session)
+
+        # Send first question to user
+        send_question(expert_bot, last_chat_id, quiz_session)
+
+
+def handle_received_message(expert_bot: ExpertBotHandler, storage: MemoryStorage,
+                            last_chat_id: int, message: tuple) -> None:
+    """Handle a message and observe the time since it has been received
+
+    :param message: a tuple (text, received_at), received_at is a value of time.monotonic()
+    """
+    last_chat_text, received_at = message
+    handle_message(expert_bot, storage, last_chat_id, last_chat_text)
+    UPDATE_SECONDS.observe(time.monotonic() - received_at)
+
+
+def create_storage(partition: tuple=None) -> MemoryStorage:
+    """Keep languages and quiz sessions in a database if it is set in misc.py (database = 'path.sqlite3')
+
+    :param partition: (worker_number, number_of_workers) to load only the chats of one worker
+    """
+    database = getattr(misc, 'database', None)
+    if database:
+        return SQLiteStorage(database, partition=partition)
+    return MemoryStorage()
+
+
+class ChatWorker:
+    """Handles the messages of the chats of one Dispatcher worker (in a thread or in a process)
+    """
+
+    def __init__(self, worker_number: int, number_of_workers: int):
+        self.worker_number = worker_number
+        # The global rate limit is shared by all the workers
+        self.scheduler = SendScheduler(RateLimiter(global_rate=GLOBAL_MESSAGES_PER_SECOND / number_of_workers))
+        self.expert_bot = ExpertBotHandler(misc.token, scheduler=self.scheduler)
+        self.storage = create_storage((worker_number, number_of_workers))
+        COMPONENT_STATS.add(self.scheduler.stats, 'send_queue', str(worker_number))
+        CATALOG_WATCHER.start()
+
+    def handle(self, chat_id: int, message: tuple) -> None:
+        handle_received_message(self.expert_bot, self.storage, chat_id, message)
+
+    def close(self) -> None:
+        CATALOG_WATCHER.close()
+        COMPONENT_STATS.remove('send_queue', str(self.worker_number))
+        self.scheduler.close()
+        self.storage.close()
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Sound recording studio expert bot')
+    parser.add_argument('--async', dest='use_asyncio', action='store_true',
+                        help='handle chats concurrently with asyncio')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='handle chats in parallel by this number of workers')
+    parser.add_argument('--processes', action='store_true',
+                        help='run workers in processes instead of threads')
+    parser.add_argument('--webhook', metavar='URL',
+                        help='receive updates on this public HTTPS url instead of polling')
+    parser.add_argument('--port', type=int, default=8443, help='a local port of the webhook endpoint')
+    parser.add_argument('--limit', type=int, default=100, help='a maximum number of updates in one batch')
+    parser.add_argument('--drain-backlog', action='store_true',
+                        help='merge repeated commands of a chat in a backlog (e.g. after downtime)')
+    parser.add_argument('--inline', action='store_true',
+                        help='answer questions with inline keyboard buttons, which edit one message of a quiz')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='ask the most informative question first instead of the fixed order')
+    parser.add_argument('--stop-threshold', type=float, metavar='SHARE',
+                        help='finish a quiz when the best outcome has this share of all the probabilities')
+    parser.add_argument('--speculate', type=int, default=0, metavar='QUIZZES',
+                        help='calculate all the answers to a question while it is read, '
+                             'for up to this number of quizzes at once in every process')
+    parser.add_argument('--reload', type=float, default=0, metavar='SECONDS',
+                        help='check the knowledge bases every SECONDS and reload the changed ones without a restart')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve metrics on http://127.0.0.1:PORT/metrics (without the worker processes)')
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT)
+    if args.metrics_port:
+        MetricsServer(port=args.metrics_port).start()
+    # Workers in processes are forked, so they get the same settings and the rendered replies
+    Expert.adaptive_questions = args.adaptive
+    Expert.stop_threshold = args.stop_threshold
+    QuizSession.inline_keyboard = args.inline
+    SPECULATOR.max_pending = args.speculate
+    CATALOG_WATCHER.interval = args.reload
+    CATALOG_WATCHER.prepare = render_reloaded_quiz
+    render_replies()
+
+    def create_ingestion(expert_bot: ExpertBotHandler) -> UpdateIngestion:
+        return UpdateIngestion(expert_bot, args.limit, drain_backlog=args.drain_backlog,
+                               mergeable_texts=MERGEABLE_TEXTS)
+
+    if args.use_asyncio:
+        asyncio.get_event_loop().run_until_complete(main_async(create_ingestion=create_ingestion))
+        return
+
     my_token = misc.token
-    expert_bot = ExpertBotHandler(my_token)
-    chat_language_for_user = dict()  # chat_id: language_id
-    current_step_for_user = dict()  # e.g chat_id: {expert_class: expert, current_step: 0}
-    new_offset = None
-
-    while True:
-        expert_bot.get_updates(new_offset)
-        for update in expert_bot.get_updates():
-            last_update_id, last_chat_text, last_chat_id = expert_bot.parse_update_message(update)
-
-            if not last_update_id:
-                # Update response is empty
-                continue
-
-            current_language_id = chat_language_for_user.get(last_chat_id, DEFAULT_LANGUAGE_ID)
-            is_current_user_in_quiz = current_step_for_user.get(last_chat_id, dict()).get(
-                'current_step') or current_step_for_user.get(last_chat_id, dict()).get('current_step') == 0
-
-            if not last_chat_text:
-                # There is no text in this update
-                expert_bot.send_message(last_chat_id, NO_TEXT_MESSAGE[current_language_id])
-
-            elif is_current_user_in_quiz:
-                if last_chat_text in LIST_OF_ANSWERS[current_language_id]:
-                    question_number = current_step_for_user[last_chat_id]['current_step']
-                    expert_system = current_step_for_user[last_chat_id]['expert_class']
-                    number_of_questions = len(expert_system.questions)
-
-                    # Calculate probabilities
-                    answer_id = LIST_OF_ANSWERS[current_language_id].index(last_chat_text)
-                    expert_system.handle_answer(question_number, answer_id)
-
-                    question_number += 1
-
-                    if question_number >= number_of_questions:
-                        # Send results
-                        result = expert_system.get_result()
-                        file_id = result.get('image_id')
-                        if file_id:
-                            expert_bot.send_photo(last_chat_id, file_id, caption='{} {}'.format(
-                                result.get('producer'), result.get('model')))
-                        expert_bot.send_message(
-                            last_chat_id, RESULT_MESSAGE[current_language_id].format(
-                                producer=result.get('producer'), model=result.get('model'),
-                                description=result.get('description')),
-                            reply_markup=expert_bot.remove_keyboards())
-                        del current_step_for_user[last_chat_id]
-                    else:
-                        # Send next question
-                        current_step_for_user[last_chat_id]['current_step'] = question_number
-                        question_text = expert_system.questions[question_number]
-
-                        send_question(expert_bot, last_chat_id, question_text,
-                                      question_number, number_of_questions, current_language_id)
-
-                elif last_chat_text == '/stop':
-                    # Stop this quiz
-                    del current_step_for_user[last_chat_id]
-                    expert_bot.send_message(chat_id=last_chat_id,
-                                            text=DONE_MESSAGE[current_language_id],
-                                            reply_markup=expert_bot.remove_keyboards())
-
-                elif last_chat_text.startswith('/'):
-                    expert_bot.send_message(chat_id=last_chat_id, text=NOT_AVAILABLE_TEXT[current_language_id])
-                    expert_system = current_step_for_user[last_chat_id]['expert_class']
-                    question_number = current_step_for_user[last_chat_id]['current_step']
-                    question_text = expert_system.questions[question_number]
-                    number_of_questions = len(expert_system.questions)
-
-                    send_question(expert_bot, last_chat_id, question_text,
-                                  question_number, number_of_questions, current_language_id)
-
-            elif last_chat_text == '/start':
-                expert_bot.send_message(last_chat_id, START_TEXT[current_language_id],
-                                        reply_markup=expert_bot.remove_keyboards())
-
-            elif last_chat_text == '/menu':
-                keyboard = expert_bot.build_keyboard(list(EQUIPMENTS[current_language_id].keys()))
-                expert_bot.send_message(last_chat_id, MENU_TEXT[current_language_id], reply_markup=keyboard)
-
-            elif last_chat_text == '/help':
-                expert_bot.send_message(
-                    chat_id=last_chat_id, text='\n'.join(HELP_TEXT[current_language_id]),
-                    reply_markup=expert_bot.remove_keyboards())
-
-            elif last_chat_text == '/settings':
-                keyboard = expert_bot.build_keyboard(list(LANGUAGES.keys()))
-                expert_bot.send_message(last_chat_id, SETTINGS_TEXT[current_language_id], reply_markup=keyboard)
-
-            elif last_chat_text in LANGUAGES:
-                chat_language_for_user[last_chat_id] = LANGUAGES.get(last_chat_text, DEFAULT_LANGUAGE_ID)
-                expert_bot.send_message(last_chat_id, DONE_MESSAGE[chat_language_for_user[last_chat_id]],
-                                        reply_markup=expert_bot.remove_keyboards())
-
-            elif last_chat_text in EQUIPMENTS[current_language_id]:
-                chosen_class = EQUIPMENTS[current_language_id][last_chat_text]
-                expert_system = chosen_class()
-                current_step_for_user[last_chat_id] = dict(expert_class=expert_system, current_step=0)
-
-                # Send first question to user
-                number_of_questions = len(expert_system.questions)
-                question_number = 0
-                question_text = expert_system.questions[question_number]
-                send_question(expert_bot, last_chat_id, question_text,
-                              question_number, number_of_questions, current_language_id)
-
-            new_offset = last_update_id + 1
+    if args.webhook:
+        run_webhook(ExpertBotHandler(my_token), args.webhook, args.port, args.workers or 1, args.processes)
+        return
+
+    if args.workers:
+        # This process only polls updates, workers send replies themselves
+        dispatcher = Dispatcher(ChatWorker, args.workers, args.processes)
+        COMPONENT_STATS.add(dispatcher.stats, 'dispatcher', '')
+        try:
+            poll_updates(create_ingestion(ExpertBotHandler(my_token)), dispatcher.submit)
+        finally:
+            COMPONENT_STATS.remove('dispatcher', '')
+            dispatcher.close()
+        return
+
+    scheduler = SendScheduler()
+    expert_bot = ExpertBotHandler(my_token, scheduler=scheduler)
+    storage = create_storage()
+    COMPONENT_STATS.add(scheduler.stats, 'send_queue', '')
+    CATALOG_WATCHER.start()
+    try:
+        poll_updates(create_ingestion(expert_bot), partial(handle_received_message, expert_bot, storage))
+    finally:
+        COMPONENT_STATS.remove('send_queue', '')
+        CATALOG_WATCHER.close()
+        SPECULATOR.close()
+        scheduler.close()
+        storage.close()
+
+
+async def main_async(api_url: str=API_URL, create_ingestion=UpdateIngestion) -> None:
+    """Long polling keeps running while replies to different chats are sent concurrently.
+    Messages of one chat are handled in order, updates are confirmed to Telegram after they are handled
+
+    :param api_url: a template of the Bot API address (e.g. a local server for testing)
+    :param create_ingestion: a function which creates an UpdateIngestion for the bot
+    """
+    from bot.async_expert_bot import AsyncExpertBotHandler, ChatQueues, Outbox
+
+    expert_bot = AsyncExpertBotHandler(misc.token, api_url)
+    storage = create_storage()
+
+    async def reply(chat_id: int, message: tuple) -> None:
+        text, received_at = message
+        outbox = Outbox()
+        handle_message(outbox, storage, chat_id, text)
+        await outbox.send(expert_bot)
+        UPDATE_SECONDS.observe(time.monotonic() - received_at)
+
+    chat_queues = ChatQueues(reply)
+    ingestion = create_ingestion(expert_bot)
+    COMPONENT_STATS.add(expert_bot.stats, 'send_queue', '')
+    CATALOG_WATCHER.start()
+    try:
+        while True:
+            previous_update_id = ingestion.last_update_id
+            updates = await expert_bot.get_updates(ingestion.offset, ingestion.timeout, ingestion.limit)
+            for last_update_id, last_chat_id, last_chat_text in ingestion.prepare(updates):
+                chat_queues.put(last_chat_id, (last_chat_text, ingestion.received_at), last_update_id)
+            if updates and ingestion.last_update_id == previous_update_id:
+                # Only the updates which are still being handled are delivered again, so wait for them
+                await chat_queues.wait_handled(timeout=1)
+            if ingestion.last_update_id is not None:
+                # Updates are confirmed only when they and all the previous ones are handled
+                ingestion.acknowledge(chat_queues.get_handled_update_id(ingestion.last_update_id))
+    finally:
+        await chat_queues.join()
+        COMPONENT_STATS.remove('send_queue', '')
+        await expert_bot.close()
+        CATALOG_WATCHER.close()
+        SPECULATOR.close()
+        storage.close()
+
+
+def run_webhook(expert_bot: ExpertBotHandler, url: str, port: int, workers: int, use_processes: bool) -> None:
+    """Receive updates on a local HTTP endpoint and pass them to the workers.
+    Updates are postponed (Telegram retries them) while the workers are busy
+    """
+    secret_token = getattr(misc, 'webhook_secret', None) or secrets.token_urlsafe(32)
+    dispatcher = Dispatcher(ChatWorker, workers, use_processes)
+    COMPONENT_STATS.add(dispatcher.stats, 'dispatcher', '')
+    server = WebhookServer(partial(dispatcher.submit, timeout=1), secret_token, port=port)
+    expert_bot.set_webhook(url, secret_token)
+    try:
+        server.serve_forever()
+    finally:
+        expert_bot.delete_webhook()
+        server.server_close()
+        COMPONENT_STATS.remove('dispatcher', '')
+        dispatcher.close()
+
+
+def poll_updates(ingestion: UpdateIngestion, handle) -> None:
+    """Get updates from the Bot API and pass their messages to the handler
+
+    :param ingestion: an ingestion stage of the bot
+    :param handle: a function handle(chat_id, (text, received_at))
+    """
+    for last_update_id, last_chat_id, last_chat_text in ingestion.updates():
+        handle(last_chat_id, (last_chat_text, ingestion.received_at))
 
 
 if __name__ == '__main__':
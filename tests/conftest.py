@@ -0,0 +1,43 @@
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+try:
+    import misc  # noqa: F401
+except ImportError:
+    # misc.py with the token of the bot is created by the user (look at README.md)
+    sys.modules['misc'] = types.SimpleNamespace(token='TEST_TOKEN')
+
+from bot import MemoryStorage  # noqa: E402
+
+
+class RecordingBot:
+    """Records the requests of handle_message instead of sending them to the Bot API
+    """
+
+    def __init__(self):
+        self.requests = []  # (chat_id, (method, body), message_id)
+
+    def send_payload(self, chat_id: int, payload: tuple, message_id: int=None) -> None:
+        self.requests.append((chat_id, payload, message_id))
+
+    def answer_callback_query(self, chat_id: int, callback_query_id: str) -> None:
+        self.requests.append((chat_id, ('answerCallbackQuery', callback_query_id), None))
+
+    @property
+    def methods(self) -> list:
+        return [method for chat_id, (method, body), message_id in self.requests]
+
+
+@pytest.fixture
+def bot():
+    return RecordingBot()
+
+
+@pytest.fixture
+def storage():
+    return MemoryStorage()
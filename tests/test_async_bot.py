@@ -0,0 +1,164 @@
+import asyncio
+import functools
+import time
+from collections import defaultdict
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+import misc  # noqa: E402
+import run_bot  # noqa: E402
+from bot import async_expert_bot  # noqa: E402
+from bot.expert_bot import encode_chat_id  # noqa: E402
+
+NUMBER_OF_CHATS = 50
+NUMBER_OF_ANSWERS = 6
+LANGUAGE = '🇺🇸US'
+
+
+class FakeBotAPI:
+    """A local Bot API server: getUpdates returns the updates which are not confirmed yet,
+    other methods record their requests and answer after a short delay.
+    Requests to the held chat wait until release is set and then fail
+    """
+
+    def __init__(self, updates: list, held_chat_id: int=None):
+        self.updates = updates
+        self.confirmed = 0
+        self.number_of_polls = 0
+        self.requests = []  # (method, body)
+        self.held_chat_id = held_chat_id
+        self.release = None  # asyncio.Event, it is created in the event loop of the test
+
+    async def get_updates(self, request: web.Request) -> web.Response:
+        self.number_of_polls += 1
+        offset = int(request.query.get('offset', 0))
+        self.confirmed = max(self.confirmed, offset)
+        pending = [update for update in self.updates if update['update_id'] >= self.confirmed]
+        if not pending:
+            await asyncio.sleep(0.05)
+        return web.json_response({'ok': True, 'result': pending[:int(request.query.get('limit', 100))]})
+
+    async def post(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if self.held_chat_id is not None and body.startswith(encode_chat_id(self.held_chat_id)):
+            await self.release.wait()
+            return web.Response(status=500, text='Internal Server Error')
+        # Replies to different chats overtake each other
+        await asyncio.sleep(0.01 * (len(self.requests) % 3))
+        self.requests.append((request.match_info['method'], body))
+        return web.json_response({'ok': True, 'result': {'message_id': len(self.requests)}})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(f'/bot{misc.token}/getUpdates', self.get_updates)
+        app.router.add_post(f'/bot{misc.token}/{{method}}', self.post)
+        return app
+
+
+async def wait_for(condition, timeout: float=30) -> None:
+    started = time.monotonic()
+    while not condition() and time.monotonic() - started < timeout:
+        await asyncio.sleep(0.05)
+
+
+def run_bot_with(fake_api: FakeBotAPI, check) -> None:
+    """Run main_async against the fake Bot API until the coroutine check(task) returns
+    """
+    async def run() -> None:
+        fake_api.release = asyncio.Event()
+        server = TestServer(fake_api.create_app())
+        await server.start_server()
+        task = asyncio.ensure_future(run_bot.main_async(f'http://{server.host}:{server.port}/bot{{}}/'))
+        try:
+            await check(task)
+        finally:
+            fake_api.release.set()
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            await server.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def no_rate_limits(monkeypatch):
+    # Telegram limits are not needed for a local server
+    monkeypatch.setattr(async_expert_bot, 'RateLimiter', functools.partial(
+        async_expert_bot.RateLimiter, global_rate=10000, chat_rate=10000))
+
+
+def create_script() -> dict:
+    """
+    :return: {chat_id: texts}, every chat changes the language and answers a quiz in its own way
+    """
+    answers = run_bot.LIST_OF_ANSWERS[run_bot.LANGUAGES[LANGUAGE]]
+    microphone = next(name for name, expert_class in run_bot.EQUIPMENTS[run_bot.LANGUAGES[LANGUAGE]].items()
+                      if expert_class is run_bot.Microphone)
+    return {chat_id: ['/settings', LANGUAGE, '/menu', microphone] +
+            [answers[(chat_id + answer_number) % len(answers)] for answer_number in range(NUMBER_OF_ANSWERS)]
+            for chat_id in range(1, NUMBER_OF_CHATS + 1)}
+
+
+def test_interleaved_quizzes(no_rate_limits, bot, storage):
+    script = create_script()
+    # Messages of all the chats are interleaved
+    messages = [(chat_id, texts[message_number]) for message_number in range(len(script[1]))
+                for chat_id, texts in script.items()]
+    updates = [{'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'text': text}}
+               for update_id, (chat_id, text) in enumerate(messages, 1)]
+
+    # The replies of every chat are the same as the replies of the synchronous bot
+    for chat_id, text in messages:
+        run_bot.handle_message(bot, storage, chat_id, text)
+    expected = defaultdict(list)
+    for chat_id, (method, body), message_id in bot.requests:
+        expected[chat_id].append((method, encode_chat_id(chat_id) + body))
+
+    fake_api = FakeBotAPI(updates)
+
+    async def check(task: asyncio.Task) -> None:
+        await wait_for(lambda: len(fake_api.requests) >= len(bot.requests) or task.done())
+        await wait_for(lambda: fake_api.confirmed > len(updates), timeout=5)
+
+    run_bot_with(fake_api, check)
+
+    assert fake_api.confirmed == len(updates) + 1
+    sent = defaultdict(list)
+    for method, body in fake_api.requests:
+        chat_id = int(body.split(b'&', 1)[0].split(b'=')[1])
+        sent[chat_id].append((method, body))
+    assert sent == expected
+
+
+def test_updates_are_confirmed_after_they_are_handled(no_rate_limits):
+    # The reply to the first update hangs (as if the process has crashed there) and then fails
+    updates = [{'update_id': update_id, 'message': {'chat': {'id': update_id}, 'text': '/start'}}
+               for update_id in range(1, 6)]
+    fake_api = FakeBotAPI(updates, held_chat_id=1)
+
+    async def check(task: asyncio.Task) -> None:
+        await wait_for(lambda: len(fake_api.requests) == len(updates) - 1 or task.done())
+        number_of_polls = fake_api.number_of_polls
+        await wait_for(lambda: fake_api.number_of_polls >= number_of_polls + 2 or task.done(), timeout=10)
+        assert not task.done()
+        assert len(fake_api.requests) == len(updates) - 1
+        # The handled updates after the first one are not confirmed, Telegram delivers them again after a restart
+        assert fake_api.confirmed <= 1
+
+        fake_api.release.set()
+        # A failed update is handled too, it would fail the same way again
+        await wait_for(lambda: fake_api.confirmed > len(updates), timeout=10)
+        assert fake_api.confirmed == len(updates) + 1
+
+    run_bot_with(fake_api, check)
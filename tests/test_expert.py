@@ -0,0 +1,76 @@
+import gc
+import random
+import weakref
+from decimal import Decimal
+
+import pytest
+
+from experts import EXPERTS, Microphone
+from experts.base import PROBABILITY_MODE, UNANSWERED
+from experts.catalog import Catalog
+
+NUMBER_OF_QUIZZES = 20
+# The largest absolute difference of a posteriori probabilities from the Decimal formulas
+TOLERANCE = 1e-12
+
+
+def calculate_reference(expert, p: Decimal, p_y: Decimal, p_n: Decimal, rate: int) -> Decimal:
+    """The scalar formulas of the Decimal implementation for one outcome
+    """
+    if rate == 0:
+        return ((1 - p_y) * p) / ((1 - p_y) * p + (1 - p_n) * (1 - p))
+    if rate == 1:
+        return p + (p - ((1 - p_y) * p) / ((1 - p_y) * p + (1 - p_n) *
+                                           (1 - p))) * expert.probably_no_rate / expert.rate_gradation
+    if rate == 2:
+        return p
+    if rate == 3:
+        return p + ((p_y * p) / (p_y * p + p_n * (1 - p)) - p) * expert.probably_rate / expert.rate_gradation
+    return (p_y * p) / (p_y * p + p_n * (1 - p))
+
+
+def replay_quiz(expert, rng: random.Random) -> float:
+    """Answer all the questions in a random order with random rates
+    and compare every step with the Decimal formulas
+
+    :return: the largest absolute difference
+    """
+    catalog = expert.catalog
+    reference = [Decimal(prior) for prior in catalog.priors.tolist()]
+    question_numbers = list(range(len(catalog.questions)))
+    rng.shuffle(question_numbers)
+    largest_difference = 0.0
+    for question_number in question_numbers:
+        rate = rng.randrange(5)
+        expert.handle_answer(question_number, rate)
+        reference = [calculate_reference(expert, p, Decimal(p_y), Decimal(p_n), rate) for p, p_y, p_n in
+                     zip(reference, catalog.presence[:, question_number].tolist(),
+                         catalog.absence[:, question_number].tolist())]
+        largest_difference = max(largest_difference, max(abs(float(expected) - posterior) for expected, posterior
+                                                         in zip(reference, expert.posteriors.tolist())))
+        assert expert.get_result_number() == max(range(len(reference)), key=reference.__getitem__)
+    return largest_difference
+
+
+@pytest.mark.parametrize('expert_class', EXPERTS, ids=lambda expert_class: expert_class.__name__)
+def test_answers_same_as_decimal_formulas(expert_class, monkeypatch):
+    monkeypatch.setattr(expert_class, 'posterior_mode', PROBABILITY_MODE)
+    rng = random.Random(expert_class.__name__)
+    for _ in range(NUMBER_OF_QUIZZES):
+        assert replay_quiz(expert_class(), rng) < TOLERANCE
+
+
+
+def test_posterior_cache_does_not_keep_replaced_catalogs():
+    catalog = Microphone.get_catalog()
+    # A reloaded knowledge base with the same data
+    reloaded_catalog = Catalog(catalog.name, catalog.questions, [dict(outcome) for outcome in catalog.outcomes],
+                               catalog.priors, catalog.presence, catalog.absence)
+    expert = Microphone(reloaded_catalog)
+    expert.handle_answers(bytes([4, 0] + [UNANSWERED] * (len(catalog.questions) - 2)))
+    assert Microphone.posterior_cache.get(expert._get_cache_key(expert.answers)) is not None
+
+    reference = weakref.ref(reloaded_catalog)
+    del expert, reloaded_catalog
+    gc.collect()
+    assert reference() is None
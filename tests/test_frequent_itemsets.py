@@ -0,0 +1,129 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+from apriori import ALGORITHMS, Apriori
+from apriori.__main__ import main
+from benchmarks.frequent_itemsets import write_transactions
+
+SOME_EX = Path(__file__).resolve().parent.parent / 'apriori' / 'some_ex.txt'
+MIN_SUPPORT = 0.25
+MIN_CONFIDENCE = 0.7
+
+
+def create_miner(algorithm, filename, min_support, tmp_path, num_baskets=-1):
+    options = {'sharded': {'processes': 1},
+               'incremental': {'state_filename': str(tmp_path / 'state.json')}}.get(algorithm, {})
+    return ALGORITHMS[algorithm](str(filename), min_support, num_baskets, **options)
+
+
+def normalize(levels):
+    """
+    Post-conditions:
+        the non-empty levels of k-tuples as sorted lists of sorted items
+    """
+    return [sorted(sorted(itemset) for itemset in lk) for lk in levels if lk]
+
+
+def get_frequent_supports(miner, min_support):
+    # Apriori and the incremental Apriori keep supports of the counted infrequent candidates too
+    return {itemset: support for itemset, support in miner.frequentItemsSupport.items() if support >= min_support}
+
+
+@pytest.fixture
+def some_ex(tmp_path):
+    # A copy, so no state files are written next to the example
+    return Path(shutil.copy(str(SOME_EX), str(tmp_path / SOME_EX.name)))
+
+
+@pytest.fixture
+def synthetic(tmp_path):
+    path = tmp_path / 'transactions.txt'
+    write_transactions(str(path), 300, number_of_items=12, seed=1)
+    return path
+
+
+@pytest.mark.parametrize('algorithm', [algorithm for algorithm in sorted(ALGORITHMS) if algorithm != 'apriori'] +
+                         ['vertical'])
+@pytest.mark.parametrize('transactions, min_support, num_baskets', [
+    ('some_ex', MIN_SUPPORT, -1),
+    ('some_ex', 0.1, -1),
+    ('some_ex', MIN_SUPPORT, 5),
+    ('synthetic', 0.1, -1),
+    ('synthetic', 0.03, -1),
+    ('synthetic', 0.05, 100),
+])
+def test_same_as_apriori(algorithm, transactions, min_support, num_baskets, tmp_path, request):
+    filename = request.getfixturevalue(transactions)
+    expected = Apriori(str(filename), min_support, num_baskets)
+    expected.run()
+
+    if algorithm == 'vertical':
+        miner = Apriori(str(filename), min_support, num_baskets, vertical=True)
+    else:
+        miner = create_miner(algorithm, filename, min_support, tmp_path, num_baskets)
+    miner.run()
+
+    assert len(normalize(expected.frequentItems)) > 1
+    assert normalize(miner.frequentItems) == normalize(expected.frequentItems)
+    assert get_frequent_supports(miner, min_support) == get_frequent_supports(expected, min_support)
+    assert normalize(miner.results) == normalize(expected.results)
+
+
+@pytest.mark.parametrize('algorithm', sorted(ALGORITHMS))
+def test_no_frequent_items(algorithm, some_ex, tmp_path):
+    miner = create_miner(algorithm, some_ex, 1.5, tmp_path)
+    miner.run()
+
+    assert miner.frequentItems == [[]]
+    assert miner.results == []
+    assert miner.association_rules(MIN_CONFIDENCE) == []
+
+
+def test_incremental_update_same_as_apriori(synthetic, tmp_path):
+    with open(str(synthetic)) as transaction_file:
+        lines = transaction_file.readlines()
+    log = tmp_path / 'log.txt'
+    log.write_text(''.join(lines[:250]))
+    create_miner('incremental', log, 0.05, tmp_path).run()
+    with open(str(log), 'a') as log_file:
+        log_file.writelines(lines[250:])
+
+    miner = create_miner('incremental', log, 0.05, tmp_path)
+    miner.run()
+    expected = Apriori(str(synthetic), 0.05, -1)
+    expected.run()
+
+    assert normalize(miner.frequentItems) == normalize(expected.frequentItems)
+    assert get_frequent_supports(miner, 0.05) == pytest.approx(get_frequent_supports(expected, 0.05))
+
+
+@pytest.mark.parametrize('algorithm', sorted(ALGORITHMS))
+def test_association_rules_after_levels(algorithm, some_ex, tmp_path):
+    expected = Apriori(str(some_ex), MIN_SUPPORT, -1)
+    expected.run()
+    expected_rules = expected.association_rules(MIN_CONFIDENCE)
+
+    # The same way as python -m apriori --confidence gets them
+    miner = create_miner(algorithm, some_ex, MIN_SUPPORT, tmp_path)
+    for _ in miner.levels():
+        pass
+    rules = miner.association_rules(MIN_CONFIDENCE)
+
+    assert len(expected_rules) == 3
+    assert [rule[:2] for rule in rules] == [rule[:2] for rule in expected_rules]
+    assert [rule[2:] for rule in rules] == pytest.approx([rule[2:] for rule in expected_rules])
+
+
+def test_vertical_option(some_ex, monkeypatch, capsys):
+    outputs = []
+    for options in ([], ['--vertical']):
+        monkeypatch.setattr(sys, 'argv', ['apriori', str(some_ex), '--confidence', str(MIN_CONFIDENCE)] + options)
+        main()
+        # Itemsets of a level are printed in the order they are found
+        outputs.append(sorted(capsys.readouterr().out.splitlines()))
+
+    assert 'Association Rules:' in outputs[0]
+    assert outputs[1] == outputs[0]
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+import requests
+
+import run_bot
+from metrics import MetricsServer, Registry, StatsCollector
+
+
+def test_stats_are_read_at_every_scrape():
+    registry = Registry()
+    collector = StatsCollector('component_stats', 'Numbers of the components', ('component', ), registry=registry)
+    depths = [3]
+
+    def fail() -> dict:
+        raise RuntimeError('closed')
+
+    collector.add(lambda: dict(queue_depth=depths[0]), 'queue')
+    collector.add(lambda: dict(queue_sizes=[1, 2]), 'dispatcher')
+    collector.add(fail, 'broken')
+    depths[0] = 5
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP component_stats Numbers of the components', '# TYPE component_stats gauge']
+    # A failed source is skipped, the others are still served
+    assert lines[2:] == ['component_stats{component="queue",stat="queue_depth"} 5.0',
+                         'component_stats{component="dispatcher",stat="queue_sizes_0"} 1.0',
+                         'component_stats{component="dispatcher",stat="queue_sizes_1"} 2.0']
+
+    collector.remove('queue')
+    collector.remove('broken')
+    assert 'queue_depth' not in registry.render()
+    with pytest.raises(ValueError):
+        collector.add(lambda: dict(), 'queue', 'extra')
+
+
+@pytest.fixture
+def metrics_url():
+    server = MetricsServer(port=0)
+    threading.Thread(target=server.serve_forever, args=(0.05, ), daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/metrics'
+    server.shutdown()
+    server.server_close()
+
+
+def test_stats_of_the_bot_are_served(metrics_url):
+    worker = run_bot.ChatWorker(0, 1)
+    try:
+        text = requests.get(metrics_url, timeout=5).text
+    finally:
+        worker.close()
+
+    assert 'bot_component_stats{component="send_queue",worker="0",stat="queue_depth"} 0.0' in text
+    assert 'bot_component_stats{component="posterior_cache",worker="",stat="hits"}' in text
+    assert 'bot_component_stats{component="posterior_cache",worker="",stat="misses"}' in text
+    assert 'bot_component_stats{component="speculator",worker="",stat="pending"}' in text
+    # The stats of a closed worker are not served anymore
+    assert 'component="send_queue"' not in requests.get(metrics_url, timeout=5).text
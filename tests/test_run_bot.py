@@ -0,0 +1,112 @@
+import gc
+import json
+from urllib.parse import parse_qs
+
+import pytest
+
+import run_bot
+from bot import QuizSession
+from bot.expert_bot import CallbackQuery
+from experts import Microphone, Software
+from experts.base import Expert
+from experts.catalog import Catalog
+
+
+def test_quiz_decided_by_priors_sends_result(monkeypatch, bot, storage):
+    # Software has a single outcome, so it is decided before the first question
+    monkeypatch.setattr(Expert, 'stop_threshold', 0.6)
+    language_id = run_bot.DEFAULT_LANGUAGE_ID
+    software_button = next(name for name, expert_class in run_bot.EQUIPMENTS[language_id].items()
+                           if expert_class is Software)
+
+    run_bot.handle_message(bot, storage, 1, software_button)
+
+    expert_id = run_bot.EXPERTS.index(Software)
+    replies = run_bot.render_quiz(expert_id, Software.get_catalog())
+    assert storage.get_session(1) is None
+    assert bot.requests[-1] == (1, replies[('result', expert_id, 0, language_id)], None)
+
+
+@pytest.mark.parametrize('data', ['0 7', '0 255', '0 -1'])
+def test_callback_answer_out_of_range_is_ignored(bot, storage, data):
+    language_id = run_bot.DEFAULT_LANGUAGE_ID
+    button, expert_class = next(iter(run_bot.EQUIPMENTS[language_id].items()))
+    run_bot.handle_message(bot, storage, 1, button)
+    quiz_session = storage.get_session(1)
+    answers = bytes(quiz_session.answers)
+
+    run_bot.handle_message(bot, storage, 1, CallbackQuery(data, 'query', 2))
+
+    assert storage.get_session(1) is quiz_session
+    assert quiz_session.current_step == 0
+    assert bytes(quiz_session.answers) == answers
+    assert bot.methods[-1] == 'answerCallbackQuery'
+
+
+def test_quiz_replies_are_kept_per_knowledge_base():
+    expert_id = run_bot.EXPERTS.index(Software)
+    catalog = Software.get_catalog()
+    replies = run_bot.render_quiz(expert_id, catalog)
+    # Reloads of every expert do not evict the replies of a knowledge base which is still used
+    reloaded_catalogs = [Catalog(catalog.name, catalog.questions, [dict(outcome) for outcome in catalog.outcomes],
+                                 catalog.priors, catalog.presence, catalog.absence)
+                         for _ in range(2 * len(run_bot.EXPERTS) + 1)]
+    for reloaded_catalog in reloaded_catalogs:
+        assert run_bot.render_quiz(expert_id, reloaded_catalog) is not replies
+    assert run_bot.render_quiz(expert_id, catalog) is replies
+
+    # Replies of an unused knowledge base are dropped together with it
+    number_of_catalogs = len(run_bot.QUIZ_REPLIES)
+    del reloaded_catalog, reloaded_catalogs
+    gc.collect()
+    assert len(run_bot.QUIZ_REPLIES) == number_of_catalogs - 2 * len(run_bot.EXPERTS) - 1
+
+
+@pytest.mark.parametrize('adaptive_questions', [False, True])
+def test_questions_are_rendered_at_the_steps_they_are_asked(monkeypatch, bot, storage, adaptive_questions):
+    monkeypatch.setattr(Expert, 'adaptive_questions', adaptive_questions)
+    language_id = run_bot.DEFAULT_LANGUAGE_ID
+    microphone_button = next(name for name, expert_class in run_bot.EQUIPMENTS[language_id].items()
+                             if expert_class is Microphone)
+    expert_id = run_bot.EXPERTS.index(Microphone)
+    catalog = Microphone.get_catalog()
+    replies = run_bot.render_quiz(expert_id, catalog)
+
+    # Questions are asked in order, unless the adaptive mode chooses them
+    number_of_questions = len(catalog.questions)
+    question_keys = [key for key in replies.payloads if key[0] == 'question']
+    assert len(question_keys) == len(run_bot.LIST_OF_ANSWERS) * number_of_questions ** (1 + adaptive_questions)
+
+    run_bot.handle_message(bot, storage, 1, microphone_button)
+    answers = run_bot.LIST_OF_ANSWERS[language_id]
+    for answer_number in range(number_of_questions):
+        if storage.get_session(1) is None:
+            break
+        run_bot.handle_message(bot, storage, 1, answers[answer_number % len(answers)])
+    assert storage.get_session(1) is None
+    assert run_bot.render_quiz(expert_id, catalog) is replies
+
+@pytest.fixture
+def inline_keyboard(monkeypatch):
+    # Inline replies are rendered only in the inline keyboard mode
+    monkeypatch.setattr(QuizSession, 'inline_keyboard', True)
+    run_bot.QUIZ_REPLIES.clear()
+    yield
+    run_bot.QUIZ_REPLIES.clear()
+
+
+def test_inline_photo_result_removes_keyboard_of_last_question(inline_keyboard, bot, storage):
+    language_id = run_bot.DEFAULT_LANGUAGE_ID
+    button = next(name for name, expert_class in run_bot.EQUIPMENTS[language_id].items()
+                  if expert_class is Microphone)
+    run_bot.handle_message(bot, storage, 1, button)
+    message_id = 10
+    while storage.get_session(1) is not None:
+        quiz_session = storage.get_session(1)
+        run_bot.handle_message(bot, storage, 1, CallbackQuery(f'{quiz_session.current_step} 4', 'query', message_id))
+
+    assert bot.requests[-2] == (1, run_bot.render_replies()[('remove_inline_keyboard', )], message_id)
+    method, body = bot.requests[-2][1]
+    assert method == 'editMessageReplyMarkup'
+    assert json.loads(parse_qs(body.decode())['reply_markup'][0]) == {'inline_keyboard': []}
+    assert bot.methods[-1] == 'sendPhoto'
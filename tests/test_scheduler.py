@@ -0,0 +1,101 @@
+import json
+import logging
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from bot.expert_bot import ExpertBotHandler
+from bot.scheduler import CHAT_BURST, RateLimiter, SendScheduler
+
+NUMBER_OF_TAPS = 6
+
+
+@pytest.fixture
+def frozen_time(monkeypatch):
+    # All the taps come at the same moment
+    monkeypatch.setattr(time, 'monotonic', lambda: 1000.0)
+
+
+def test_callback_answers_do_not_delay_edits(frozen_time):
+    limiter = RateLimiter()
+    edit_delays = []
+    for _ in range(NUMBER_OF_TAPS):
+        limiter.reserve(1, chat_limited=False)
+        edit_delays.append(limiter.reserve(1))
+
+    reply_limiter = RateLimiter()
+    reply_delays = [reply_limiter.reserve(1) for _ in range(NUMBER_OF_TAPS)]
+    assert edit_delays == reply_delays == pytest.approx([0] * CHAT_BURST + [1, 2, 3])
+
+
+def test_callback_answers_are_globally_limited(frozen_time):
+    limiter = RateLimiter(global_rate=2)
+    delays = [limiter.reserve(chat_id, chat_limited=False) for chat_id in range(4)]
+    assert delays == pytest.approx([0, 0, 0.5, 1])
+
+
+class RecordingSession:
+    """Answers every request at once and records its method and time
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, http_method: str, url: str, **kwargs) -> SimpleNamespace:
+        self.requests.append((url.rsplit('/', 1)[1], time.monotonic()))
+        return SimpleNamespace(status_code=200, json=lambda: {'ok': True})
+
+
+def test_scheduler_sends_edits_after_callback_answers_without_delay():
+    scheduler = SendScheduler()
+    expert_bot = ExpertBotHandler('TOKEN', scheduler=scheduler)
+    expert_bot.session = RecordingSession()
+    started = time.monotonic()
+    try:
+        futures = []
+        for tap in range(CHAT_BURST):
+            futures.append(expert_bot.answer_callback_query(1, str(tap)))
+            futures.append(expert_bot.edit_message_text(1, 1, f'Question {tap}'))
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        scheduler.close()
+
+    # The edits fit into the burst of the chat, as the replies of the reply keyboard mode do
+    assert [method for method, sent_at in expert_bot.session.requests] == \
+        ['answerCallbackQuery', 'editMessageText'] * CHAT_BURST
+    assert max(sent_at for method, sent_at in expert_bot.session.requests) - started < 0.5
+
+
+def create_response(status_code: int, result: dict) -> SimpleNamespace:
+    return SimpleNamespace(status_code=status_code, json=lambda: result, text=json.dumps(result))
+
+
+def test_failed_deliveries_are_logged(caplog):
+    def fail():
+        raise requests.ConnectionError('Connection refused')
+
+    def block():
+        return create_response(403, {'ok': False, 'description': 'Forbidden: bot was blocked by the user'})
+
+    def limit():
+        return create_response(429, {'ok': False, 'parameters': {'retry_after': 0.01}})
+
+    scheduler = SendScheduler(RateLimiter(global_rate=1000, chat_rate=1000), max_retries=2)
+    try:
+        futures = [scheduler.submit(1, fail, method='sendMessage'), scheduler.submit(2, block, method='sendPhoto'),
+                   scheduler.submit(3, limit, method='editMessageText')]
+        for future in futures:
+            future.exception(timeout=5)
+    finally:
+        scheduler.close()
+
+    errors = [record for record in caplog.records if record.levelno >= logging.WARNING]
+    assert 'Can not send sendMessage to the chat 1' in caplog.text
+    assert 'Connection refused' in caplog.text
+    assert 'Can not send sendPhoto to the chat 2: 403' in caplog.text
+    assert 'Can not send editMessageText to the chat 3: 429' in caplog.text and 'after 2 retries' in caplog.text
+    assert sum(record.levelno == logging.ERROR for record in errors) == 1
+    assert scheduler.stats()['failed'] == 3
@@ -0,0 +1,139 @@
+import functools
+import queue
+import threading
+
+import pytest
+import requests
+
+from bot import Dispatcher, WebhookServer
+from bot.webhook import SECRET_TOKEN_HEADER
+
+SECRET_TOKEN = 'secret'
+PATH = '/webhook'
+
+
+def create_update(update_id: int, chat_id: int=1, text: str='/start') -> dict:
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'text': text}}
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(handle) -> str:
+        server = WebhookServer(handle, SECRET_TOKEN, host='127.0.0.1', port=0, path=PATH)
+        threading.Thread(target=server.serve_forever, args=(0.05, ), daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}{PATH}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post(url: str, secret_token: str=SECRET_TOKEN, **kwargs) -> requests.Response:
+    return requests.post(url, headers={SECRET_TOKEN_HEADER: secret_token}, timeout=5, **kwargs)
+
+
+def test_message_is_handled(start_server):
+    handled = []
+    url = start_server(lambda chat_id, message: handled.append((chat_id, message)))
+
+    assert post(url, json=create_update(1, chat_id=7, text='/menu')).status_code == 200
+    assert [(chat_id, text) for chat_id, (text, received_at) in handled] == [(7, '/menu')]
+
+
+@pytest.mark.parametrize('secret_token', ['', 'wrong', SECRET_TOKEN + 'x'])
+def test_wrong_secret_token(start_server, secret_token):
+    handled = []
+    url = start_server(lambda chat_id, message: handled.append(chat_id))
+
+    assert post(url, secret_token, json=create_update(1)).status_code == 403
+    assert not handled
+
+
+@pytest.mark.parametrize('body', [b'{', b'\xff', b'[1, '])
+def test_malformed_update(start_server, body):
+    handled = []
+    url = start_server(lambda chat_id, message: handled.append(chat_id))
+
+    assert post(url, data=body).status_code == 400
+    assert not handled
+
+
+def test_other_updates_are_skipped(start_server):
+    handled = []
+    url = start_server(lambda chat_id, message: handled.append(chat_id))
+
+    # Telegram must not deliver them again
+    assert post(url, json={'update_id': 1, 'edited_message': {}}).status_code == 200
+    assert post(url.replace(PATH, '/other'), json=create_update(2)).status_code == 404
+    assert not handled
+
+
+def test_duplicate_updates_are_skipped(start_server):
+    postponed = []
+    handled = []
+
+    def handle(chat_id, message):
+        # The workers are busy only once
+        if not postponed:
+            postponed.append(message[0])
+            raise queue.Full
+        handled.append(message[0])
+    url = start_server(handle)
+
+    # A postponed update is handled when it is delivered again, a handled one is skipped
+    statuses = [post(url, json=create_update(update_id, text=str(update_id))).status_code
+                for update_id in (1, 1, 1, 2, 1)]
+    assert statuses == [503, 200, 200, 200, 200]
+    assert handled == ['1', '2']
+
+def test_busy_workers_postpone_updates(start_server):
+    def handle(chat_id, message):
+        raise queue.Full
+    url = start_server(handle)
+
+    response = post(url, json=create_update(1))
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+class BlockedWorker:
+    """Handles messages only after the test releases it
+    """
+
+    released = threading.Event()
+    handled = []
+
+    def __init__(self, worker_number: int, number_of_workers: int):
+        pass
+
+    def handle(self, chat_id: int, message: tuple) -> None:
+        self.released.wait()
+        self.handled.append(message[0])
+
+    def close(self) -> None:
+        pass
+
+
+def test_dispatcher_backpressure(start_server):
+    dispatcher = Dispatcher(BlockedWorker, workers=1, queue_size=2)
+    url = start_server(functools.partial(dispatcher.submit, timeout=0.01))
+    try:
+        accepted = []
+        for update_id in range(10):
+            status_code = post(url, json=create_update(update_id, text=str(update_id))).status_code
+            assert status_code in (200, 503)
+            if status_code == 503:
+                break
+            accepted.append(str(update_id))
+        else:
+            pytest.fail('The queue of the busy worker has accepted all the updates')
+    finally:
+        BlockedWorker.released.set()
+        dispatcher.close()
+
+    # The postponed update is delivered again by Telegram, the accepted ones are handled in order
+    assert BlockedWorker.handled == accepted